@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""
+benchmark_myersdiff.py [sizes...]
+
+Compares MyersDiffer against CompactMyersDiffer on generated files of the
+given numbers of lines, and checks that both produce the same opcodes.
+"""
+
+import os
+import random
+import sys
+import time
+
+topdir = os.path.join(os.path.dirname(__file__), "..", "..")
+sys.path.insert(0, topdir)
+
+from reviewboard.diffviewer import myersdiff
+from reviewboard.diffviewer.myersdiff import MyersDiffer, CompactMyersDiffer
+
+
+def generate_files(num_lines, lines_per_edit):
+    """Generates a file and a modified copy of it.
+
+    The files look somewhat like generated code, with lots of repeated lines
+    and an edit every lines_per_edit lines on average.
+    """
+    orig = ['    field_%d = %d;\n' % (random.randint(0, num_lines / 4), i % 7)
+            for i in xrange(num_lines)]
+    new = list(orig)
+
+    for i in xrange(max(1, num_lines / lines_per_edit)):
+        pos = random.randint(0, len(new))
+        count = random.randint(1, 20)
+
+        if random.random() < 0.5:
+            new[pos:pos] = ['    added_%d = %d;\n' % (pos, j)
+                            for j in xrange(count)]
+        else:
+            del new[pos:pos + count]
+
+    return orig, new
+
+
+def time_differ(differ_cls, orig, new):
+    start = time.time()
+    opcodes = list(differ_cls(orig, new).get_opcodes())
+
+    return time.time() - start, opcodes
+
+
+def main():
+    if len(sys.argv) > 1:
+        sizes = [int(size) for size in sys.argv[1:]]
+    else:
+        sizes = [1000, 5000, 20000, 50000, 100000]
+
+    random.seed(0)
+
+    if myersdiff.numpy is None:
+        print "NumPy is not installed. Snakes will be followed in Python."
+
+    print "%10s %10s %12s %12s %8s" % ("Lines", "Lines/edit", "MyersDiffer",
+                                       "Compact", "Speedup")
+
+    for size in sizes:
+        for lines_per_edit in (500, 50):
+            orig, new = generate_files(size, lines_per_edit)
+            old_time, old_opcodes = time_differ(MyersDiffer, orig, new)
+            new_time, new_opcodes = time_differ(CompactMyersDiffer, orig, new)
+
+            if old_opcodes != new_opcodes:
+                print "Opcodes differ for %d lines" % size
+                sys.exit(1)
+
+            print "%10d %10d %11.3fs %11.3fs %7.1fx" % \
+                  (size, lines_per_edit, old_time, new_time,
+                   old_time / new_time)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""
+benchmark_patch.py [iterations]
+
+Compares the in-process patcher against running `patch` on the diffviewer
+test data, and checks that both produce the same results.
+"""
+
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+topdir = os.path.join(os.path.dirname(__file__), "..", "..")
+sys.path.insert(0, topdir)
+
+from reviewboard.diffviewer.patcher import apply_patch
+
+
+TESTDATA = os.path.join(topdir, "reviewboard", "diffviewer", "testdata")
+NEWLINE_CONVERSION_RE = re.compile(r'\r(\r?\n)?')
+
+
+def read_file(*relative):
+    f = open(os.path.join(TESTDATA, *relative), "r")
+    data = f.read()
+    f.close()
+
+    # Same as diffutils.convert_line_endings.
+    if data and data[-1] == "\r":
+        data = data[:-1]
+
+    return NEWLINE_CONVERSION_RE.sub('\n', data)
+
+
+def run_patch(diff, data):
+    tempdir = tempfile.mkdtemp(prefix='reviewboard.')
+    oldfile = os.path.join(tempdir, "old")
+    newfile = os.path.join(tempdir, "new")
+
+    f = open(oldfile, "w")
+    f.write(data)
+    f.close()
+
+    p = subprocess.Popen(['patch', '-o', newfile, oldfile],
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT)
+    p.communicate(diff)
+
+    f = open(newfile, "r")
+    result = f.read()
+    f.close()
+
+    os.unlink(oldfile)
+    os.unlink(newfile)
+    os.rmdir(tempdir)
+
+    return result
+
+
+def time_func(func, cases, iterations):
+    start = time.time()
+
+    for i in xrange(iterations):
+        for diff, data in cases:
+            func(diff, data)
+
+    return time.time() - start
+
+
+def main():
+    if len(sys.argv) > 1:
+        iterations = int(sys.argv[1])
+    else:
+        iterations = 20
+
+    cases = []
+
+    for name in sorted(os.listdir(os.path.join(TESTDATA, "new_src"))):
+        diff = read_file("diffs", "unified", name + ".diff")
+        data = read_file("orig_src", name)
+
+        if apply_patch(diff, data) != run_patch(diff, data):
+            print "Results differ for %s" % name
+            sys.exit(1)
+
+        cases.append((diff, data))
+
+    num_patches = iterations * len(cases)
+    in_process = time_func(apply_patch, cases, iterations)
+    subproc = time_func(run_patch, cases, iterations)
+
+    print "Applied %d patches" % num_patches
+    print "In-process: %.3fs (%.3fms per patch)" % \
+          (in_process, in_process * 1000 / num_patches)
+    print "patch:      %.3fs (%.3fms per patch)" % \
+          (subproc, subproc * 1000 / num_patches)
+    print "Speedup:    %.1fx" % (subproc / in_process)
+
+
+if __name__ == "__main__":
+    main()
@@ -590,6 +590,64 @@ class DiffSettingsForm(SiteSettingsForm):
                     "page to the diff viewer."),
         initial=10)
 
+    diffviewer_patched_file_cache_dir = forms.CharField(
+        label=_("Patched file cache directory"),
+        help_text=_("The directory where patched files are cached on the "
+                    "local disk. This must be owned by the user the web "
+                    "server runs as, and will be created if it doesn't "
+                    "exist. Leave this blank to disable the disk cache."),
+        required=False,
+        widget=forms.TextInput(attrs={'size': '50'}))
+
+    diffviewer_patched_file_cache_size = forms.IntegerField(
+        label=_("Patched file cache size"),
+        help_text=_("The maximum size, in megabytes, of the patched file "
+                    "cache on disk."),
+        min_value=1,
+        initial=100)
+
+    diffviewer_fetch_threads = forms.IntegerField(
+        label=_("File fetch threads"),
+        help_text=_("The maximum number of files to fetch from the "
+                    "repository at once when generating several diffs, "
+                    "or to check for when uploading a diff."),
+        min_value=1,
+        initial=4)
+
+    diffviewer_chunk_processes = forms.IntegerField(
+        label=_("Diff generation processes"),
+        help_text=_("The number of processes used to generate several diffs "
+                    "at once. This is only worth enabling on servers with "
+                    "several CPUs to spare. Enter 0 to generate diffs in the "
+                    "web server process. Requires Python 2.6 or higher."),
+        min_value=0,
+        initial=0)
+
+    diffviewer_incremental_highlighting = forms.BooleanField(
+        label=_("Highlight modified files incrementally"),
+        help_text=_("Only re-highlight the parts of a file that changed, "
+                    "reusing the highlighting of the original file for the "
+                    "rest. This is much faster for large files, but some "
+                    "lines near a change may occasionally be highlighted "
+                    "differently than if the whole file had been "
+                    "highlighted."),
+        required=False)
+
+    diffviewer_stream_fragments = forms.BooleanField(
+        label=_("Stream large diffs"),
+        help_text=_("Send diffs to the browser as they're generated, rather "
+                    "than waiting until the whole file has been processed. "
+                    "This lets reviewers start reading large diffs sooner."),
+        required=False)
+
+    diffviewer_precompute_diffs = forms.BooleanField(
+        label=_("Pre-compute diffs on upload"),
+        help_text=_("Queue newly uploaded diffs to be generated in the "
+                    "background, so they're ready before anyone views them. "
+                    "This requires running the precompute_diffs command "
+                    "with rb-site manage."),
+        required=False)
+
     def load(self):
         # TODO: Move this check into a dependencies module so we can catch it
         #       when the user starts up Review Board.
@@ -606,6 +664,30 @@ class DiffSettingsForm(SiteSettingsForm):
 
         super(DiffSettingsForm, self).load()
 
+    def clean_diffviewer_patched_file_cache_dir(self):
+        """Validates that the patched file cache directory is usable."""
+        cache_dir = self.cleaned_data['diffviewer_patched_file_cache_dir']
+
+        if cache_dir:
+            if os.path.exists(cache_dir):
+                if not os.path.isdir(cache_dir):
+                    raise forms.ValidationError(_("This is not a directory."))
+
+                if not os.access(cache_dir, os.W_OK):
+                    raise forms.ValidationError(
+                        _("This path is not writable by the web server."))
+
+                if (hasattr(os, 'getuid') and
+                    os.stat(cache_dir).st_uid != os.getuid()):
+                    raise forms.ValidationError(
+                        _("This directory is not owned by the web server's "
+                          "user."))
+            elif not os.access(os.path.dirname(cache_dir) or '.', os.W_OK):
+                raise forms.ValidationError(
+                    _("This path cannot be created by the web server."))
+
+        return cache_dir
+
     def save(self):
         self.siteconfig.set('diffviewer_include_space_patterns',
             re.split(r",\s*", self.cleaned_data['include_space_patterns']))
@@ -635,7 +717,14 @@ class DiffSettingsForm(SiteSettingsForm):
                 'classes': ('wide',),
                 'fields': ('diffviewer_context_num_lines',
                            'diffviewer_paginate_by',
-                           'diffviewer_paginate_orphans')
+                           'diffviewer_paginate_orphans',
+                           'diffviewer_patched_file_cache_dir',
+                           'diffviewer_patched_file_cache_size',
+                           'diffviewer_fetch_threads',
+                           'diffviewer_chunk_processes',
+                           'diffviewer_incremental_highlighting',
+                           'diffviewer_stream_fragments',
+                           'diffviewer_precompute_diffs')
             }
         )
 
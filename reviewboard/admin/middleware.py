@@ -5,11 +5,15 @@ from django.conf import settings
 from django.contrib import auth
 from django.core.handlers.modpython import ModPythonRequest
 from django.core.handlers.wsgi import WSGIRequest
+from django.middleware.gzip import GZipMiddleware
+from django.middleware.http import ConditionalGetMiddleware
 
 
 from reviewboard.admin.checks import check_updates_required
 from reviewboard.admin.siteconfig import auth_backend_map, load_site_config
 from reviewboard.admin.views import manual_updates_required
+from reviewboard.diffviewer.timing import set_request_timings, \
+                                          start_request_timings
 from reviewboard.webapi.json import service_not_configured
 
 
@@ -88,3 +92,58 @@ class X509AuthMiddleware(object):
                     auth.login(request, user)
 
         return None
+
+
+class StreamingGZipMiddleware(GZipMiddleware):
+    """
+    Middleware that compresses responses, except for streaming responses.
+
+    Compressing a response requires reading all of its content, which would
+    defeat the point of streaming it. Streaming responses are marked by
+    setting a ``streaming`` attribute on them.
+    """
+    def process_response(self, request, response):
+        if getattr(response, 'streaming', False):
+            return response
+
+        return super(StreamingGZipMiddleware, self).process_response(
+            request, response)
+
+
+class StreamingConditionalGetMiddleware(ConditionalGetMiddleware):
+    """
+    Middleware that handles conditional GETs, except for streaming responses.
+
+    The standard middleware computes the Content-Length of every response,
+    which requires reading all of its content. See StreamingGZipMiddleware.
+    """
+    def process_response(self, request, response):
+        if getattr(response, 'streaming', False):
+            return response
+
+        return super(StreamingConditionalGetMiddleware,
+                     self).process_response(request, response)
+
+
+class DiffTimingMiddleware(object):
+    """
+    Middleware that reports how long each stage of showing diffs took.
+
+    If any diff viewer stages were timed while handling a request, their
+    totals are added to the response in an X-Diff-Timing header. See
+    reviewboard.diffviewer.timing.
+
+    Streaming responses generate most of their content after this has run,
+    so their header only covers the work done before they started.
+    """
+    def process_request(self, request):
+        request.diff_timings = start_request_timings()
+
+    def process_response(self, request, response):
+        timings = getattr(request, 'diff_timings', None)
+        set_request_timings(None)
+
+        if timings and timings.stages:
+            response['X-Diff-Timing'] = timings.get_header_value()
+
+        return response
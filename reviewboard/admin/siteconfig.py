@@ -123,13 +123,20 @@ defaults.update({
     'auth_x509_username_field':            'SSL_CLIENT_S_DN_CN',
     'auth_x509_username_regex':            '',
     'auth_x509_autocreate_users':          False,
+    'diffviewer_chunk_processes':          0,
     'diffviewer_context_num_lines':        5,
+    'diffviewer_fetch_threads':            4,
     'diffviewer_include_space_patterns':   [],
+    'diffviewer_incremental_highlighting': False,
     'diffviewer_paginate_by':              20,
     'diffviewer_paginate_orphans':         10,
+    'diffviewer_precompute_diffs':         False,
+    'diffviewer_patched_file_cache_dir':   '',
+    'diffviewer_patched_file_cache_size':  100,
     'diffviewer_syntax_highlighting':      True,
     'diffviewer_syntax_highlighting_threshold': 0,
     'diffviewer_show_trailing_whitespace': True,
+    'diffviewer_stream_fragments':         True,
     'mail_send_review_mail':               False,
     'search_enable':                       False,
     'site_domain_method':                  'http',
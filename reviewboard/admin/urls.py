@@ -36,6 +36,7 @@ NEWS_FEED = "http://www.reviewboard.org/news/feed/"
 urlpatterns = patterns('reviewboard.admin.views',
     (r'^$', 'dashboard'),
     (r'^cache/$', 'cache_stats'),
+    (r'^diff-timing/$', 'diff_timing'),
 
     # Settings
     url(r'^settings/general/$', 'site_settings',
@@ -10,6 +10,7 @@ from djblets.siteconfig.views import site_settings as djblets_site_settings
 
 from reviewboard.admin.checks import check_updates_required
 from reviewboard.admin.cache_stats import get_cache_stats, get_has_cache_stats
+from reviewboard.diffviewer.timing import timing_store
 from reviewboard.reviews.models import Group, DefaultReviewer
 from reviewboard.scmtools.models import Repository
 
@@ -47,6 +48,19 @@ def cache_stats(request, template_name="admin/cache_stats.html"):
     }))
 
 
+@staff_member_required
+def diff_timing(request, template_name="admin/diff_timing.html"):
+    """
+    Displays how long the recent runs of each stage of generating diffs
+    took in this server process.
+    """
+    return render_to_response(template_name, RequestContext(request, {
+        'stages': timing_store.get_stats(),
+        'title': _("Diff Timing"),
+        'root_path': settings.SITE_ROOT + "admin/db/"
+    }))
+
+
 @staff_member_required
 def site_settings(request, form_class,
                   template_name="siteconfig/settings.html"):
@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from reviewboard.diffviewer.models import FileDiff, DiffSet, DiffSetHistory
+from reviewboard.diffviewer.models import FileDiff, DiffSet, DiffSetHistory, \
+                                          DiffPrecomputeJob
 
 
 class FileDiffAdmin(admin.ModelAdmin):
@@ -30,6 +31,15 @@ class DiffSetAdmin(admin.ModelAdmin):
     ordering = ('-timestamp',)
 
 
+class DiffPrecomputeJobAdmin(admin.ModelAdmin):
+    list_display = ('diffset', 'previous_diffset', 'status', 'timestamp',
+                    'started', 'completed')
+    list_filter = ('status',)
+    raw_id_fields = ('diffset', 'previous_diffset')
+    readonly_fields = ('started', 'completed', 'error')
+    ordering = ('-timestamp',)
+
+
 class DiffSetInline(admin.StackedInline):
     model = DiffSet
     extra = 0
@@ -44,3 +54,4 @@ class DiffSetHistoryAdmin(admin.ModelAdmin):
 admin.site.register(FileDiff, FileDiffAdmin)
 admin.site.register(DiffSet, DiffSetAdmin)
 admin.site.register(DiffSetHistory, DiffSetHistoryAdmin)
+admin.site.register(DiffPrecomputeJob, DiffPrecomputeJobAdmin)
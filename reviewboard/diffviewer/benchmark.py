@@ -0,0 +1,527 @@
+"""Benchmarks for the stages of the diff viewer.
+
+Each benchmark case is a set of files, with their original and modified
+contents. Every stage the diff viewer goes through to show them is timed
+separately, so that changes in performance can be tracked down to a stage:
+
+    parse              Parsing the uploaded diff (DiffParser.parse).
+    patch              Applying the diff of each file (patch).
+    diff               Diffing each file (the differ's get_opcodes).
+    opcodes_metadata   Finding moved and whitespace-only lines
+                       (opcodes_with_metadata).
+    chunks             Generating the chunks of each file (generate_chunks),
+                       without syntax highlighting.
+    chunks_highlighted The same, with syntax highlighting.
+    render             Rendering the diff fragment of each file.
+
+Nothing is read from or stored in the cache or the database, so the
+stages always do their full work.
+
+The synthetic cases are generated from a random seed, so they're the same
+from run to run. Recorded cases are loaded from a pair of directories
+holding the original and modified versions of some files (see
+load_recorded_case).
+
+This is used by the benchmark_diffviewer management command.
+"""
+
+import difflib
+import os
+import random
+import sys
+import time
+
+from django.template.loader import render_to_string
+
+from reviewboard import get_version_string
+from reviewboard.admin.checks import get_can_enable_syntax_highlighting
+from reviewboard.diffviewer.diffutils import DEFAULT_DIFF_COMPAT_VERSION, \
+                                             NEWLINES_RE, \
+                                             Differ, \
+                                             add_chunk_info, \
+                                             generate_chunks, \
+                                             get_chunk_settings, \
+                                             opcodes_with_metadata, \
+                                             patch
+from reviewboard.diffviewer.linetable import LineTable
+from reviewboard.diffviewer.models import DiffSet, FileDiff
+from reviewboard.diffviewer.parser import DiffParser
+
+
+STAGES = ('parse', 'patch', 'diff', 'opcodes_metadata', 'chunks',
+          'chunks_highlighted', 'render')
+
+
+class BenchmarkFile(object):
+    """A file in a benchmark case.
+
+    old and new are the two versions of the file that are diffed. For an
+    interdiff, base is the version both are based on, and each is the
+    result of applying a separate diff to it.
+    """
+    def __init__(self, orig_name, new_name, old, new, base=None):
+        self.orig_name = orig_name
+        self.new_name = new_name
+        self.old = old
+        self.new = new
+        self.base = base
+        self._patches = None
+
+    def get_patches(self):
+        """Returns the diffs applied to get the versions of the file.
+
+        This is a list of (original, diff, patched) tuples.
+        """
+        if self._patches is None:
+            if self.base is None:
+                sources = [(self.old, self.new)]
+            else:
+                sources = [(self.base, self.old), (self.base, self.new)]
+
+            self._patches = [
+                (orig,
+                 make_unified_diff(self.orig_name, self.new_name, orig,
+                                   patched),
+                 patched)
+                for orig, patched in sources
+            ]
+
+        return self._patches
+
+
+class BenchmarkCase(object):
+    """A set of files to benchmark the diff viewer with."""
+    def __init__(self, name, description, files):
+        self.name = name
+        self.description = description
+        self.files = files
+
+    def get_diff(self):
+        """Returns the diff of every file in the case, as uploaded."""
+        return ''.join([diff
+                        for file in self.files
+                        for orig, diff, patched in file.get_patches()])
+
+    def get_info(self):
+        """Returns a description of the case, for the results."""
+        return {
+            'name': self.name,
+            'description': self.description,
+            'files': len(self.files),
+            'old_lines': sum([len(_split_lines(file.old))
+                              for file in self.files]),
+            'new_lines': sum([len(_split_lines(file.new))
+                              for file in self.files]),
+            'diff_bytes': len(self.get_diff()),
+        }
+
+
+def make_unified_diff(orig_name, new_name, old, new):
+    """Returns a unified diff between two versions of a file."""
+    lines = []
+
+    for line in difflib.unified_diff(old.splitlines(True),
+                                     new.splitlines(True),
+                                     '%s\t(revision 1)' % orig_name,
+                                     '%s\t(working copy)' % new_name):
+        lines.append(line)
+
+        # difflib doesn't mark the last line of a file that doesn't end in
+        # a newline, the way diff does.
+        if not line.endswith('\n'):
+            lines.append('\n\\ No newline at end of file\n')
+
+    return ''.join(lines)
+
+
+def _split_lines(data):
+    # This splits lines the way generate_chunks does.
+    lines = NEWLINES_RE.split(data)
+    del lines[-1]
+
+    return lines
+
+
+def _generate_source(rng, num_lines):
+    """Returns lines of made-up Python code."""
+    lines = []
+    i = 0
+
+    while len(lines) < num_lines:
+        lines += [
+            'def function_%d(value, count=%d):\n' % (i, rng.randint(0, 99)),
+            '    """Computes result %d from the value."""\n' % i,
+            '    result = compute(value, %d)\n' % rng.randint(0, 9999),
+            '\n',
+            '    for j in xrange(count):\n',
+            '        if result > %d:\n' % rng.randint(0, 999),
+            '            result -= j * %d\n' % rng.randint(1, 9),
+            '\n',
+            '    return result\n',
+            '\n',
+            '\n',
+        ]
+        i += 1
+
+    return lines[:num_lines]
+
+
+def _edit_lines(rng, lines, num_edits):
+    """Returns a copy of lines with some of them changed, added or removed."""
+    lines = list(lines)
+
+    for i in xrange(num_edits):
+        j = rng.randint(0, len(lines) - 1)
+        kind = rng.randint(0, 2)
+
+        if kind == 0:
+            lines[j] = lines[j].rstrip('\n') + '  # edited %d\n' % i
+        elif kind == 1:
+            lines.insert(j, '    added_%d = compute(result, %d)\n' % (i, i))
+        else:
+            del lines[j]
+
+    return lines
+
+
+def _make_small_edits(rng):
+    files = []
+
+    for i in xrange(20):
+        old = _generate_source(rng, 300)
+        new = _edit_lines(rng, old, 3)
+        name = 'reviewboard/small/module_%d.py' % i
+        files.append(BenchmarkFile(name, name, ''.join(old), ''.join(new)))
+
+    return BenchmarkCase('small_edits', 'A few edits to 20 small files',
+                         files)
+
+
+def _make_huge_file(rng):
+    old = _generate_source(rng, 20000)
+    new = _edit_lines(rng, old, 200)
+    name = 'reviewboard/huge.py'
+
+    return BenchmarkCase('huge_file', '200 edits to a 20000-line file',
+                         [BenchmarkFile(name, name, ''.join(old),
+                                        ''.join(new))])
+
+
+def _make_mass_renames(rng):
+    files = []
+
+    for i in xrange(300):
+        old = ['from oldpackage.module_%d import base\n' % i,
+               '\n'] + _generate_source(rng, 48)
+        new = ['from newpackage.module_%d import base\n' % i] + old[1:]
+        files.append(BenchmarkFile('oldpackage/module_%d.py' % i,
+                                   'newpackage/module_%d.py' % i,
+                                   ''.join(old), ''.join(new)))
+
+    return BenchmarkCase('mass_renames',
+                         '300 renamed files with their imports updated',
+                         files)
+
+
+def _make_moves(rng):
+    head = _generate_source(rng, 2000)
+    block = _generate_source(rng, 5000)
+    middle = _generate_source(rng, 3000)
+    tail = _generate_source(rng, 2000)
+    name = 'reviewboard/moves.py'
+
+    return BenchmarkCase('moves',
+                         'A 5000-line block moved within a 12000-line file',
+                         [BenchmarkFile(name, name,
+                                        ''.join(head + block + middle + tail),
+                                        ''.join(head + middle + block +
+                                                tail))])
+
+
+def _make_whitespace_changes(rng):
+    files = []
+
+    for i in xrange(10):
+        old = _generate_source(rng, 500)
+        new = [line.replace('    ', '\t') for line in old]
+        name = 'reviewboard/whitespace/module_%d.py' % i
+        files.append(BenchmarkFile(name, name, ''.join(old), ''.join(new)))
+
+    return BenchmarkCase('whitespace',
+                         'Reindenting 10 files, changing only whitespace',
+                         files)
+
+
+def _make_interdiff(rng):
+    files = []
+
+    for i in xrange(10):
+        base = _generate_source(rng, 1000)
+        old = _edit_lines(rng, base, 20)
+        new = _edit_lines(rng, old, 10)
+        name = 'reviewboard/interdiff/module_%d.py' % i
+        files.append(BenchmarkFile(name, name, ''.join(old), ''.join(new),
+                                   ''.join(base)))
+
+    return BenchmarkCase('interdiff',
+                         'An interdiff between two revisions of a change to '
+                         '10 files',
+                         files)
+
+
+SYNTHETIC_CASES = (
+    ('small_edits', _make_small_edits),
+    ('huge_file', _make_huge_file),
+    ('mass_renames', _make_mass_renames),
+    ('moves', _make_moves),
+    ('whitespace', _make_whitespace_changes),
+    ('interdiff', _make_interdiff),
+)
+
+
+def get_synthetic_cases(names=None, seed=0):
+    """Returns the synthetic benchmark cases.
+
+    If names is passed, only the cases with those names are returned.
+    """
+    cases = []
+
+    for i, (name, make_case) in enumerate(SYNTHETIC_CASES):
+        if not names or name in names:
+            # Each case gets its own generator, so it comes out the same
+            # no matter which other cases are chosen.
+            cases.append(make_case(random.Random(seed * 1000 + i)))
+
+    return cases
+
+
+def load_recorded_case(orig_dir, new_dir, name=None):
+    """Loads a benchmark case from two directories of files.
+
+    Files are matched up by their paths within the directories. Files
+    only in new_dir are treated as newly added. Files only in orig_dir are
+    ignored, since the diff viewer doesn't show the contents of deleted
+    files.
+    """
+    files = []
+
+    for dirpath, dirnames, filenames in os.walk(new_dir):
+        dirnames.sort()
+
+        for filename in sorted(filenames):
+            new_path = os.path.join(dirpath, filename)
+            path = new_path[len(new_dir):].lstrip(os.sep)
+            orig_path = os.path.join(orig_dir, path)
+
+            if os.path.exists(orig_path):
+                old = _read_file(orig_path)
+            else:
+                old = ''
+
+            files.append(BenchmarkFile(path, path, old, _read_file(new_path)))
+
+    return BenchmarkCase(name or os.path.basename(new_dir.rstrip(os.sep)),
+                         'Files recorded in %s and %s' % (orig_dir, new_dir),
+                         files)
+
+
+def _read_file(path):
+    f = open(path, 'rb')
+
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def _time_parse(case, settings):
+    diff = case.get_diff()
+
+    start_time = time.time()
+    DiffParser(diff).parse()
+
+    return time.time() - start_time
+
+
+def _time_patch(case, settings):
+    patches = [(orig, diff, file.new_name)
+               for file in case.files
+               for orig, diff, patched in file.get_patches()]
+
+    start_time = time.time()
+
+    for orig, diff, filename in patches:
+        patch(diff, orig, filename)
+
+    return time.time() - start_time
+
+
+def _make_differs(case):
+    differs = []
+
+    for file in case.files:
+        line_table = LineTable()
+        differ = Differ(_split_lines(file.old), _split_lines(file.new),
+                        ignore_space=True,
+                        compat_version=DEFAULT_DIFF_COMPAT_VERSION,
+                        line_table=line_table)
+        differs.append((differ, line_table))
+
+    return differs
+
+
+def _time_diff(case, settings):
+    differs = _make_differs(case)
+
+    start_time = time.time()
+
+    for differ, line_table in differs:
+        list(differ.get_opcodes())
+
+    return time.time() - start_time
+
+
+def _time_opcodes_metadata(case, settings):
+    differs = _make_differs(case)
+
+    # Only time the metadata, not the diffing.
+    for differ, line_table in differs:
+        list(differ.get_opcodes())
+
+    start_time = time.time()
+
+    for differ, line_table in differs:
+        opcodes_with_metadata(differ, line_table)
+
+    return time.time() - start_time
+
+
+def _can_highlight():
+    return get_can_enable_syntax_highlighting()[0]
+
+
+def _get_chunks(case, settings, enable_syntax_highlighting):
+    return [list(generate_chunks(file.old, file.new, file.orig_name,
+                                 file.new_name, DEFAULT_DIFF_COMPAT_VERSION,
+                                 enable_syntax_highlighting, settings))
+            for file in case.files]
+
+
+def _time_chunks(case, settings):
+    start_time = time.time()
+    _get_chunks(case, settings, False)
+
+    return time.time() - start_time
+
+
+def _time_chunks_highlighted(case, settings):
+    start_time = time.time()
+    _get_chunks(case, settings, True)
+
+    return time.time() - start_time
+
+
+def _time_render(case, settings):
+    diffset = DiffSet(id=1, name='benchmark', revision=1)
+    all_chunks = _get_chunks(case, settings, _can_highlight())
+    contexts = []
+
+    for i, (file, chunks) in enumerate(zip(case.files, all_chunks)):
+        filediff = FileDiff(id=i + 1, diffset=diffset,
+                            source_file=file.orig_name,
+                            dest_file=file.new_name,
+                            source_revision='1',
+                            dest_detail='(working copy)')
+        file_info = {
+            'depot_filename': file.orig_name,
+            'basename': os.path.basename(file.orig_name),
+            'basepath': os.path.dirname(file.orig_name),
+            'revision': 'Revision 1',
+            'dest_revision': 'New Change',
+            'filediff': filediff,
+            'interfilediff': None,
+            'force_interdiff': False,
+            'binary': False,
+            'deleted': False,
+            'newfile': not file.old,
+            'index': i,
+            'chunks': chunks,
+            'changed_chunk_indexes': [],
+            'whitespace_only': True,
+            'num_changes': 0,
+        }
+
+        for j, chunk in enumerate(chunks):
+            add_chunk_info(file_info, j, chunk)
+
+        contexts.append({
+            'file': file_info,
+            'collapseall': False,
+            'standalone': False,
+        })
+
+    start_time = time.time()
+
+    for context in contexts:
+        render_to_string('diffviewer/diff_file_fragment.html', context)
+
+    return time.time() - start_time
+
+
+STAGE_FUNCS = {
+    'parse': _time_parse,
+    'patch': _time_patch,
+    'diff': _time_diff,
+    'opcodes_metadata': _time_opcodes_metadata,
+    'chunks': _time_chunks,
+    'chunks_highlighted': _time_chunks_highlighted,
+    'render': _time_render,
+}
+
+
+def run_benchmarks(cases, iterations=3, stages=STAGES, settings=None,
+                   progress=None):
+    """Times each stage of the diff viewer on each benchmark case.
+
+    Each stage is run the given number of times for each case. settings
+    are the chunk settings passed to generate_chunks, which default to the
+    site's settings (see get_chunk_settings). If passed, progress is called
+    with the name of each case and stage before it's run.
+
+    Returns a dictionary of results, suitable for encoding as JSON. Times
+    are in seconds.
+    """
+    if settings is None:
+        settings = get_chunk_settings()
+
+    if not _can_highlight():
+        stages = [stage for stage in stages if stage != 'chunks_highlighted']
+
+    results = []
+
+    for case in cases:
+        case_results = case.get_info()
+        case_results['stages'] = {}
+
+        for stage in stages:
+            if progress:
+                progress(case.name, stage)
+
+            durations = [STAGE_FUNCS[stage](case, settings)
+                         for i in xrange(iterations)]
+
+            case_results['stages'][stage] = {
+                'min': min(durations),
+                'mean': sum(durations) / len(durations),
+                'max': max(durations),
+            }
+
+        results.append(case_results)
+
+    return {
+        'reviewboard_version': get_version_string(),
+        'python_version': sys.version.split()[0],
+        'iterations': iterations,
+        'settings': settings,
+        'cases': results,
+    }
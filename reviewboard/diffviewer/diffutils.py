@@ -1,18 +1,17 @@
 import fnmatch
+import logging
 import os
 import re
 import subprocess
+import sys
 import tempfile
+import threading
+from bisect import bisect_left, bisect_right
 from difflib import SequenceMatcher
 
-try:
-    import pygments
-    from pygments.lexers import get_lexer_for_filename
-    # from pygments.lexers import guess_lexer_for_filename
-    from pygments.formatters import HtmlFormatter
-except ImportError:
-    pass
-
+from django.db import connection
+from django.utils.encoding import smart_str
+from django.utils.hashcompat import sha_constructor
 from django.utils.html import escape
 from django.utils.http import urlquote
 from django.utils.safestring import mark_safe
@@ -24,8 +23,20 @@ from djblets.util.misc import cache_memoize
 
 from reviewboard.accounts.models import Profile
 from reviewboard.admin.checks import get_can_enable_syntax_highlighting
-from reviewboard.diffviewer.myersdiff import MyersDiffer
+from reviewboard.diffviewer.filecache import get_disk_cache
+from reviewboard.diffviewer.highlighting import get_lexer, \
+                                                get_lexer_class, \
+                                                get_markup_cache_key, \
+                                                highlight, \
+                                                highlight_incrementally
+from reviewboard.diffviewer.linetable import LineTable
+from reviewboard.diffviewer.myersdiff import CompactMyersDiffer
+from reviewboard.diffviewer.packedchunks import PackedChunks, pack_chunks
+from reviewboard.diffviewer.parallel import can_run_in_processes, \
+                                            run_in_processes, run_in_threads
+from reviewboard.diffviewer.patcher import apply_patch, PatchError
 from reviewboard.diffviewer.smdiff import SMDiffer
+from reviewboard.diffviewer.timing import time_iteration, time_stage
 from reviewboard.scmtools.core import PRE_CREATION, HEAD
 
 
@@ -38,7 +49,17 @@ NEWLINES_RE = re.compile(r'\r?\n')
 NEWLINE_CONVERSION_RE = re.compile(r'\r(\r?\n)?')
 
 ALPHANUM_RE = re.compile(r'\w')
-WHITESPACE_RE = re.compile(r'\s')
+
+# The minimum similarity between two lines for the changes within them to
+# be shown.
+MIN_LINE_CHANGED_RATIO = 0.6
+
+# Lines longer than this are treated as being entirely changed, rather than
+# comparing them character by character.
+MAX_LINE_CHANGED_REGIONS_LENGTH = 5000
+
+# The maximum number of line pairs to remember the changed regions for.
+MAX_CACHED_LINE_CHANGED_REGIONS = 10000
 
 
 # A list of regular expressions for headers in the source code that we can
@@ -141,32 +162,18 @@ class DiffCompatError(Exception):
     pass
 
 
-class NoWrapperHtmlFormatter(HtmlFormatter):
-    """An HTML Formatter for Pygments that don't wrap items in a div."""
-    def __init__(self, *args, **kwargs):
-        super(NoWrapperHtmlFormatter, self).__init__(*args, **kwargs)
-
-    def _wrap_div(self, inner):
-        """
-        Method called by the formatter to wrap the contents of inner.
-        Inner is a list of tuples containing formatted code. If the first item
-        in the tuple is zero, then it's a wrapper, so we should ignore it.
-        """
-        for tup in inner:
-            if tup[0]:
-                yield tup
-
-
 def Differ(a, b, ignore_space=False,
-           compat_version=DEFAULT_DIFF_COMPAT_VERSION):
+           compat_version=DEFAULT_DIFF_COMPAT_VERSION, line_table=None):
     """
     Factory wrapper for returning a differ class based on the compat version
     and flags specified.
+
+    If a LineTable is passed, it will be used by differs that support it.
     """
     if compat_version == 0:
         return SMDiffer(a, b)
     elif compat_version == 1:
-        return MyersDiffer(a, b, ignore_space)
+        return CompactMyersDiffer(a, b, ignore_space, line_table)
     else:
         raise DiffCompatError(
             "Invalid diff compatibility version (%s) passed to Differ" %
@@ -196,25 +203,44 @@ def convert_line_endings(data):
 
 
 def patch(diff, file, filename):
-    """Apply a diff to a file.  Delegates out to `patch` because noone
-       except Larry Wall knows how to patch."""
+    """Apply a diff to a file.
 
+    This first tries to apply the diff in-process. If that fails for any
+    reason, we delegate out to `patch`, because noone except Larry Wall
+    knows how to patch.
+    """
     log_timer = log_timed("Patching file %s" % filename)
 
     if diff.strip() == "":
         # Someone uploaded an unchanged file. Return the one we're patching.
+        log_timer.done()
         return file
 
+    file = convert_line_endings(file)
+    diff = convert_line_endings(diff)
+
+    try:
+        data = apply_patch(diff, file)
+    except PatchError, e:
+        logging.debug("Unable to patch '%s' in-process, falling back on "
+                      "`patch`: %s" % (filename, e))
+        data = _run_patch_command(diff, file, filename)
+
+    log_timer.done()
+
+    return data
+
+
+def _run_patch_command(diff, file, filename):
+    """Apply a diff to a file using the `patch` command."""
     # Prepare the temporary directory if none is available
     tempdir = tempfile.mkdtemp(prefix='reviewboard.')
 
     (fd, oldfile) = tempfile.mkstemp(dir=tempdir)
     f = os.fdopen(fd, "w+b")
-    f.write(convert_line_endings(file))
+    f.write(file)
     f.close()
 
-    diff = convert_line_endings(diff)
-
     # XXX: catch exception if Popen fails?
     newfile = '%s-new' % oldfile
     p = subprocess.Popen(['patch', '-o', newfile, oldfile],
@@ -231,8 +257,6 @@ def patch(diff, file, filename):
         f.write(diff)
         f.close()
 
-        log_timer.done()
-
         # FIXME: This doesn't provide any useful error report on why the patch
         # failed to apply, which makes it hard to debug.  We might also want to
         # have it clean up if DEBUG=False
@@ -249,26 +273,72 @@ def patch(diff, file, filename):
     os.unlink(newfile)
     os.rmdir(tempdir)
 
-    log_timer.done()
-
     return data
 
 
+_line_changed_regions = {}
+
+
 def get_line_changed_regions(oldline, newline):
+    """Returns the regions that changed between two versions of a line.
+
+    This returns a tuple of lists of (start, end) character ranges for the
+    old and new lines. If the lines are too different to compare, or too
+    long, this returns (None, None), and the whole line is shown as changed.
+
+    The same pairs of lines show up again in interdiffs and when the diff
+    is viewed with and without highlighting, so results are remembered for
+    the most recent line pairs. Only a digest of each pair is kept, rather
+    than the lines themselves, which may be long.
+    """
     if oldline is None or newline is None:
         return (None, None)
 
+    oldline_str = smart_str(oldline)
+    key = sha_constructor('%d:%s%s' % (len(oldline_str), oldline_str,
+                                       smart_str(newline))).digest()
+
+    try:
+        oldchanges, newchanges = _line_changed_regions[key]
+    except KeyError:
+        oldchanges, newchanges = _get_line_changed_regions(oldline, newline)
+
+        if len(_line_changed_regions) >= MAX_CACHED_LINE_CHANGED_REGIONS:
+            _line_changed_regions.clear()
+
+        _line_changed_regions[key] = (oldchanges, newchanges)
+
+    # The cached lists are shared, so callers get their own copies.
+    if oldchanges is not None:
+        oldchanges = list(oldchanges)
+
+    if newchanges is not None:
+        newchanges = list(newchanges)
+
+    return (oldchanges, newchanges)
+
+
+def _get_line_changed_regions(oldline, newline):
+    if (len(oldline) > MAX_LINE_CHANGED_REGIONS_LENGTH or
+        len(newline) > MAX_LINE_CHANGED_REGIONS_LENGTH):
+        return (None, None)
+
     # Use the SequenceMatcher directly. It seems to give us better results
     # for this. We should investigate steps to move to the new differ.
     differ = SequenceMatcher(None, oldline, newline)
 
     # This thresholds our results -- we don't want to show inter-line diffs if
     # most of the line has changed, unless those lines are very short.
+    #
+    # real_quick_ratio is an upper bound on the ratio that only looks at the
+    # lengths of the lines, so it rules out lines of very different lengths
+    # without comparing them.
 
     # FIXME: just a plain, linear threshold is pretty crummy here.  Short
     # changes in a short line get lost.  I haven't yet thought of a fancy
     # nonlinear test.
-    if differ.ratio() < 0.6:
+    if (differ.real_quick_ratio() < MIN_LINE_CHANGED_RATIO or
+        differ.ratio() < MIN_LINE_CHANGED_RATIO):
         return (None, None)
 
     oldchanges = []
@@ -326,11 +396,14 @@ def convert_to_utf8(s, enc):
         raise TypeError("Value to convert is unexpected type %s", type(s))
 
 
-def get_original_file(filediff):
+def get_original_file(filediff, original_files=None):
     """
     Get a file either from the cache or the SCM, applying the parent diff if
     it exists.
 
+    original_files may be a dictionary returned by prefetch_original_files,
+    in which case the file is taken from it, if it's there.
+
     SCM exceptions are passed back to the caller.
     """
     data = ""
@@ -339,39 +412,170 @@ def get_original_file(filediff):
         def fetch_file(file, revision):
             log_timer = log_timed("Fetching file '%s' r%s from %s" %
                                   (file, revision, repository))
+            timer = time_stage('fetch')
             data = tool.get_file(file, revision)
+            timer.done(len(data))
             data = convert_line_endings(data)
             log_timer.done()
             return data
 
-        repository = filediff.diffset.repository
-        tool = repository.get_scmtool()
-        file = filediff.source_file
-        revision = filediff.source_revision
+        key = _get_original_file_cache_key(filediff)
 
-        key = "%s:%s:%s" % (filediff.diffset.repository.path, urlquote(file),
-                            revision)
-
-        # We wrap the result of get_file in a list and then return the first
-        # element after getting the result from the cache. This prevents the
-        # cache backend from converting to unicode, since we're no longer
-        # passing in a string and the cache backend doesn't recursively look
-        # through the list in order to convert the elements inside.
-        #
-        # Basically, this fixes the massive regressions introduced by the
-        # Django unicode changes.
-        data = cache_memoize(key, lambda: [fetch_file(file, revision)],
-                             large_data=True)[0]
+        if original_files and key in original_files:
+            data = original_files[key]
+        else:
+            repository = filediff.diffset.repository
+            tool = repository.get_scmtool()
+            file = filediff.source_file
+            revision = filediff.source_revision
+
+            # We wrap the result of get_file in a list and then return the
+            # first element after getting the result from the cache. This
+            # prevents the cache backend from converting to unicode, since
+            # we're no longer passing in a string and the cache backend
+            # doesn't recursively look through the list in order to convert
+            # the elements inside.
+            #
+            # Basically, this fixes the massive regressions introduced by the
+            # Django unicode changes.
+            data = cache_memoize(key, lambda: [fetch_file(file, revision)],
+                                 large_data=True)[0]
 
     # If there's a parent diff set, apply it to the buffer.
     if filediff.parent_diff:
-        data = patch(filediff.parent_diff, data, filediff.source_file)
+        timer = time_stage('parent_patch')
+        data = get_cached_patch(filediff.parent_diff, data,
+                                filediff.source_file)
+        timer.done()
 
     return data
 
 
+def prefetch_original_files(filediffs):
+    """Fetches the original versions of several files at once.
+
+    The files that aren't already cached are fetched with a single call to
+    SCMTool.get_files for each repository, using up to
+    diffviewer_fetch_threads threads, and are then cached.
+
+    This returns a dictionary of the files' contents, for passing to
+    get_original_file. Files that couldn't be fetched are left out, so that
+    get_original_file will try them again and raise the error.
+    """
+    original_files = {}
+    to_fetch = {}
+
+    for filediff in filediffs:
+        if filediff.source_revision == PRE_CREATION:
+            continue
+
+        key = _get_original_file_cache_key(filediff)
+
+        if key in original_files:
+            continue
+
+        try:
+            original_files[key] = cache_memoize(key, _raise_cache_miss,
+                                                large_data=True)[0]
+        except _CacheMiss:
+            repository = filediff.diffset.repository
+
+            if repository.pk not in to_fetch:
+                to_fetch[repository.pk] = (repository, [], [])
+
+            if key not in to_fetch[repository.pk][1]:
+                to_fetch[repository.pk][1].append(key)
+                to_fetch[repository.pk][2].append(
+                    (filediff.source_file, filediff.source_revision))
+
+    if not to_fetch:
+        return original_files
+
+    siteconfig = SiteConfiguration.objects.get_current()
+    num_threads = siteconfig.get('diffviewer_fetch_threads')
+
+    for repository, keys, files in to_fetch.itervalues():
+        log_timer = log_timed("Fetching %d files from %s" %
+                              (len(keys), repository))
+        timer = time_stage('fetch')
+
+        try:
+            results = repository.get_scmtool().get_files(files,
+                                                         max(num_threads, 1))
+        except Exception, e:
+            logging.warning("Error prefetching files from %s: %s" %
+                            (repository, e))
+            results = []
+
+        size = 0
+
+        for key, (path, revision), (data, exc_info) in zip(keys, files,
+                                                           results):
+            if exc_info:
+                logging.debug("Error prefetching file '%s' r%s from %s: %s" %
+                              (path, revision, repository, exc_info[1]))
+            else:
+                size += len(data)
+                data = convert_line_endings(data)
+                original_files[key] = data
+                cache_memoize(key, lambda: [data], large_data=True)
+
+        timer.done(size)
+        log_timer.done()
+
+    return original_files
+
+
+def _get_original_file_cache_key(filediff):
+    return "%s:%s:%s" % (filediff.diffset.repository.path,
+                         urlquote(filediff.source_file),
+                         filediff.source_revision)
+
+
 def get_patched_file(buffer, filediff):
-    return patch(filediff.diff, buffer, filediff.dest_file)
+    timer = time_stage('patch')
+    data = get_cached_patch(filediff.diff, buffer, filediff.dest_file)
+    timer.done()
+
+    return data
+
+
+def get_cached_patch(diff, file, filename):
+    """Apply a diff to a file, caching the result.
+
+    The result is keyed on hashes of the file and the diff, rather than
+    on anything about the FileDiff, so identical diffs uploaded to different
+    review requests share the result. It's stored in a local on-disk cache
+    (if one is configured) and in the main cache.
+    """
+    if diff.strip() == "":
+        return file
+
+    file_hash = sha_constructor(file).hexdigest()
+    diff_hash = sha_constructor(diff).hexdigest()
+
+    siteconfig = SiteConfiguration.objects.get_current()
+    cache_dir = siteconfig.get('diffviewer_patched_file_cache_dir')
+    disk_cache = None
+
+    if cache_dir:
+        disk_cache = get_disk_cache(
+            cache_dir,
+            siteconfig.get('diffviewer_patched_file_cache_size') * 1024 * 1024)
+        data = disk_cache.get(file_hash + diff_hash)
+
+        if data is not None:
+            return data
+
+    # See get_original_file for why this is wrapped in a list.
+    data = cache_memoize("patched-file:%s:%s" % (file_hash, diff_hash),
+                         lambda: [patch(diff, file, filename)],
+                         large_data=True)[0]
+
+    if disk_cache:
+        disk_cache.set(file_hash + diff_hash, data)
+
+    return data
 
 
 def register_interesting_lines_for_filename(differ, filename):
@@ -397,8 +601,157 @@ def register_interesting_lines_for_filename(differ, filename):
         differ.add_interesting_line_regex('header', regex)
 
 
+def get_chunk_settings():
+    """Returns the site settings used when generating chunks.
+
+    These are passed to generate_chunks, which may be run in a separate
+    process without access to the database.
+    """
+    siteconfig = SiteConfiguration.objects.get_current()
+
+    return {
+        'syntax_highlighting_threshold':
+            siteconfig.get('diffviewer_syntax_highlighting_threshold'),
+        'include_space_patterns':
+            siteconfig.get('diffviewer_include_space_patterns'),
+        'context_num_lines': siteconfig.get('diffviewer_context_num_lines'),
+        'incremental_highlighting':
+            siteconfig.get('diffviewer_incremental_highlighting'),
+    }
+
+
+def get_diff_texts(diffset, filediff, interfilediff, force_interdiff,
+                   original_files=None):
+    """Returns the original and modified versions of a file to be diffed.
+
+    This fetches the file from the repository (or the cache, or
+    original_files, as with get_original_file) and applies the diffs
+    needed to get both versions. They're returned as UTF-8 strings, each
+    ending with a newline unless empty.
+
+    SCM exceptions are passed back to the caller.
+    """
+    # There are three ways this function is called:
+    #
+    #     1) filediff, no interfilediff
+    #        - Returns chunks for a single filediff. This is the usual way
+    #          people look at diffs in the diff viewer.
+    #
+    #          In this mode, we get the original file based on the filediff
+    #          and then patch it to get the resulting file.
+    #
+    #          This is also used for interdiffs where the source revision
+    #          has no equivalent modified file but the interdiff revision
+    #          does. It's no different than a standard diff.
+    #
+    #     2) filediff, interfilediff
+    #        - Returns chunks showing the changes between a source filediff
+    #          and the interdiff.
+    #
+    #          This is the typical mode used when showing the changes
+    #          between two diffs. It requires that the file is included in
+    #          both revisions of a diffset.
+    #
+    #     3) filediff, no interfilediff, force_interdiff
+    #        - Returns chunks showing the changes between a source
+    #          diff and an unmodified version of the diff.
+    #
+    #          This is used when the source revision in the diffset contains
+    #          modifications to a file which have then been reverted in the
+    #          interdiff revision. We don't actually have an interfilediff
+    #          in this case, so we have to indicate that we are indeed in
+    #          interdiff mode so that we can special-case this and not
+    #          grab a patched file for the interdiff version.
+
+    assert filediff
+
+    old = get_original_file(filediff, original_files)
+    new = get_patched_file(old, filediff)
+
+    if interfilediff:
+        old = new
+        interdiff_orig = get_original_file(interfilediff, original_files)
+        new = get_patched_file(interdiff_orig, interfilediff)
+    elif force_interdiff:
+        # Basically, revert the change.
+        old, new = new, old
+
+    encoding = diffset.repository.encoding or 'iso-8859-15'
+    timer = time_stage('utf8')
+    old = convert_to_utf8(old, encoding)
+    new = convert_to_utf8(new, encoding)
+    timer.done(len(old) + len(new))
+
+    # Normalize the input so that if there isn't a trailing newline, we add
+    # it.
+    if old and old[-1] != '\n':
+        old += '\n'
+
+    if new and new[-1] != '\n':
+        new += '\n'
+
+    return old, new
+
+
 def get_chunks(diffset, filediff, interfilediff, force_interdiff,
-               enable_syntax_highlighting):
+               enable_syntax_highlighting, line_table=None,
+               original_files=None):
+    """Generates the chunks for a file's diff.
+
+    See get_diff_texts for the ways this can be called.
+    """
+    old, new = get_diff_texts(diffset, filediff, interfilediff,
+                              force_interdiff, original_files)
+
+    if enable_syntax_highlighting:
+        markup = get_cached_markup(old, new, filediff.source_file,
+                                   filediff.dest_file)
+    else:
+        markup = None
+
+    highlighted = {}
+
+    if interfilediff:
+        log_timer = log_timed(
+            "Generating diff chunks for interdiff ids %s-%s (%s)" %
+            (filediff.id, interfilediff.id, filediff.source_file))
+    else:
+        log_timer = log_timed(
+            "Generating diff chunks for filediff id %s (%s)" %
+            (filediff.id, filediff.source_file))
+
+    for chunk in time_iteration('chunks',
+                                generate_chunks(old, new,
+                                                filediff.source_file,
+                                                filediff.dest_file,
+                                                diffset.diffcompat,
+                                                enable_syntax_highlighting,
+                                                get_chunk_settings(),
+                                                line_table, markup,
+                                                highlighted)):
+        yield chunk
+
+    log_timer.done()
+
+    cache_markup(old, new, filediff.source_file, filediff.dest_file,
+                 highlighted)
+
+
+def generate_chunks(old, new, source_file, dest_file, diffcompat,
+                    enable_syntax_highlighting, settings, line_table=None,
+                    markup=None, highlighted=None):
+    """Generates the chunks for a diff between two versions of a file.
+
+    old and new are the UTF-8 strings returned by get_diff_texts, and
+    settings is the dictionary returned by get_chunk_settings. This doesn't
+    access the database or the cache, so it's safe to call from other
+    processes.
+
+    markup is the dictionary of already highlighted files returned by
+    get_cached_markup, if any. Files that are highlighted in full here are
+    stored in the highlighted dictionary, if passed, to be cached with
+    cache_markup.
+    """
     def diff_line(vlinenum, oldlinenum, newlinenum, oldline, newline,
                   oldmarkup, newmarkup):
         # This function accesses the variable meta, defined in an outer context.
@@ -491,83 +844,6 @@ def get_chunks(diffset, filediff, interfilediff, force_interdiff,
         else:
             last_header_index[0] = last_index
 
-    def apply_pygments(data, filename):
-        # XXX Guessing is preferable but really slow, especially on XML
-        #     files.
-        #if filename.endswith(".xml"):
-        lexer = get_lexer_for_filename(filename, stripnl=False,
-                                       encoding='utf-8')
-        #else:
-        #    lexer = guess_lexer_for_filename(filename, data, stripnl=False)
-
-        try:
-            # This is only available in 0.7 and higher
-            lexer.add_filter('codetagify')
-        except AttributeError:
-            pass
-
-        return pygments.highlight(data, lexer, NoWrapperHtmlFormatter()).splitlines()
-
-
-    # There are three ways this function is called:
-    #
-    #     1) filediff, no interfilediff
-    #        - Returns chunks for a single filediff. This is the usual way
-    #          people look at diffs in the diff viewer.
-    #
-    #          In this mode, we get the original file based on the filediff
-    #          and then patch it to get the resulting file.
-    #
-    #          This is also used for interdiffs where the source revision
-    #          has no equivalent modified file but the interdiff revision
-    #          does. It's no different than a standard diff.
-    #
-    #     2) filediff, interfilediff
-    #        - Returns chunks showing the changes between a source filediff
-    #          and the interdiff.
-    #
-    #          This is the typical mode used when showing the changes
-    #          between two diffs. It requires that the file is included in
-    #          both revisions of a diffset.
-    #
-    #     3) filediff, no interfilediff, force_interdiff
-    #        - Returns chunks showing the changes between a source
-    #          diff and an unmodified version of the diff.
-    #
-    #          This is used when the source revision in the diffset contains
-    #          modifications to a file which have then been reverted in the
-    #          interdiff revision. We don't actually have an interfilediff
-    #          in this case, so we have to indicate that we are indeed in
-    #          interdiff mode so that we can special-case this and not
-    #          grab a patched file for the interdiff version.
-
-    assert filediff
-
-    file = filediff.source_file
-
-    old = get_original_file(filediff)
-    new = get_patched_file(old, filediff)
-
-    if interfilediff:
-        old = new
-        interdiff_orig = get_original_file(interfilediff)
-        new = get_patched_file(interdiff_orig, interfilediff)
-    elif force_interdiff:
-        # Basically, revert the change.
-        old, new = new, old
-
-    encoding = diffset.repository.encoding or 'iso-8859-15'
-    old = convert_to_utf8(old, encoding)
-    new = convert_to_utf8(new, encoding)
-
-    # Normalize the input so that if there isn't a trailing newline, we add
-    # it.
-    if old and old[-1] != '\n':
-        old += '\n'
-
-    if new and new[-1] != '\n':
-        new += '\n'
-
     a = NEWLINES_RE.split(old or '')
     b = NEWLINES_RE.split(new or '')
 
@@ -579,60 +855,85 @@ def get_chunks(diffset, filediff, interfilediff, force_interdiff,
     a_num_lines = len(a)
     b_num_lines = len(b)
 
-    markup_a = markup_b = None
+    linenum = 1
+    last_header = [None, None]
+    last_header_index = [0, 0]
 
-    siteconfig = SiteConfiguration.objects.get_current()
+    ignore_space = True
+    for pattern in settings['include_space_patterns']:
+        if fnmatch.fnmatch(source_file, pattern):
+            ignore_space = False
+            break
+
+    if not line_table:
+        line_table = LineTable()
 
-    threshold = siteconfig.get('diffviewer_syntax_highlighting_threshold')
+    differ = Differ(a, b, ignore_space=ignore_space,
+                    compat_version=diffcompat,
+                    line_table=line_table)
+
+    # Register any regexes for interesting lines we may want to show.
+    register_interesting_lines_for_filename(differ, source_file)
+
+    # The differ only does the work of diffing the first time its opcodes
+    # are needed.
+    timer = time_stage('diff')
+    opcodes = list(differ.get_opcodes())
+    timer.done()
+
+    markup_a = markup_b = None
+
+    threshold = settings['syntax_highlighting_threshold']
 
     if threshold and (a_num_lines > threshold or b_num_lines > threshold):
         enable_syntax_highlighting = False
 
     if enable_syntax_highlighting:
+        if markup is None:
+            markup = {}
+
+        if highlighted is None:
+            highlighted = {}
+
+        timer = time_stage('highlight')
+
         try:
-            # TODO: Try to figure out the right lexer for these files
-            #       once instead of twice.
-            markup_a = apply_pygments(old or '', filediff.source_file)
-            markup_b = apply_pygments(new or '', filediff.dest_file)
+            markup_a = markup.get('old')
+
+            if markup_a is None:
+                markup_a = highlight(old or '', get_lexer(source_file))
+                highlighted['old'] = markup_a
+
+            markup_b = markup.get('new')
+
+            if markup_b is None:
+                lexer_b = get_lexer(dest_file)
+
+                if (settings['incremental_highlighting'] and
+                    type(lexer_b) is get_lexer_class(source_file)):
+                    markup_b = highlight_incrementally(markup_a, a, b,
+                                                       opcodes, lexer_b)
+
+                if markup_b is None:
+                    markup_b = highlight(new or '', lexer_b)
+                    highlighted['new'] = markup_b
         except ValueError:
             pass
 
+        timer.done()
+
     if not markup_a:
         markup_a = NEWLINES_RE.split(escape(old))
 
     if not markup_b:
         markup_b = NEWLINES_RE.split(escape(new))
 
-    linenum = 1
-    last_header = [None, None]
-    last_header_index = [0, 0]
-
-    ignore_space = True
-    for pattern in siteconfig.get("diffviewer_include_space_patterns"):
-        if fnmatch.fnmatch(file, pattern):
-            ignore_space = False
-            break
-
-    differ = Differ(a, b, ignore_space=ignore_space,
-                    compat_version=diffset.diffcompat)
-
-    # Register any regexes for interesting lines we may want to show.
-    register_interesting_lines_for_filename(differ, file)
-
     # TODO: Make this back into a preference if people really want it.
-    context_num_lines = siteconfig.get("diffviewer_context_num_lines")
+    context_num_lines = settings['context_num_lines']
     collapse_threshold = 2 * context_num_lines + 3
 
-    if interfilediff:
-        log_timer = log_timed(
-            "Generating diff chunks for interdiff ids %s-%s (%s)" %
-            (filediff.id, interfilediff.id, filediff.source_file))
-    else:
-        log_timer = log_timed(
-            "Generating diff chunks for filediff id %s (%s)" %
-            (filediff.id, filediff.source_file))
-
-    for tag, i1, i2, j1, j2, meta in opcodes_with_metadata(differ):
+    for tag, i1, i2, j1, j2, meta in opcodes_with_metadata(differ,
+                                                           line_table):
         oldlines = markup_a[i1:i2]
         newlines = markup_b[j1:j2]
         numlines = max(len(oldlines), len(newlines))
@@ -662,8 +963,6 @@ def get_chunks(diffset, filediff, interfilediff, force_interdiff,
 
         linenum += numlines
 
-    log_timer.done()
-
 
 def is_valid_move_range(lines):
     """Determines if a move range is valid and should be included.
@@ -684,18 +983,28 @@ def is_valid_move_range(lines):
     return False
 
 
-def opcodes_with_metadata(differ):
+def opcodes_with_metadata(differ, line_table=None):
     """Returns opcodes from the differ with extra metadata.
 
     This is a wrapper around a differ's get_opcodes function, which returns
     extra metadata along with each range. That metadata includes information
     on moved blocks of code and whitespace-only lines.
 
+    Lines are compared using codes from the LineTable, if one is passed.
+
     This returns a list of opcodes as tuples in the form of
     (tag, i1, i2, j1, j2, meta).
     """
+    if not line_table:
+        line_table = LineTable()
+
+    get_code = line_table.get_code
+    get_stripped_code = line_table.get_stripped_code
+    get_no_whitespace_code = line_table.get_no_whitespace_code
+
     groups = []
     removes = {}
+    removed_codes = {}
     inserts = []
 
     for tag, i1, i2, j1, j2 in differ.get_opcodes():
@@ -712,8 +1021,8 @@ def opcodes_with_metadata(differ):
             assert (i2 - i1) == (j2 - j1)
 
             for i, j in zip(xrange(i1, i2), xrange(j1, j2)):
-                if (WHITESPACE_RE.sub("", differ.a[i]) ==
-                    WHITESPACE_RE.sub("", differ.b[j])):
+                if (get_no_whitespace_code(get_code(differ.a[i])) ==
+                    get_no_whitespace_code(get_code(differ.b[j]))):
                     # Both original lines are equal when removing all
                     # whitespace, so include their original line number in
                     # the meta dict.
@@ -727,178 +1036,95 @@ def opcodes_with_metadata(differ):
         group = (tag, i1, i2, j1, j2, meta)
         groups.append(group)
 
-        # Store delete/insert ranges for later lookup. We will be building
-        # keys that in most cases will be unique for the particular block
-        # of text being inserted/deleted. There is a chance of collision,
-        # so we store a list of matching groups under that key.
-        #
-        # Later, we will loop through the keys and attempt to find insert
-        # keys/groups that match remove keys/groups.
+        # Store the stripped code of each deleted line, and the first
+        # deleted line and group for each code, for finding moves later.
         if tag == 'delete':
             for i in xrange(i1, i2):
-                line = differ.a[i].strip()
+                code = get_stripped_code(get_code(differ.a[i]))
+
+                if code:
+                    removed_codes[i] = code
 
-                if line:
-                    removes.setdefault(line, []).append((i, group))
+                    if code not in removes:
+                        removes[code] = (i, group)
         elif tag == 'insert':
             inserts.append(group)
 
-    # We now need to figure out all the moved locations.
-    #
-    # At this point, we know all the inserted groups, and all the individually
-    # deleted lines. We'll be going through and finding consecutive groups
-    # of matching inserts/deletes that represent a move block.
-    #
-    # The algorithm will be documented as we go in the code.
-    #
-    # We start by looping through all the inserted groups.
-    for itag, ii1, ii2, ij1, ij2, imeta in inserts:
-        # Store some state on the range we'll be working with inside this
-        # insert group.
-        #
-        # i_move_cur is the current location inside the insert group
-        # (from ij1 through ij2).
-        #
-        # i_move_range is the current range of consecutive lines that we'll
-        # use for a move. Each line in this range has a corresponding
-        # consecutive delete line.
-        #
-        # r_move_ranges represents deleted move ranges. The key is a
-        # string in the form of "{i1}-{i2}-{j1}-{j2}", with those positions
-        # taken from the remove group for the line. The value
-        # is an array of tuples of (r_start, r_end, r_group). These values
-        # are used to quickly locate deleted lines we've found that match
-        # the inserted lines, so we can assemble ranges later.
-        i_move_cur = ij1
-        i_move_range = (i_move_cur, i_move_cur)
-        r_move_ranges = {} # key -> [(start, end, group)]
-
-        # Loop through every location from ij1 through ij2 until we've
-        # reached the end.
-        while i_move_cur <= ij2:
-            try:
-                iline = differ.b[i_move_cur].strip()
-            except IndexError:
-                iline = None
-
-            if iline is not None and iline in removes:
-                # The inserted line at this location has a corresponding
-                # removed line.
-                #
-                # If there's already some information on removed line ranges
-                # for this particular move block we're processing then we'll
-                # update the range.
-                #
-                # The way we do that is to find each removed line that
-                # matches this inserted line, and for each of those find
-                # out if there's an existing move range that the found
-                # removed line immediately follows. If there is, we update
-                # the existing range.
-                #
-                # If there isn't any move information for this line, we'll
-                # simply add it to the move ranges.
-                for ri, rgroup in removes.get(iline, []):
-                    key = "%s-%s-%s-%s" % rgroup[1:5]
-
-                    if r_move_ranges:
-                        for i, r_move_range in \
-                            enumerate(r_move_ranges.get(key, [])):
-                            # If the remove information for the line is next in
-                            # the sequence for this calculated move range...
-                            if ri == r_move_range[1] + 1:
-                                r_move_ranges[key][i] = (r_move_range[0], ri,
-                                                         rgroup)
-                                break
-                    else:
-                        # We don't have any move ranges yet, so it's time to
-                        # build one based on any removed lines we find that
-                        # match the inserted line.
-                        r_move_ranges[key] = [(ri, ri, rgroup)]
-
-                # On to the next line in the sequence...
-                i_move_cur += 1
-            else:
-                # We've reached the very end of the insert group. See if
-                # we have anything that looks like a move.
-                if r_move_ranges:
-                    r_move_range = None
-
-                    # Go through every range of lines we've found and
-                    # find the longest.
-                    #
-                    # The longest move range wins. If we find two ranges that
-                    # are equal, though, we'll ignore both. The idea is that
-                    # if we have two identical moves, then it's probably
-                    # common enough code that we don't want to show the move.
-                    # An example might be some standard part of a comment
-                    # block, with no real changes in content.
-                    #
-                    # Note that with the current approach, finding duplicate
-                    # moves doesn't cause us to reset the winning range
-                    # to the second-highest identical match. We may want to
-                    # do that down the road, but it means additional state,
-                    # and this is hopefully uncommon enough to not be a real
-                    # problem.
-                    for ranges in r_move_ranges.itervalues():
-                        for r1, r2, rgroup in ranges:
-                            if not r_move_range:
-                                r_move_range = (r1, r2, rgroup)
-                            else:
-                                len1 = r_move_range[2] - r_move_range[1]
-                                len2 = r2 - r1
-
-                                if len1 < len2:
-                                    r_move_range = (r1, r2, rgroup)
-                                elif len1 == len2:
-                                    # If there are two that are the same, it
-                                    # may be common code that we don't want to
-                                    # see moves for. Comments, for example.
-                                    r_move_range = None
-
-                    # If we have a move range, see if it's one we want to
-                    # include or filter out. Some moves are not impressive
-                    # enough to display. For example, a small portion of a
-                    # comment, or whitespace-only changes.
-                    if (r_move_range and
-                        is_valid_move_range(
-                            differ.a[r_move_range[0]:r_move_range[1]])):
-
-                        # Rebuild the insert and remove ranges based on
-                        # where we are now and which range we won.
-                        #
-                        # The new ranges will be actual lists of positions,
-                        # rather than a beginning and end. These will be
-                        # provided to the renderer.
-                        #
-                        # The ranges expected by the renderers are 1-based,
-                        # whereas our calculations for this algorithm are
-                        # 0-based, so we add 1 to the numbers.
-                        #
-                        # The upper boundaries passed to the range() function
-                        # must actually be one higher than the value we want.
-                        # So, for r_move_range, we actually increment by 2.
-                        # We only increment i_move_cur by one, because
-                        # i_move_cur already factored in the + 1 by being
-                        # at the end of the while loop.
-                        i_move_range = range(i_move_range[0] + 1,
-                                             i_move_cur + 1)
-                        r_move_range = range(r_move_range[0] + 1,
-                                             r_move_range[1] + 2)
-
-                        rmeta = rgroup[-1]
-                        rmeta.setdefault('moved', {}).update(
-                            dict(zip(r_move_range, i_move_range)))
-                        imeta.setdefault('moved', {}).update(
-                            dict(zip(i_move_range, r_move_range)))
-
-                # Reset the state for the next range.
-                i_move_cur += 1
-                i_move_range = (i_move_cur, i_move_cur)
-                r_move_ranges = {}
+    timer = time_stage('moves')
+
+    for group in inserts:
+        _find_moves(differ, group, removes, removed_codes, line_table)
+
+    timer.done()
 
     return groups
 
 
+def _find_moves(differ, group, removes, removed_codes, line_table):
+    """Finds the lines in an insert group that were moved from deletes.
+
+    The inserted lines are split into runs of lines that each match some
+    deleted line. Each run is matched against a range of deleted lines
+    that starts at the first deleted line matching the run's first line.
+    The range is extended whenever a line in the run matches the deleted
+    line just past its end, within the same delete group. Lines are
+    compared by their stripped codes, so each line takes constant time.
+
+    If the range contains enough content (see is_valid_move_range), the
+    'moved' metadata of the insert group and the delete group is updated
+    to map the lines of the run and the range to each other.
+    """
+    get_code = line_table.get_code
+    get_stripped_code = line_table.get_stripped_code
+    b = differ.b
+    b_num_lines = len(b)
+    imeta = group[-1]
+    ij1, ij2 = group[3:5]
+
+    # The current run of inserted lines starts at run_start. The range of
+    # deleted lines it's matched against is r_start through r_end,
+    # inclusive, in rgroup.
+    run_start = ij1
+    rgroup = None
+
+    # This also looks at the line after the group, which may extend the
+    # last run.
+    for j in xrange(ij1, ij2 + 1):
+        if j < b_num_lines:
+            code = get_stripped_code(get_code(b[j]))
+        else:
+            code = None
+
+        if code and code in removes:
+            if rgroup is None:
+                r_start, rgroup = removes[code]
+                r_end = r_start
+
+            # Extend the range over each deleted line past its end that
+            # matches this line.
+            r_group_end = rgroup[2]
+
+            while (r_end + 1 < r_group_end and
+                   removed_codes.get(r_end + 1) == code):
+                r_end += 1
+
+            continue
+
+        if (rgroup is not None and
+            is_valid_move_range(differ.a[r_start:r_end])):
+            # The line numbers in the metadata are 1-based.
+            i_move_range = range(run_start + 1, j + 1)
+            r_move_range = range(r_start + 1, r_end + 2)
+
+            rgroup[-1].setdefault('moved', {}).update(
+                dict(zip(r_move_range, i_move_range)))
+            imeta.setdefault('moved', {}).update(
+                dict(zip(i_move_range, r_move_range)))
+
+        run_start = j + 1
+        rgroup = None
+
+
 def get_revision_str(revision):
     if revision == HEAD:
         return "HEAD"
@@ -910,7 +1136,16 @@ def get_revision_str(revision):
 
 def get_diff_files(diffset, filediff=None, interdiffset=None,
                    enable_syntax_highlighting=True,
-                   load_chunks=True):
+                   load_chunks=True, stream_chunks=False):
+    """Returns information on the files in a diffset.
+
+    If load_chunks is True, each file's chunks are loaded from the cache,
+    or generated and cached if they're not yet there. If stream_chunks is
+    also True, chunks that aren't already cached are not generated up front.
+    Instead, the file's 'chunks' will be a ChunkStream, which generates them
+    as it's iterated over. The file's 'streaming' key will be set to True
+    when this happens.
+    """
     if filediff:
         filediffs = [filediff]
 
@@ -943,12 +1178,6 @@ def get_diff_files(diffset, filediff=None, interdiffset=None,
                filediff.source_file == interfilediff.source_file:
                 interdiff_map[interfilediff.source_file] = interfilediff
 
-    key_prefix = "diff-sidebyside-"
-
-    if enable_syntax_highlighting:
-        key_prefix += "hl-"
-
-
     # In order to support interdiffs properly, we need to display diffs
     # on every file in the union of both diffsets. Iterating over one diffset
     # or the other doesn't suffice.
@@ -983,8 +1212,17 @@ def get_diff_files(diffset, filediff=None, interdiffset=None,
                            for interdiff in interdiff_map.values()]
 
 
+    # Lines are interned once for all the files we process, since many will
+    # share things like license headers and imports.
+    line_table = LineTable()
+
     files = []
 
+    # Files whose chunks need to be loaded, along with what's needed to
+    # load them. These are all loaded at once after the loop below.
+    files_to_load = []
+    chunk_specs = []
+
     for parts in filediff_parts:
         filediff, interfilediff, force_interdiff = parts
 
@@ -1038,43 +1276,59 @@ def get_diff_files(diffset, filediff=None, interdiffset=None,
         }
 
         if load_chunks:
-            chunks = []
-
-            if not filediff.binary and not filediff.deleted:
-                key = key_prefix
-
-                if not force_interdiff:
-                    key += str(filediff.id)
-                elif interfilediff:
-                    key += "interdiff-%s-%s" % (filediff.id, interfilediff.id)
-                else:
-                    key += "interdiff-%s-none" % filediff.id
-
-                chunks = cache_memoize(
-                    key,
-                    lambda: list(get_chunks(filediff.diffset,
-                                            filediff, interfilediff,
-                                            force_interdiff,
-                                            enable_syntax_highlighting)),
-                    large_data=True)
-
-            file['chunks'] = chunks
+            file['chunks'] = []
             file['changed_chunk_indexes'] = []
             file['whitespace_only'] = True
+            file['num_changes'] = 0
 
-            for j, chunk in enumerate(file['chunks']):
-                chunk['index'] = j
+            if not filediff.binary and not filediff.deleted:
+                key = get_chunks_cache_key(filediff, interfilediff,
+                                           force_interdiff,
+                                           enable_syntax_highlighting)
+                chunks = None
+
+                if stream_chunks:
+                    chunks = get_cached_chunks(key)
+
+                    if chunks is None:
+                        # The chunks are generated after the response has
+                        # been returned and the request's database
+                        # connection closed, so load everything that needs
+                        # the database now.
+                        for f in (filediff, interfilediff):
+                            if f:
+                                f.diffset.repository.tool
+                                f.diffset.repository.encoding
+
+                        file['chunks'] = ChunkStream(
+                            file, key,
+                            get_chunks(filediff.diffset, filediff,
+                                       interfilediff, force_interdiff,
+                                       enable_syntax_highlighting,
+                                       line_table))
+                        file['streaming'] = True
+
+                if chunks is not None:
+                    file['chunks'] = chunks
+                elif not stream_chunks:
+                    chunk_specs.append((key, filediff.diffset, filediff,
+                                        interfilediff, force_interdiff))
+                    files_to_load.append(file)
 
-                if chunk['change'] != 'equal':
-                    file['changed_chunk_indexes'].append(j)
-                    meta = chunk.get('meta', {})
+        files.append(file)
 
-                    if not meta.get('whitespace_chunk', False):
-                        file['whitespace_only'] = False
+    if chunk_specs:
+        chunk_lists = load_chunks(chunk_specs, enable_syntax_highlighting,
+                                  line_table)
 
-            file['num_changes'] = len(file['changed_chunk_indexes'])
+        for file, chunks in zip(files_to_load, chunk_lists):
+            file['chunks'] = chunks
 
-        files.append(file)
+    if load_chunks:
+        for file in files:
+            if not file.get('streaming', False):
+                for j, chunk in enumerate(file['chunks']):
+                    add_chunk_info(file, j, chunk)
 
     def cmp_file(x, y):
         # Sort based on basepath in asc order
@@ -1097,6 +1351,397 @@ def get_diff_files(diffset, filediff=None, interdiffset=None,
     return files
 
 
+def add_chunk_info(file, index, chunk):
+    """Records a chunk in a file's list of changes.
+
+    This sets the chunk's index and updates the file's
+    'changed_chunk_indexes', 'whitespace_only' and 'num_changes' keys.
+    """
+    chunk['index'] = index
+
+    if chunk['change'] != 'equal':
+        file['changed_chunk_indexes'].append(index)
+        file['num_changes'] += 1
+        meta = chunk.get('meta', {})
+
+        if not meta.get('whitespace_chunk', False):
+            file['whitespace_only'] = False
+
+
+class _CacheMiss(Exception):
+    pass
+
+
+def _raise_cache_miss():
+    raise _CacheMiss
+
+
+def get_cached_chunks(key):
+    """Returns the chunks cached for a key, or None if they aren't cached.
+
+    The lines of each chunk are decoded from the cache as they're accessed
+    (see PackedChunks).
+    """
+    timer = time_stage('cache_get')
+
+    try:
+        chunks = cache_memoize(key, _raise_cache_miss, large_data=True)
+    except _CacheMiss:
+        timer.done()
+        return None
+
+    if isinstance(chunks, PackedChunks):
+        timer.done(chunks.get_size())
+        return chunks.unpack()
+    else:
+        # This was cached as a plain list, before chunks were packed.
+        timer.done()
+        return chunks
+
+
+def cache_chunks(key, chunks):
+    """Stores a list of chunks in the cache, packed into a PackedChunks."""
+    timer = time_stage('cache_set')
+    packed = pack_chunks(chunks)
+    cache_memoize(key, lambda: packed, force_overwrite=True, large_data=True)
+    timer.done(packed.get_size())
+
+
+def cache_chunks_in_background(key, chunks):
+    """Stores a list of chunks in the cache from a separate thread.
+
+    Large diffs can take a while to pack and send to the cache, and by
+    the time we're storing them, everything else is done. This lets the
+    response finish without waiting on that.
+
+    Returns the thread doing the caching.
+    """
+    thread = threading.Thread(target=cache_chunks, args=(key, chunks))
+    thread.setDaemon(True)
+    thread.start()
+
+    return thread
+
+
+def get_cached_markup(old, new, source_file, dest_file):
+    """Returns the cached highlighting for the two versions of a file.
+
+    The result is a dictionary containing the highlighted lines of old and
+    new under 'old' and 'new', for whichever of them are cached. It's meant
+    to be passed to generate_chunks.
+    """
+    markup = {}
+
+    for name, data, filename in (('old', old, source_file),
+                                 ('new', new, dest_file)):
+        key = get_markup_cache_key(data, filename)
+
+        if key:
+            timer = time_stage('cache_get')
+
+            try:
+                lines = cache_memoize(key, _raise_cache_miss, large_data=True)
+                markup[name] = lines
+                timer.done(_get_markup_size(lines))
+            except _CacheMiss:
+                timer.done()
+
+    return markup
+
+
+def cache_markup(old, new, source_file, dest_file, markup):
+    """Caches the highlighting for the two versions of a file.
+
+    markup is a dictionary in the form returned by get_cached_markup,
+    usually the highlighted dictionary filled in by generate_chunks.
+    """
+    for name, data, filename in (('old', old, source_file),
+                                 ('new', new, dest_file)):
+        if name in markup:
+            key = get_markup_cache_key(data, filename)
+
+            if key:
+                timer = time_stage('cache_set')
+                cache_memoize(key, lambda: markup[name], large_data=True)
+                timer.done(_get_markup_size(markup[name]))
+
+
+def _get_markup_size(lines):
+    """Returns roughly how many bytes of highlighted lines are cached."""
+    return sum([len(line) for line in lines])
+
+
+def get_chunks_cache_key(filediff, interfilediff, force_interdiff,
+                         enable_syntax_highlighting):
+    """Returns the cache key for the chunks of a file's diff."""
+    key = "diff-sidebyside-"
+
+    if enable_syntax_highlighting:
+        key += "hl-"
+
+    if not force_interdiff:
+        key += str(filediff.id)
+    elif interfilediff:
+        key += "interdiff-%s-%s" % (filediff.id, interfilediff.id)
+    else:
+        key += "interdiff-%s-none" % filediff.id
+
+    return key
+
+
+def load_chunks(chunk_specs, enable_syntax_highlighting, line_table=None):
+    """Loads the chunks for several files, generating any that aren't cached.
+
+    chunk_specs is a list of (key, diffset, filediff, interfilediff,
+    force_interdiff) tuples. Returns a list of the lists of chunks for each,
+    in the same order.
+
+    If more than one file needs to be generated, the original versions of
+    the files are fetched from the repository at once (see
+    prefetch_original_files). They're then patched using a pool of threads,
+    and diffed and highlighted using a pool of processes, depending on the
+    diffviewer_fetch_threads and diffviewer_chunk_processes settings. The
+    results are cached under the same keys as if they'd been generated one
+    at a time.
+
+    If any file fails, the first error is raised once the others are done.
+    """
+    results = [get_cached_chunks(spec[0]) for spec in chunk_specs]
+    missing = [i for i, chunks in enumerate(results) if chunks is None]
+
+    siteconfig = SiteConfiguration.objects.get_current()
+    num_threads = siteconfig.get('diffviewer_fetch_threads')
+    num_processes = siteconfig.get('diffviewer_chunk_processes')
+
+    if not can_run_in_processes():
+        num_processes = 0
+
+    if len(missing) > 1:
+        # Fetch the original files for all of them at once, rather than one
+        # at a time as each is diffed.
+        filediffs = []
+
+        for i in missing:
+            for f in chunk_specs[i][2:4]:
+                if f:
+                    filediffs.append(f)
+
+        original_files = prefetch_original_files(filediffs)
+    else:
+        original_files = None
+
+    if len(missing) < 2 or (num_threads < 2 and num_processes < 1):
+        for i in missing:
+            key, diffset, filediff, interfilediff, force_interdiff = \
+                chunk_specs[i]
+            results[i] = list(get_chunks(diffset, filediff, interfilediff,
+                                         force_interdiff,
+                                         enable_syntax_highlighting,
+                                         line_table, original_files))
+            cache_chunks(key, results[i])
+
+        return results
+
+    log_timer = log_timed("Generating diff chunks for %d files in parallel" %
+                          len(missing))
+
+    fetch_args = []
+
+    for i in missing:
+        key, diffset, filediff, interfilediff, force_interdiff = \
+            chunk_specs[i]
+
+        # Load everything that needs the database now, so the fetching
+        # threads don't need to.
+        for f in (filediff, interfilediff):
+            if f:
+                f.diffset.repository.tool
+
+        fetch_args.append((diffset, filediff, interfilediff,
+                           force_interdiff, enable_syntax_highlighting,
+                           original_files))
+
+    fetch_results = run_in_threads(_fetch_diff_texts, fetch_args,
+                                   max(num_threads, 1))
+
+    settings = get_chunk_settings()
+    generate_indexes = []
+    generate_args = []
+    generate_results = [None] * len(missing)
+
+    for j, (fetch_result, exc_info) in enumerate(fetch_results):
+        if exc_info:
+            generate_results[j] = (None, exc_info)
+        else:
+            diffset, filediff = fetch_args[j][:2]
+            old, new, markup = fetch_result
+            generate_indexes.append(j)
+            generate_args.append((old, new,
+                                  filediff.source_file, filediff.dest_file,
+                                  diffset.diffcompat,
+                                  enable_syntax_highlighting, settings,
+                                  markup))
+
+    if num_processes > 0:
+        chunk_results = run_in_processes(_generate_chunk_list,
+                                         generate_args, num_processes)
+    else:
+        chunk_results = []
+
+        for args in generate_args:
+            try:
+                chunk_results.append(
+                    (_generate_chunk_list(*(args + (line_table,))), None))
+            except Exception:
+                chunk_results.append((None, sys.exc_info()))
+
+    for j, args, (result, exc_info) in zip(generate_indexes, generate_args,
+                                           chunk_results):
+        if exc_info:
+            generate_results[j] = (None, exc_info)
+        else:
+            chunks, highlighted = result
+            cache_markup(args[0], args[1], args[2], args[3], highlighted)
+            generate_results[j] = (chunks, None)
+
+    first_exc_info = None
+
+    for i, (chunks, exc_info) in zip(missing, generate_results):
+        if exc_info:
+            logging.error("Error generating diff chunks for %s: %s" %
+                          (chunk_specs[i][0], exc_info[1]))
+
+            if not first_exc_info:
+                first_exc_info = exc_info
+        else:
+            results[i] = chunks
+            cache_chunks(chunk_specs[i][0], chunks)
+
+    log_timer.done()
+
+    if first_exc_info:
+        raise first_exc_info[0], first_exc_info[1], first_exc_info[2]
+
+    return results
+
+
+def _fetch_diff_texts(diffset, filediff, interfilediff, force_interdiff,
+                      enable_syntax_highlighting, original_files):
+    try:
+        old, new = get_diff_texts(diffset, filediff, interfilediff,
+                                  force_interdiff, original_files)
+
+        if enable_syntax_highlighting:
+            markup = get_cached_markup(old, new, filediff.source_file,
+                                       filediff.dest_file)
+        else:
+            markup = None
+
+        return old, new, markup
+    finally:
+        # If anything needed the database, it opened a connection for this
+        # thread. Close it before the thread goes away.
+        connection.close()
+
+
+def _generate_chunk_list(old, new, source_file, dest_file, diffcompat,
+                         enable_syntax_highlighting, settings, markup,
+                         line_table=None):
+    highlighted = {}
+    timer = time_stage('chunks')
+    chunks = list(generate_chunks(old, new, source_file, dest_file,
+                                  diffcompat, enable_syntax_highlighting,
+                                  settings, line_table, markup, highlighted))
+    timer.done()
+
+    return chunks, highlighted
+
+
+class ChunkStream(object):
+    """Generates the chunks for a file as they're iterated over.
+
+    This allows the beginning of a large diff to be sent to the browser
+    before the rest of it has been diffed and highlighted. As each chunk is
+    generated, its information is added to the file (see add_chunk_info).
+
+    Once every chunk has been generated, the file's 'chunks' is replaced
+    with the complete list, and the list is cached in the background so
+    that later requests don't need to generate them again.
+
+    A ChunkStream can only be iterated over once. Anything the chunk
+    generator needs from the database should be loaded before the response
+    is returned, since the request's connection will have been closed.
+    """
+    def __init__(self, file, key, chunk_generator):
+        self.file = file
+        self.key = key
+        self.chunk_generator = chunk_generator
+        self.chunks = []
+        self.cache_thread = None
+
+    def __iter__(self):
+        assert not self.chunks, "ChunkStreams can only be iterated over once"
+
+        file = self.file
+        chunks = self.chunks
+
+        # This is usually iterated over after the request has finished. If
+        # anything needed the database, it opened a new connection, which
+        # shouldn't be left open. (Python 2.4 doesn't allow yield within
+        # try/finally.)
+        try:
+            for chunk in self.chunk_generator:
+                add_chunk_info(file, len(chunks), chunk)
+                chunks.append(chunk)
+                yield chunk
+        except:
+            connection.close()
+            raise
+
+        connection.close()
+
+        file['chunks'] = chunks
+        file['streaming'] = False
+        self.cache_thread = cache_chunks_in_background(self.key, chunks)
+
+
+def preload_file_chunks(context, filediff_pairs):
+    """Loads the chunks for several files for get_file_chunks_in_range.
+
+    filediff_pairs is a list of (filediff, interfilediff) tuples, as would
+    be passed to get_file_chunks_in_range. Any of them that aren't cached
+    are generated at once (see load_chunks), so that later calls to
+    get_file_chunks_in_range find them in the cache.
+
+    Errors are logged and otherwise ignored. They'll be raised again when
+    get_file_chunks_in_range is called for the files.
+    """
+    assert 'user' in context
+    enable_syntax_highlighting = get_enable_highlighting(context['user'])
+    chunk_specs = []
+    keys = set()
+
+    for filediff, interfilediff in filediff_pairs:
+        if (filediff.binary or filediff.deleted or
+            (interfilediff and filediff.diff == interfilediff.diff)):
+            # get_diff_files won't generate chunks for these.
+            continue
+
+        force_interdiff = interfilediff is not None
+        key = get_chunks_cache_key(filediff, interfilediff, force_interdiff,
+                                   enable_syntax_highlighting)
+
+        if key not in keys:
+            keys.add(key)
+            chunk_specs.append((key, filediff.diffset, filediff,
+                                interfilediff, force_interdiff))
+
+    try:
+        load_chunks(chunk_specs, enable_syntax_highlighting)
+    except Exception, e:
+        logging.warning("Error preloading diff chunks: %s" % e)
+
+
 def get_file_chunks_in_range(context, filediff, interfilediff,
                              first_line, num_lines):
     """
@@ -1135,10 +1780,12 @@ def get_file_chunks_in_range(context, filediff, interfilediff,
       7        True if line consists of only whitespace changes
       ======== =============================================================
     """
-    def find_header(headers):
-        for header in reversed(headers):
-            if header[0] < first_line:
-                return header[1]
+    def find_header(headers, header_lines):
+        # Find the last header before first_line.
+        i = bisect_left(header_lines, first_line)
+
+        if i > 0:
+            return headers[i - 1][1]
 
     interdiffset = None
 
@@ -1160,19 +1807,35 @@ def get_file_chunks_in_range(context, filediff, interfilediff,
         raise StopIteration
 
     assert len(files) == 1
-    last_header = (None, None)
+    chunks = files[0]['chunks']
+    line_index = get_chunk_line_index(files[0])
+
+    # Find the chunk containing first_line, and the last header from the
+    # chunks before it.
+    chunk_index = bisect_right(line_index['starts'], first_line) - 1
+
+    if chunk_index < 0:
+        raise StopIteration
+
+    if chunk_index > 0:
+        last_header = line_index['last_headers'][chunk_index - 1]
+    else:
+        last_header = (None, None)
+
+    for chunk_index in xrange(chunk_index, len(chunks)):
+        chunk = chunks[chunk_index]
 
-    for chunk in files[0]['chunks']:
         if ('headers' in chunk['meta'] and
             (chunk['meta']['headers'][0] or chunk['meta']['headers'][1])):
             last_header = chunk['meta']['headers']
 
         lines = chunk['lines']
+        chunk_start = line_index['starts'][chunk_index]
 
-        if lines[-1][0] >= first_line >= lines[0][0]:
-            start_index = first_line - lines[0][0]
+        if chunk_start + len(lines) > first_line >= chunk_start:
+            start_index = first_line - chunk_start
 
-            if first_line + num_lines <= lines[-1][0]:
+            if first_line + num_lines < chunk_start + len(lines):
                 last_index = start_index + num_lines
             else:
                 last_index = len(lines)
@@ -1181,12 +1844,18 @@ def get_file_chunks_in_range(context, filediff, interfilediff,
                 'lines': chunk['lines'][start_index:last_index],
                 'numlines': last_index - start_index,
                 'change': chunk['change'],
-                'meta': chunk.get('meta', {}),
+                # This is copied, since the file and its chunks are shared
+                # by every call for the file.
+                'meta': dict(chunk.get('meta', {})),
             }
 
             if 'left_headers' in chunk['meta']:
-                left_header = find_header(chunk['meta']['left_headers'])
-                right_header = find_header(chunk['meta']['right_headers'])
+                left_lines, right_lines = \
+                    line_index['header_lines'][chunk_index]
+                left_header = find_header(chunk['meta']['left_headers'],
+                                          left_lines)
+                right_header = find_header(chunk['meta']['right_headers'],
+                                           right_lines)
                 del new_chunk['meta']['left_headers']
                 del new_chunk['meta']['right_headers']
 
@@ -1208,6 +1877,61 @@ def get_file_chunks_in_range(context, filediff, interfilediff,
             assert num_lines >= 0
             if num_lines == 0:
                 break
+        else:
+            break
+
+
+def get_chunk_line_index(file):
+    """Returns an index for looking up lines in a file's chunks.
+
+    This lets get_file_chunks_in_range find the chunk containing a line
+    without going through every chunk before it. The index is a dictionary
+    containing:
+
+      ================ ====================================================
+      Key              Description
+      ================ ====================================================
+      ``starts``       The virtual line number of the first line of each
+                       chunk.
+      ``last_headers`` The last non-empty headers in the metadata of each
+                       chunk or the chunks before it, or (None, None).
+      ``header_lines`` The line numbers of the left and right headers of
+                       each chunk.
+      ================ ====================================================
+
+    It's built the first time it's needed and then stored in the file.
+    """
+    if 'chunk_line_index' in file:
+        return file['chunk_line_index']
+
+    starts = []
+    last_headers = []
+    header_lines = []
+    linenum = 1
+    last_header = (None, None)
+
+    for chunk in file['chunks']:
+        meta = chunk['meta']
+
+        # Virtual line numbers run through all the chunks without gaps.
+        starts.append(linenum)
+        linenum += chunk['numlines']
+
+        if 'headers' in meta and (meta['headers'][0] or meta['headers'][1]):
+            last_header = meta['headers']
+
+        last_headers.append(last_header)
+        header_lines.append(
+            ([header[0] for header in meta.get('left_headers', [])],
+             [header[0] for header in meta.get('right_headers', [])]))
+
+    file['chunk_line_index'] = {
+        'starts': starts,
+        'last_headers': last_headers,
+        'header_lines': header_lines,
+    }
+
+    return file['chunk_line_index']
 
 
 def get_enable_highlighting(user):
@@ -0,0 +1,236 @@
+"""A size-limited, on-disk cache for file contents.
+
+This is used to store patched files, keyed on hashes of their contents and
+the diffs applied to them. Since the keys are content-addressed, entries
+never need to be invalidated, only evicted when the cache grows too large.
+The least recently used entries are evicted first, based on their
+modification times, which are updated on every hit.
+"""
+
+import errno
+import logging
+import os
+import tempfile
+import threading
+
+
+class DiskCache(object):
+    """A content-addressed file cache stored in a directory.
+
+    Entries are spread across subdirectories named after the first two
+    characters of their keys, to keep directory sizes reasonable. Keys are
+    expected to be hex digests.
+
+    Once the total size goes over max_size bytes, the least recently used
+    entries are removed until the cache is back down to ``PRUNE_RATIO`` of
+    that size.
+
+    Since cached files are read back and served as-is, the directory is
+    created readable only by the current user, and an existing directory
+    owned by another user is never used.
+    """
+    PRUNE_RATIO = 0.8
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.total_size = None
+        self.usable = None
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the data stored for a key, or None if it's not cached."""
+        if not self._check_usable():
+            return None
+
+        filename = self._get_filename(key)
+
+        try:
+            f = open(filename, 'rb')
+        except IOError:
+            return None
+
+        try:
+            data = f.read()
+        finally:
+            f.close()
+
+        try:
+            # Mark this as recently used.
+            os.utime(filename, None)
+        except OSError:
+            pass
+
+        return data
+
+    def set(self, key, data):
+        """Stores data for a key.
+
+        Errors writing to the cache are logged and otherwise ignored, since
+        the cache is only an optimization.
+        """
+        if not self._check_usable():
+            return
+
+        filename = self._get_filename(key)
+        dirname = os.path.dirname(filename)
+
+        try:
+            if not os.path.exists(dirname):
+                try:
+                    os.mkdir(dirname, 0700)
+                except OSError, e:
+                    # Another process may have just created it.
+                    if e.errno != errno.EEXIST:
+                        raise
+
+            # Write to a temporary file and then rename it into place, so
+            # readers never see a partially written entry.
+            fd, tmpfilename = tempfile.mkstemp(dir=dirname)
+            f = os.fdopen(fd, 'wb')
+
+            try:
+                f.write(data)
+            finally:
+                f.close()
+
+            # If this replaces an existing entry, only the difference in
+            # size counts towards the total.
+            try:
+                old_size = os.stat(filename).st_size
+            except OSError:
+                old_size = 0
+
+            os.rename(tmpfilename, filename)
+        except (IOError, OSError), e:
+            logging.warning("Unable to write to the file cache at %s: %s" %
+                            (self.path, e))
+            return
+
+        self.lock.acquire()
+
+        try:
+            if self.total_size is None:
+                self.total_size = self._compute_size()
+            else:
+                self.total_size += len(data) - old_size
+
+            if self.total_size > self.max_size:
+                self._prune()
+        finally:
+            self.lock.release()
+
+    def _check_usable(self):
+        """Returns whether the cache directory can safely be used.
+
+        The directory is created if it doesn't exist. This is only checked
+        once per instance.
+        """
+        if self.usable is None:
+            self.usable = self._prepare_path()
+
+        return self.usable
+
+    def _prepare_path(self):
+        try:
+            os.makedirs(self.path, 0700)
+            return True
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                logging.warning("Unable to create the file cache at %s: %s" %
+                                (self.path, e))
+                return False
+
+        try:
+            st = os.stat(self.path)
+        except OSError, e:
+            logging.warning("Unable to access the file cache at %s: %s" %
+                            (self.path, e))
+            return False
+
+        if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+            logging.error("Not using the file cache at %s, since it's owned "
+                          "by another user" % self.path)
+            return False
+
+        return True
+
+    def _get_filename(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def _get_entries(self):
+        """Returns a list of (mtime, size, filename) for every entry."""
+        entries = []
+
+        if not os.path.isdir(self.path):
+            return entries
+
+        for dirname in os.listdir(self.path):
+            dirpath = os.path.join(self.path, dirname)
+
+            if not os.path.isdir(dirpath):
+                continue
+
+            for filename in os.listdir(dirpath):
+                filename = os.path.join(dirpath, filename)
+
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    # It was removed by another process.
+                    continue
+
+                entries.append((st.st_mtime, st.st_size, filename))
+
+        return entries
+
+    def _compute_size(self):
+        size = 0
+
+        for mtime, entry_size, filename in self._get_entries():
+            size += entry_size
+
+        return size
+
+    def _prune(self):
+        """Removes the least recently used entries.
+
+        The directory is rescanned first, since other processes share the
+        cache and may have added or removed entries.
+        """
+        entries = self._get_entries()
+        entries.sort()
+
+        self.total_size = 0
+
+        for mtime, size, filename in entries:
+            self.total_size += size
+
+        target_size = self.max_size * self.PRUNE_RATIO
+
+        for mtime, size, filename in entries:
+            if self.total_size <= target_size:
+                break
+
+            try:
+                os.unlink(filename)
+                self.total_size -= size
+            except OSError:
+                pass
+
+
+_disk_caches = {}
+
+
+def get_disk_cache(path, max_size):
+    """Returns the shared DiskCache for a path.
+
+    Caches are kept around for the life of the process so that the
+    total size only needs to be computed once.
+    """
+    key = (path, max_size)
+
+    if key not in _disk_caches:
+        _disk_caches[key] = DiskCache(path, max_size)
+
+    return _disk_caches[key]
@@ -1,8 +1,10 @@
 import os
 
 from django import forms
+from django.db import transaction
 from django.utils.encoding import smart_unicode
 from django.utils.translation import ugettext as _
+from djblets.siteconfig.models import SiteConfiguration
 
 from reviewboard.diffviewer.diffutils import DEFAULT_DIFF_COMPAT_VERSION
 from reviewboard.diffviewer.models import DiffSet, FileDiff
@@ -59,8 +61,8 @@ class UploadDiffForm(forms.Form):
             basedir = ''
 
         # Parse the diff
-        files = list(self._process_files(
-            diff_file, basedir, check_existance=(not parent_diff_file)))
+        files = self._process_files(diff_file, basedir,
+                                    check_existance=(not parent_diff_file))
 
         if len(files) == 0:
             raise EmptyDiffError(_("The diff file is empty"))
@@ -93,7 +95,7 @@ class UploadDiffForm(forms.Form):
                           history=diffset_history,
                           diffcompat=DEFAULT_DIFF_COMPAT_VERSION)
         diffset.repository = self.repository
-        diffset.save()
+        filediffs = []
 
         for f in files:
             if f.origFile in parent_files:
@@ -117,8 +119,7 @@ class UploadDiffForm(forms.Form):
             else:
                 status = FileDiff.MODIFIED
 
-            filediff = FileDiff(diffset=diffset,
-                                source_file=f.origFile,
+            filediff = FileDiff(source_file=f.origFile,
                                 dest_file=dest_file,
                                 source_revision=smart_unicode(source_rev),
                                 dest_detail=f.newInfo,
@@ -126,12 +127,33 @@ class UploadDiffForm(forms.Form):
                                 parent_diff=parent_content,
                                 binary=f.binary,
                                 status=status)
-            filediff.save()
+            filediffs.append(filediff)
+
+        self._save_diffset(diffset, filediffs)
 
         return diffset
 
+    @transaction.commit_on_success
+    def _save_diffset(self, diffset, filediffs):
+        """Saves a new DiffSet and its FileDiffs in one transaction."""
+        diffset.save()
+
+        for filediff in filediffs:
+            filediff.diffset = diffset
+
+        FileDiff.objects.bulk_create(filediffs)
+
     def _process_files(self, file, basedir, check_existance=False):
+        """Parses a diff, returning its files.
+
+        If check_existance is True, this makes sure that the original
+        version of every modified file exists in the repository, raising
+        FileNotFoundError if one doesn't. The files are all checked at
+        once using SCMTool.file_exists_many.
+        """
         tool = self.repository.get_scmtool()
+        files = []
+        exists_args = []
 
         for f in tool.get_parser(file.read()).parse():
             f2, revision = tool.parse_diff_revision(f.origFile, f.origInfo)
@@ -140,20 +162,30 @@ class UploadDiffForm(forms.Form):
             else:
                 filename = os.path.join(basedir, f2).replace("\\", "/")
 
-            # FIXME: this would be a good place to find permissions errors
-            if (revision != PRE_CREATION and
+            if (check_existance and
+                revision != PRE_CREATION and
                 revision != UNKNOWN and
                 not f.binary and
-                not f.deleted and
-                (check_existance and
-                 not tool.file_exists(filename, revision))):
-                raise FileNotFoundError(filename, revision)
+                not f.deleted):
+                exists_args.append((filename, revision))
 
             f.origFile = filename
             f.origInfo = revision
 
-            yield f
+            files.append(f)
+
+        if exists_args:
+            siteconfig = SiteConfiguration.objects.get_current()
+            num_threads = max(siteconfig.get('diffviewer_fetch_threads'), 1)
+
+            results = tool.file_exists_many(exists_args, num_threads)
+
+            # FIXME: this would be a good place to find permissions errors
+            for (filename, revision), exists in zip(exists_args, results):
+                if not exists:
+                    raise FileNotFoundError(filename, revision)
 
+        return files
 
     def _compare_files(self, filename1, filename2):
         """
@@ -0,0 +1,302 @@
+"""Syntax highlighting for the diff viewer.
+
+Files are highlighted with Pygments, one line of HTML per line of the file.
+Since the two versions of a file in a diff are mostly the same, the modified
+version can be highlighted incrementally: lines that didn't change reuse the
+highlighting of the original, and only the changed regions are lexed again.
+"""
+
+import fnmatch
+import os
+import re
+
+from django.utils.hashcompat import sha_constructor
+
+try:
+    import pygments
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import get_all_lexers, get_lexer_for_filename
+    from pygments.util import ClassNotFound
+except ImportError:
+    pass
+
+
+# The number of unchanged, non-blank lines around a changed region that are
+# lexed along with it. They're compared against the original highlighting to check
+# that the lexer is in the same state it was for the original file. If they
+# don't match, the window is doubled until they do.
+RESYNC_LINES = 5
+
+# How Pygments marks up tokens it couldn't lex.
+ERROR_TOKEN_MARKUP = '<span class="err">'
+
+# Matches filename patterns that only depend on the file extension.
+EXTENSION_PATTERN_RE = re.compile(r'^\*\.[^.*?\[\]]+$')
+
+
+class NoWrapperHtmlFormatter(HtmlFormatter):
+    """An HTML Formatter for Pygments that don't wrap items in a div."""
+    def __init__(self, *args, **kwargs):
+        super(NoWrapperHtmlFormatter, self).__init__(*args, **kwargs)
+
+    def _wrap_div(self, inner):
+        """
+        Method called by the formatter to wrap the contents of inner.
+        Inner is a list of tuples containing formatted code. If the first item
+        in the tuple is zero, then it's a wrapper, so we should ignore it.
+        """
+        for tup in inner:
+            if tup[0]:
+                yield tup
+
+
+_lexer_classes = {}
+_filename_patterns = None
+
+
+def _get_lexer_cache_key(filename):
+    """Returns the key used to cache the lexer class for a filename.
+
+    Most lexers are chosen based only on the file extension, so that's used
+    as the key. Some, though, match full filenames (such as "Makefile") or
+    more than one extension. Files matching those are keyed by their full
+    name.
+    """
+    global _filename_patterns
+
+    if _filename_patterns is None:
+        patterns = []
+
+        for name, aliases, filenames, mimetypes in get_all_lexers():
+            for pattern in filenames:
+                if not EXTENSION_PATTERN_RE.match(pattern):
+                    patterns.append(pattern)
+
+        _filename_patterns = patterns
+
+    basename = os.path.basename(filename)
+
+    for pattern in _filename_patterns:
+        if fnmatch.fnmatch(basename, pattern):
+            return basename
+
+    return os.path.splitext(basename)[1]
+
+
+def get_lexer_class(filename):
+    """Returns the Pygments lexer class for a filename, or None.
+
+    Looking up a lexer means matching the filename against the patterns of
+    every lexer Pygments knows about, so the results are cached.
+    """
+    key = _get_lexer_cache_key(filename)
+
+    try:
+        return _lexer_classes[key]
+    except KeyError:
+        try:
+            lexer_cls = type(get_lexer_for_filename(filename))
+        except ClassNotFound:
+            lexer_cls = None
+
+        _lexer_classes[key] = lexer_cls
+
+        return lexer_cls
+
+
+def get_lexer(filename):
+    """Returns a new lexer for highlighting a file in the diff viewer.
+
+    If there's no lexer for the file, this raises a ValueError.
+    """
+    # XXX Guessing is preferable but really slow, especially on XML
+    #     files.
+    lexer_cls = get_lexer_class(filename)
+
+    if lexer_cls is None:
+        raise ClassNotFound('no lexer for filename %r found' % filename)
+
+    lexer = lexer_cls(stripnl=False, encoding='utf-8')
+
+    try:
+        # This is only available in 0.7 and higher
+        lexer.add_filter('codetagify')
+    except AttributeError:
+        pass
+
+    return lexer
+
+
+def get_markup_cache_key(data, filename):
+    """Returns the cache key for the highlighted lines of a file.
+
+    The key depends only on the contents of the file, the lexer used and
+    the version of Pygments, so every diff involving the same version of a
+    file shares it. Returns None if there's no lexer for the file.
+    """
+    lexer_cls = get_lexer_class(filename)
+
+    if lexer_cls is None:
+        return None
+
+    return "highlighted-file:%s:%s:%s" % (lexer_cls.__name__,
+                                          pygments.__version__,
+                                          sha_constructor(data).hexdigest())
+
+
+def highlight(data, lexer):
+    """Returns a list of the highlighted lines of a file."""
+    return pygments.highlight(data, lexer,
+                              NoWrapperHtmlFormatter()).splitlines()
+
+
+def highlight_incrementally(old_markup, a, b, opcodes, lexer):
+    """Highlights a modified file, reusing the highlighting of the original.
+
+    old_markup is the highlighted lines of the original file, a and b are
+    the lines of the original and modified files, and opcodes are the
+    differ's opcodes between them.
+
+    Lines in "equal" ranges that are identical to their original lines take
+    the original's highlighting. Each changed region is lexed along with a
+    window of unchanged lines around it (see RESYNC_LINES), which is grown
+    until the unchanged lines highlight the same way they did in the
+    original. This is a heuristic. Tokens that span many lines, or that
+    depend on text far from the change, may be highlighted differently than
+    they would be if the whole file were highlighted.
+
+    Returns the list of highlighted lines, or None if the file can't be
+    highlighted this way and should be highlighted in full.
+    """
+    if len(old_markup) != len(a):
+        return None
+
+    num_lines = len(b)
+
+    # The line in the original file that each line is identical to, or -1.
+    source_lines = [-1] * num_lines
+
+    deleted_at = []
+
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            # With whitespace being ignored, "equal" lines may still differ.
+            for k in xrange(j2 - j1):
+                if a[i1 + k] == b[j1 + k]:
+                    source_lines[j1 + k] = i1 + k
+        elif tag == 'delete':
+            deleted_at.append(j1)
+
+    # Removed lines may change how the lines after them are lexed, so the
+    # first line after each removal is treated as changed.
+    for j in deleted_at:
+        if j < num_lines:
+            source_lines[j] = -1
+
+    markup = [None] * num_lines
+
+    for j, i in enumerate(source_lines):
+        if i != -1:
+            markup[j] = old_markup[i]
+
+    j = 0
+
+    while j < num_lines:
+        if source_lines[j] != -1:
+            j += 1
+            continue
+
+        start = j
+
+        while j < num_lines and source_lines[j] == -1:
+            j += 1
+
+        j = _highlight_region(b, markup, source_lines, start, j, lexer)
+
+        if j is None:
+            return None
+
+    return markup
+
+
+def _highlight_region(b, markup, source_lines, start, end, lexer):
+    """Highlights a changed region of a file, filling in its markup.
+
+    Returns the line after the last one highlighted, or None if the
+    highlighted lines don't line up with the file.
+    """
+    num_lines = len(b)
+    before = after = RESYNC_LINES
+
+    while True:
+        window_start = _skip_lines(b, start, -1, before)
+        window_end = _skip_lines(b, end, 1, after)
+
+        # Any changed lines in the window after the region need to be
+        # highlighted along with it, so the region grows to include them.
+        k = end
+
+        while k < window_end:
+            if source_lines[k] == -1:
+                while k < num_lines and source_lines[k] == -1:
+                    k += 1
+
+                end = k
+                window_end = _skip_lines(b, end, 1, after)
+            else:
+                k += 1
+
+        lines = highlight('\n'.join(b[window_start:window_end]) + '\n', lexer)
+
+        if len(lines) != window_end - window_start:
+            return None
+
+        # An unterminated string or comment in the changed lines is often
+        # lexed as an error when only part of the file is seen, but may
+        # continue far past the end of the window. Resyncing can't be
+        # trusted then.
+        for line in lines[start - window_start:end - window_start]:
+            if ERROR_TOKEN_MARKUP in line:
+                return None
+
+        # Lexing from the start or to the end of the file is always right.
+        # Otherwise, the unchanged lines in the window must come out the
+        # same as before.
+        start_synced = (window_start == 0 or
+                        lines[:start - window_start] ==
+                        markup[window_start:start])
+        end_synced = (window_end == num_lines or
+                      lines[end - window_start:] == markup[end:window_end])
+
+        if start_synced and end_synced:
+            markup[window_start:window_end] = lines
+
+            return window_end
+
+        if not start_synced:
+            before *= 2
+
+        if not end_synced:
+            after *= 2
+
+
+def _skip_lines(lines, i, step, count):
+    """Returns the index count non-blank lines away from line i.
+
+    Blank lines highlight the same way no matter what state the lexer is
+    in, so they don't help in telling whether it's resynced.
+    """
+    if step < 0:
+        while i > 0 and count > 0:
+            i -= 1
+
+            if lines[i].strip():
+                count -= 1
+    else:
+        while i < len(lines) and count > 0:
+            if lines[i].strip():
+                count -= 1
+
+            i += 1
+
+    return i
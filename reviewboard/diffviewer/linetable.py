@@ -0,0 +1,134 @@
+import re
+
+
+WHITESPACE_RE = re.compile(r'\s')
+
+
+class LineTable(object):
+    """Interns lines of text as integer codes.
+
+    Every distinct line is assigned a code the first time it's seen, along
+    with the results of the common transformations the diff viewer makes on
+    lines (stripping whitespace and matching header regexes). These are
+    computed once per distinct line and then looked up by code.
+
+    A single table can be shared by every differ used while processing a
+    request, so that lines common to many files, such as license headers
+    and imports, are only hashed and stripped once.
+
+    Code 0 is never assigned to a line. It's used to mean "blank" by
+    get_stripped_code.
+    """
+    def __init__(self):
+        self.codes = {}
+        self.lines = [None]
+        self.last_code = 0
+        self._ignore_space_codes = {}
+        self._stripped_codes = {}
+        self._no_whitespace_codes = {}
+        self._interesting_lines = {}
+
+    def get_code(self, line):
+        """Returns the code for a line, assigning one if it's new."""
+        try:
+            return self.codes[line]
+        except KeyError:
+            self.last_code += 1
+            self.codes[line] = self.last_code
+            self.lines.append(line)
+
+            return self.last_code
+
+    def get_codes(self, lines):
+        """Returns a list of codes for a list of lines."""
+        get_code = self.get_code
+
+        return [get_code(line) for line in lines]
+
+    def get_line(self, code):
+        """Returns the line for a code."""
+        return self.lines[code]
+
+    def get_ignore_space_code(self, code):
+        """Returns the code used to compare a line when ignoring whitespace.
+
+        This is the code for the line with leading whitespace removed.
+        Lines containing only whitespace keep their own code, so that
+        changes to them are still shown.
+        """
+        try:
+            return self._ignore_space_codes[code]
+        except KeyError:
+            stripped_line = self.lines[code].lstrip()
+
+            if stripped_line:
+                result = self.get_code(stripped_line)
+            else:
+                result = code
+
+            self._ignore_space_codes[code] = result
+
+            return result
+
+    def get_stripped_code(self, code):
+        """Returns the code for a line with surrounding whitespace removed.
+
+        If the line is blank, this returns 0.
+        """
+        try:
+            return self._stripped_codes[code]
+        except KeyError:
+            stripped_line = self.lines[code].strip()
+
+            if stripped_line:
+                result = self.get_code(stripped_line)
+            else:
+                result = 0
+
+            self._stripped_codes[code] = result
+
+            return result
+
+    def get_no_whitespace_code(self, code):
+        """Returns the code for a line with all whitespace removed."""
+        try:
+            return self._no_whitespace_codes[code]
+        except KeyError:
+            result = self.get_code(WHITESPACE_RE.sub("", self.lines[code]))
+            self._no_whitespace_codes[code] = result
+
+            return result
+
+    def get_interesting_line_func(self, regexes):
+        """Returns a function for looking up interesting lines by code.
+
+        regexes is a tuple of (name, regex) tuples, as registered on a
+        differ. The returned function takes a line code and returns the name
+        of the first regex that matches the line, or None. Blank lines never
+        match. Results are shared by every caller using the same regexes.
+        """
+        try:
+            cache = self._interesting_lines[regexes]
+        except KeyError:
+            cache = self._interesting_lines[regexes] = {}
+
+        lines = self.lines
+
+        def get_interesting_line_name(code):
+            try:
+                return cache[code]
+            except KeyError:
+                line = lines[code]
+                result = None
+
+                if line.lstrip():
+                    for name, regex in regexes:
+                        if regex.match(line):
+                            result = name
+                            break
+
+                cache[code] = result
+
+                return result
+
+        return get_interesting_line_name
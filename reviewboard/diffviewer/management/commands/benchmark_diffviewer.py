@@ -0,0 +1,100 @@
+import optparse
+import sys
+
+from django.core.management.base import CommandError, NoArgsCommand
+from django.utils import simplejson
+
+from reviewboard.diffviewer.benchmark import STAGES, SYNTHETIC_CASES, \
+                                             get_synthetic_cases, \
+                                             load_recorded_case, \
+                                             run_benchmarks
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        optparse.make_option('--iterations', type='int', dest='iterations',
+                             default=3,
+                             help='The number of times to run each stage'),
+        optparse.make_option('--case', action='append', dest='cases',
+                             default=[],
+                             help='A synthetic case to run. This can be '
+                                  'passed more than once. Defaults to all '
+                                  'of them: %s' %
+                                  ', '.join([name for name, func
+                                             in SYNTHETIC_CASES])),
+        optparse.make_option('--stage', action='append', dest='stages',
+                             default=[],
+                             help='A stage to time. This can be passed '
+                                  'more than once. Defaults to all of '
+                                  'them: %s' % ', '.join(STAGES)),
+        optparse.make_option('--recorded', action='append', dest='recorded',
+                             default=[], metavar='ORIG_DIR:NEW_DIR',
+                             help='Also run a case made up of the files in '
+                                  'NEW_DIR, compared to the files at the '
+                                  'same paths in ORIG_DIR. This can be '
+                                  'passed more than once'),
+        optparse.make_option('--no-synthetic', action='store_false',
+                             dest='synthetic', default=True,
+                             help='Only run the recorded cases'),
+        optparse.make_option('--seed', type='int', dest='seed', default=0,
+                             help='The seed the synthetic cases are '
+                                  'generated from'),
+        optparse.make_option('-o', '--output', dest='output',
+                             help='The file to write the results to, as '
+                                  'JSON. Defaults to standard output'),
+        )
+    help = "Times each stage of generating and rendering diffs"
+    requires_model_validation = True
+
+    def handle_noargs(self, **options):
+        iterations = options.get('iterations', 3)
+
+        if iterations < 1:
+            raise CommandError('--iterations must be at least 1')
+
+        case_names = options.get('cases', [])
+        valid_names = [name for name, func in SYNTHETIC_CASES]
+
+        for name in case_names:
+            if name not in valid_names:
+                raise CommandError('Unknown case "%s"' % name)
+
+        stages = options.get('stages', []) or STAGES
+
+        for stage in stages:
+            if stage not in STAGES:
+                raise CommandError('Unknown stage "%s"' % stage)
+
+        cases = []
+
+        if options.get('synthetic', True):
+            cases += get_synthetic_cases(case_names, options.get('seed', 0))
+
+        for recorded in options.get('recorded', []):
+            try:
+                orig_dir, new_dir = recorded.split(':', 1)
+            except ValueError:
+                raise CommandError('--recorded must be in the form '
+                                   'ORIG_DIR:NEW_DIR')
+
+            cases.append(load_recorded_case(orig_dir, new_dir))
+
+        if not cases:
+            raise CommandError('There are no cases to run')
+
+        def progress(case_name, stage):
+            sys.stderr.write('Timing %s on %s\n' % (stage, case_name))
+
+        results = run_benchmarks(cases, iterations, stages,
+                                 progress=progress)
+        output = simplejson.dumps(results, indent=2, sort_keys=True)
+
+        if options.get('output'):
+            f = open(options['output'], 'w')
+
+            try:
+                f.write(output + '\n')
+            finally:
+                f.close()
+        else:
+            print output
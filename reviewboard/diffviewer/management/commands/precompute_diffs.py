@@ -0,0 +1,52 @@
+import optparse
+import sys
+
+from django.core.management.base import CommandError, NoArgsCommand
+from djblets.siteconfig.models import SiteConfiguration
+
+from reviewboard.diffviewer.precompute import process_jobs, \
+                                              reset_running_jobs
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        optparse.make_option('--workers', type='int', dest='workers',
+                             default=1,
+                             help='The number of jobs to process at once'),
+        optparse.make_option('--once', action='store_false', dest='wait',
+                             default=True,
+                             help='Exit once there are no pending jobs, '
+                                  'rather than waiting for more'),
+        optparse.make_option('--poll-interval', type='int',
+                             dest='poll_interval', default=5,
+                             help='The number of seconds to wait between '
+                                  'checks for new jobs'),
+        optparse.make_option('--reset-running', action='store_true',
+                             dest='reset_running', default=False,
+                             help='Requeue jobs left running by workers '
+                                  'that exited uncleanly. Only use this '
+                                  'when no other workers are running'),
+        )
+    help = "Generates and caches diffs for newly uploaded diffsets"
+    requires_model_validation = True
+
+    def handle_noargs(self, **options):
+        if options.get('workers', 1) < 1:
+            raise CommandError('--workers must be at least 1')
+
+        siteconfig = SiteConfiguration.objects.get_current()
+
+        if not siteconfig.get('diffviewer_precompute_diffs'):
+            sys.stderr.write('Warning: Pre-computing diffs is disabled in '
+                             'the Review Board administration settings. '
+                             'No new jobs will be queued.\n')
+
+        if options.get('reset_running', False):
+            num_reset = reset_running_jobs()
+
+            if num_reset:
+                print 'Requeued %d jobs' % num_reset
+
+        process_jobs(options.get('workers', 1),
+                     options.get('wait', True),
+                     options.get('poll_interval', 5))
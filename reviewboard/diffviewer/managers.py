@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import Manager
+from django.db.models.fields import AutoField
+
+
+class FileDiffManager(Manager):
+    """A manager for FileDiff models."""
+
+    # The most rows inserted by one query in bulk_create.
+    MAX_INSERT_ROWS = 100
+
+    # The most data, in bytes, inserted by one query in bulk_create. This
+    # keeps queries below MySQL's default max_allowed_packet of 1MB. Larger
+    # FileDiffs are inserted on their own.
+    MAX_INSERT_SIZE = 512 * 1024
+
+    def bulk_create(self, filediffs):
+        """Saves a list of new FileDiffs using as few queries as possible.
+
+        The FileDiffs are inserted several rows at a time. They aren't given
+        IDs, and no save signals are sent for them. This should be called
+        within a transaction, so that either all or none of them are saved.
+        """
+        if not filediffs:
+            return
+
+        opts = self.model._meta
+        fields = [field for field in opts.local_fields
+                  if not isinstance(field, AutoField)]
+        qn = connection.ops.quote_name
+        sql = 'INSERT INTO %s (%s) VALUES ' % (
+            qn(opts.db_table),
+            ', '.join([qn(field.column) for field in fields]))
+        row_sql = '(%s)' % ', '.join(['%s'] * len(fields))
+        cursor = connection.cursor()
+
+        rows = [[field.get_db_prep_save(field.pre_save(filediff, True))
+                 for field in fields]
+                for filediff in filediffs]
+
+        if settings.DATABASE_ENGINE == 'sqlite3':
+            # Older versions of SQLite can't insert several rows in one
+            # query. There's no server to make round trips to anyway.
+            cursor.executemany(sql + row_sql, rows)
+            return
+
+        params = []
+        num_rows = 0
+        size = 0
+
+        for row in rows:
+            row_size = sum([len(value) for value in row
+                            if isinstance(value, basestring)])
+
+            if num_rows and (num_rows == self.MAX_INSERT_ROWS or
+                             size + row_size > self.MAX_INSERT_SIZE):
+                cursor.execute(sql + ', '.join([row_sql] * num_rows), params)
+                params = []
+                num_rows = 0
+                size = 0
+
+            params.extend(row)
+            num_rows += 1
+            size += row_size
+
+        cursor.execute(sql + ', '.join([row_sql] * num_rows), params)
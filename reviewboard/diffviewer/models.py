@@ -4,6 +4,7 @@ from django.db import models
 from django.utils.translation import ugettext_lazy as _
 from djblets.util.fields import Base64Field
 
+from reviewboard.diffviewer.managers import FileDiffManager
 from reviewboard.scmtools.models import Repository
 
 
@@ -38,6 +39,8 @@ class FileDiff(models.Model):
                               blank=True)
     status = models.CharField(_("status"), max_length=1, choices=STATUSES)
 
+    objects = FileDiffManager()
+
     @property
     def deleted(self):
         return self.status == 'D'
@@ -107,3 +110,48 @@ class DiffSetHistory(models.Model):
 
     class Meta:
         verbose_name_plural = "Diff set histories"
+
+
+class DiffPrecomputeJob(models.Model):
+    """
+    A request to generate and cache the diffs for a diffset ahead of time.
+
+    These are created when diffs are uploaded, and processed by the
+    precompute_diffs management command, so that the first person to view
+    a new diff doesn't have to wait for it to be generated.
+    """
+    PENDING = 'P'
+    RUNNING = 'R'
+    DONE = 'D'
+    FAILED = 'F'
+
+    STATUSES = (
+        (PENDING, _('Pending')),
+        (RUNNING, _('Running')),
+        (DONE, _('Ready')),
+        (FAILED, _('Failed')),
+    )
+
+    diffset = models.ForeignKey(DiffSet,
+                                related_name='precompute_jobs',
+                                verbose_name=_("diff set"))
+    previous_diffset = models.ForeignKey(
+        DiffSet,
+        null=True,
+        blank=True,
+        related_name='interdiff_precompute_jobs',
+        verbose_name=_("previous diff set"),
+        help_text=_("The diff set to generate an interdiff against."))
+    status = models.CharField(_("status"), max_length=1, choices=STATUSES,
+                              default=PENDING, db_index=True)
+    timestamp = models.DateTimeField(_("timestamp"), default=datetime.now)
+    started = models.DateTimeField(_("started"), null=True, blank=True)
+    completed = models.DateTimeField(_("completed"), null=True, blank=True)
+    error = models.TextField(_("error"), blank=True)
+
+    def __unicode__(self):
+        return u"Precompute %s (%s)" % (self.diffset,
+                                        self.get_status_display())
+
+    class Meta:
+        ordering = ['timestamp']
@@ -1,3 +1,13 @@
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from reviewboard.diffviewer.linetable import LineTable
+
+
 class MyersDiffer:
     """
     An implementation of Eugene Myers's O(ND) Diff algorithm based on GNU diff.
@@ -20,20 +30,19 @@ class MyersDiffer:
             self.undiscarded_lines = 0
             self.real_indexes = []
 
-    def __init__(self, a, b, ignore_space=False):
+    def __init__(self, a, b, ignore_space=False, line_table=None):
         if type(a) != type(b):
             raise TypeError
 
         self.a = a
         self.b = b
-        self.code_table = {}
+        self.line_table = line_table or LineTable()
         self.last_code = 0
         self.a_data = self.b_data = None
         self.ignore_space = ignore_space
         self.minimal_diff = False
         self.interesting_line_regexes = []
         self.interesting_lines = [{}, {}]
-        self.interesting_line_table = {}
 
         # SMS State
         self.max_lines = 0
@@ -184,56 +193,43 @@ class MyersDiffer:
         """
         Converts all unique lines of text into unique numbers. Comparing
         lists of numbers is faster than comparing lists of strings.
+
+        The numbers come from the line table, which may be shared with
+        other differs.
         """
         codes = []
 
-        linenum = 0
-
         if is_modified_file:
             interesting_lines = self.interesting_lines[1]
         else:
             interesting_lines = self.interesting_lines[0]
 
-        for line in lines:
+        get_interesting_line_name = self.line_table.get_interesting_line_func(
+            tuple(self.interesting_line_regexes))
+
+        for linenum, line in enumerate(lines):
             # TODO: Handle ignoring/triming spaces, ignoring casing, and
             #       special hooks
-
-            raw_line = line
-            stripped_line = line.lstrip()
+            raw_code = self.line_table.get_code(line)
 
             if self.ignore_space:
                 # We still want to show lines that contain only whitespace.
-                if len(stripped_line) > 0:
-                    line = stripped_line
-
-            interesting_line_name = None
-
-            try:
-                code = self.code_table[line]
-                interesting_line_name = \
-                    self.interesting_line_table.get(code, None)
-            except KeyError:
-                # This is a new, unrecorded line, so mark it and store it.
-                self.last_code += 1
-                code = self.last_code
-                self.code_table[line] = code
-
-                # Check to see if this is an interesting line that the caller
-                # wants recorded.
-                if stripped_line:
-                    for name, regex in self.interesting_line_regexes:
-                        if regex.match(raw_line):
-                            interesting_line_name = name
-                            self.interesting_line_table[code] = name
-                            break
-
-            if interesting_line_name:
-                interesting_lines[interesting_line_name].append((linenum,
-                                                                 raw_line))
+                code = self.line_table.get_ignore_space_code(raw_code)
+            else:
+                code = raw_code
+
+            # Check to see if this is an interesting line that the caller
+            # wants recorded.
+            if self.interesting_line_regexes:
+                interesting_line_name = get_interesting_line_name(raw_code)
+
+                if interesting_line_name:
+                    interesting_lines[interesting_line_name].append(
+                        (linenum, line))
 
             codes.append(code)
 
-            linenum += 1
+        self.last_code = self.line_table.last_code
 
         return codes
 
@@ -594,136 +590,141 @@ class MyersDiffer:
                     j -= 1
 
     def _discard_confusing_lines(self):
-        def build_discard_list(data, discards, counts):
-            many = 5 * self._very_approx_sqrt(data.length / 64)
+        self.a_data.undiscarded = [0] * self.a_data.length
+        self.b_data.undiscarded = [0] * self.b_data.length
+        self.a_data.real_indexes = [0] * self.a_data.length
+        self.b_data.real_indexes = [0] * self.b_data.length
+        a_discarded = [0] * self.a_data.length
+        b_discarded = [0] * self.b_data.length
 
-            for i, item in enumerate(data.data):
-                if item != 0:
-                    num_matches = counts[item]
+        # The line codes may come from a LineTable shared with other
+        # differs, so they can go far higher than the number of lines in
+        # these files. Count them in dictionaries rather than in lists
+        # indexed by code.
+        a_code_counts = {}
+        b_code_counts = {}
 
-                    if num_matches == 0:
-                        discards[i] = self.DISCARD_FOUND
-                    elif num_matches > many:
-                        discards[i] = self.DISCARD_CANCEL
+        for item in self.a_data.data:
+            a_code_counts[item] = a_code_counts.get(item, 0) + 1
 
-        def scan_run(discards, i, length, index_func):
-            consec = 0
+        for item in self.b_data.data:
+            b_code_counts[item] = b_code_counts.get(item, 0) + 1
 
-            for j in xrange(length):
-                index = index_func(i, j)
-                discard = discards[index]
+        self._build_discard_list(self.a_data, a_discarded, b_code_counts)
+        self._build_discard_list(self.b_data, b_discarded, a_code_counts)
 
-                if j >= 8 and discard == self.DISCARD_FOUND:
-                    break
+        self._check_discard_runs(self.a_data, a_discarded)
+        self._check_discard_runs(self.b_data, b_discarded)
 
-                if discard == self.DISCARD_FOUND:
-                    consec += 1
-                else:
-                    consec = 0
+        self._discard_lines(self.a_data, a_discarded)
+        self._discard_lines(self.b_data, b_discarded)
 
-                    if discard == self.DISCARD_CANCEL:
-                        discards[index] = self.DISCARD_NONE
+    def _build_discard_list(self, data, discards, counts):
+        many = 5 * self._very_approx_sqrt(data.length / 64)
 
-                if consec == 3:
-                    break
+        for i, item in enumerate(data.data):
+            if item != 0:
+                num_matches = counts.get(item, 0)
 
-        def check_discard_runs(data, discards):
-            i = 0
-            while i < data.length:
-                # Cancel the provisional discards that are not in the middle
-                # of a run of discards
-                if discards[i] == self.DISCARD_CANCEL:
-                    discards[i] = self.DISCARD_NONE
-                elif discards[i] == self.DISCARD_FOUND:
-                    # We found a provisional discard
-                    provisional = 0
-
-                    # Find the end of this run of discardable lines and count
-                    # how many are provisionally discardable.
-                    #for j in xrange(i, data.length):
-                    j = i
-                    while j < data.length:
-                        if discards[j] == self.DISCARD_NONE:
-                            break
-                        elif discards[j] == self.DISCARD_CANCEL:
-                            provisional += 1
-                        j += 1
+                if num_matches == 0:
+                    discards[i] = self.DISCARD_FOUND
+                elif num_matches > many:
+                    discards[i] = self.DISCARD_CANCEL
 
-                    # Cancel the provisional discards at the end and shrink
-                    # the run.
-                    while j > i and discards[j - 1] == self.DISCARD_CANCEL:
-                        j -= 1
-                        discards[j] = 0
-                        provisional -= 1
-
-                    length = j - i
-
-                    # If 1/4 of the lines are provisional, cancel discarding
-                    # all the provisional lines in the run.
-                    if provisional * 4 > length:
-                        while j > i:
-                            j -= 1
-                            if discards[j] == self.DISCARD_CANCEL:
-                                discards[j] = self.DISCARD_NONE
-                    else:
-                        minimum = 1 + self._very_approx_sqrt(length / 4)
-                        j = 0
-                        consec = 0
-                        while j < length:
-                            if discards[i + j] != self.DISCARD_CANCEL:
-                                consec = 0
-                            else:
-                                consec += 1
-                                if minimum == consec:
-                                    j -= consec
-                                elif minimum < consec:
-                                    discards[i + j] = self.DISCARD_NONE
-
-                            j += 1
-
-                        scan_run(discards, i, length, lambda x,y: x + y)
-                        i += length - 1
-                        scan_run(discards, i, length, lambda x,y: x - y)
+    def _scan_discard_run(self, discards, i, length, index_func):
+        consec = 0
 
-                i += 1
+        for j in xrange(length):
+            index = index_func(i, j)
+            discard = discards[index]
 
-        def discard_lines(data, discards):
-            j = 0
-            for i, item in enumerate(data.data):
-                if self.minimal_diff or discards[i] == self.DISCARD_NONE:
-                    data.undiscarded[j] = item
-                    data.real_indexes[j] = i
-                    j += 1
-                else:
-                    data.modified[i] = True
+            if j >= 8 and discard == self.DISCARD_FOUND:
+                break
 
-            data.undiscarded_lines = j
+            if discard == self.DISCARD_FOUND:
+                consec += 1
+            else:
+                consec = 0
+
+                if discard == self.DISCARD_CANCEL:
+                    discards[index] = self.DISCARD_NONE
+
+            if consec == 3:
+                break
+
+    def _check_discard_runs(self, data, discards):
+        i = 0
+        while i < data.length:
+            # Cancel the provisional discards that are not in the middle
+            # of a run of discards
+            if discards[i] == self.DISCARD_CANCEL:
+                discards[i] = self.DISCARD_NONE
+            elif discards[i] == self.DISCARD_FOUND:
+                # We found a provisional discard
+                provisional = 0
+
+                # Find the end of this run of discardable lines and count
+                # how many are provisionally discardable.
+                #for j in xrange(i, data.length):
+                j = i
+                while j < data.length:
+                    if discards[j] == self.DISCARD_NONE:
+                        break
+                    elif discards[j] == self.DISCARD_CANCEL:
+                        provisional += 1
+                    j += 1
 
+                # Cancel the provisional discards at the end and shrink
+                # the run.
+                while j > i and discards[j - 1] == self.DISCARD_CANCEL:
+                    j -= 1
+                    discards[j] = 0
+                    provisional -= 1
 
-        self.a_data.undiscarded = [0] * self.a_data.length
-        self.b_data.undiscarded = [0] * self.b_data.length
-        self.a_data.real_indexes = [0] * self.a_data.length
-        self.b_data.real_indexes = [0] * self.b_data.length
-        a_discarded = [0] * self.a_data.length
-        b_discarded = [0] * self.b_data.length
-        a_code_counts = [0] * (1 + self.last_code)
-        b_code_counts = [0] * (1 + self.last_code)
+                length = j - i
 
-        for item in self.a_data.data:
-            a_code_counts[item] += 1
+                # If 1/4 of the lines are provisional, cancel discarding
+                # all the provisional lines in the run.
+                if provisional * 4 > length:
+                    while j > i:
+                        j -= 1
+                        if discards[j] == self.DISCARD_CANCEL:
+                            discards[j] = self.DISCARD_NONE
+                else:
+                    minimum = 1 + self._very_approx_sqrt(length / 4)
+                    j = 0
+                    consec = 0
+                    while j < length:
+                        if discards[i + j] != self.DISCARD_CANCEL:
+                            consec = 0
+                        else:
+                            consec += 1
+                            if minimum == consec:
+                                j -= consec
+                            elif minimum < consec:
+                                discards[i + j] = self.DISCARD_NONE
 
-        for item in self.b_data.data:
-            b_code_counts[item] += 1
+                        j += 1
 
-        build_discard_list(self.a_data, a_discarded, b_code_counts)
-        build_discard_list(self.b_data, b_discarded, a_code_counts)
+                    self._scan_discard_run(discards, i, length,
+                                           lambda x,y: x + y)
+                    i += length - 1
+                    self._scan_discard_run(discards, i, length,
+                                           lambda x,y: x - y)
 
-        check_discard_runs(self.a_data, a_discarded)
-        check_discard_runs(self.b_data, b_discarded)
+            i += 1
 
-        discard_lines(self.a_data, a_discarded)
-        discard_lines(self.b_data, b_discarded)
+    def _discard_lines(self, data, discards):
+        j = 0
+        for i, item in enumerate(data.data):
+            if self.minimal_diff or discards[i] == self.DISCARD_NONE:
+                data.undiscarded[j] = item
+                data.real_indexes[j] = i
+                j += 1
+            else:
+                data.modified[i] = True
 
+        data.undiscarded_lines = j
 
     def _very_approx_sqrt(self, i):
         result = 1
@@ -733,3 +734,592 @@ class MyersDiffer:
             result *= 2
 
         return result
+
+
+class CompactMyersDiffer(MyersDiffer):
+    """
+    A MyersDiffer for large files.
+
+    This produces the same opcodes as MyersDiffer, but stores the line codes
+    in arrays and the modified lines in a byte map, instead of lists of
+    integer objects and dictionaries. The diagonal vectors stay as lists,
+    which are faster to index. The hot loops work on local variables, and
+    if NumPy is available, long snakes are followed by comparing whole
+    slices of lines at once.
+
+    Each byte map has one extra entry at the end, which is never set. The
+    algorithm looks one line past either end of the files, and this makes
+    both of those (including index -1) read as unmodified.
+    """
+    # The length at which we switch from walking a snake line by line to
+    # comparing slices with NumPy.
+    NUMPY_SNAKE_LENGTH = 16
+
+    class DiffData:
+        def __init__(self, data):
+            self.data = array('i', data)
+            self.length = len(data)
+            self.modified = array('B', [0]) * (self.length + 1)
+            self.undiscarded = None
+            self.undiscarded_lines = 0
+            self.real_indexes = None
+
+    def ratio(self):
+        self._gen_diff_data()
+        a_equals = self.a_data.length - self.a_data.modified.count(1)
+        b_equals = self.b_data.length - self.b_data.modified.count(1)
+
+        return 1.0 * (a_equals + b_equals) / \
+                     (self.a_data.length + self.b_data.length)
+
+    def get_opcodes(self):
+        self._gen_diff_data()
+
+        a_length = self.a_data.length
+        b_length = self.b_data.length
+        a_modified = self.a_data.modified
+        b_modified = self.b_data.modified
+        a_line = b_line = 0
+        last_group = None
+
+        while a_line < a_length or b_line < b_length:
+            a_start = a_line
+            b_start = b_line
+
+            if a_line < a_length and not a_modified[a_line] and \
+               b_line < b_length and not b_modified[b_line]:
+                # Equal. Take the whole run of equal lines at once.
+                tag = "equal"
+
+                while a_line < a_length and not a_modified[a_line] and \
+                      b_line < b_length and not b_modified[b_line]:
+                    a_line += 1
+                    b_line += 1
+
+                a_changed = b_changed = a_line - a_start
+            else:
+                while a_line < a_length and \
+                      (b_line >= b_length or a_modified[a_line]):
+                    a_line += 1
+
+                while b_line < b_length and \
+                      (a_line >= a_length or b_modified[b_line]):
+                    b_line += 1
+
+                a_changed = a_line - a_start
+                b_changed = b_line - b_start
+
+                if a_changed == 0:
+                    tag = "insert"
+                elif b_changed == 0:
+                    tag = "delete"
+                else:
+                    tag = "replace"
+
+                    if a_changed > b_changed:
+                        a_line -= a_changed - b_changed
+                        a_changed = b_changed
+                    elif a_changed < b_changed:
+                        b_line -= b_changed - a_changed
+                        b_changed = a_changed
+
+            if last_group and last_group[0] == tag:
+                last_group = (tag,
+                              last_group[1], last_group[2] + a_changed,
+                              last_group[3], last_group[4] + b_changed)
+            else:
+                if last_group:
+                    yield last_group
+
+                last_group = (tag, a_start, a_start + a_changed,
+                              b_start, b_start + b_changed)
+
+        if not last_group:
+            last_group = ("equal", 0, a_length, 0, b_length)
+
+        yield last_group
+
+    def _gen_diff_data(self):
+        if self.a_data and self.b_data:
+            return
+
+        self.a_data = self.DiffData(self._gen_diff_codes(self.a, False))
+        self.b_data = self.DiffData(self._gen_diff_codes(self.b, True))
+
+        self._discard_confusing_lines()
+
+        self.max_lines = self.a_data.undiscarded_lines + \
+                         self.b_data.undiscarded_lines + 3
+
+        vector_size = self.a_data.undiscarded_lines + \
+                      self.b_data.undiscarded_lines + 3
+        self.fdiag = [0] * vector_size
+        self.bdiag = [0] * vector_size
+        self.downoff = self.upoff = self.b_data.undiscarded_lines + 1
+
+        if numpy is not None:
+            self.a_vector = numpy.frombuffer(self.a_data.undiscarded,
+                                             dtype=numpy.intc)
+            self.b_vector = numpy.frombuffer(self.b_data.undiscarded,
+                                             dtype=numpy.intc)
+            self.snake_length = self.NUMPY_SNAKE_LENGTH
+        else:
+            # Never switch to NumPy.
+            self.snake_length = -1
+
+        self._lcs(0, self.a_data.undiscarded_lines,
+                  0, self.b_data.undiscarded_lines,
+                  self.minimal_diff)
+        self._shift_chunks(self.a_data, self.b_data)
+        self._shift_chunks(self.b_data, self.a_data)
+
+    def _gen_diff_codes(self, lines, is_modified_file):
+        """
+        Converts all unique lines of text into unique numbers.
+
+        This is the same as MyersDiffer._gen_diff_codes, but with the
+        lookups pulled into local variables.
+        """
+        line_table = self.line_table
+        raw_codes = line_table.get_codes(lines)
+        codes = array('i', raw_codes)
+
+        if self.ignore_space:
+            get_ignore_space_code = line_table.get_ignore_space_code
+
+            for i, code in enumerate(codes):
+                codes[i] = get_ignore_space_code(code)
+
+        if self.interesting_line_regexes:
+            if is_modified_file:
+                interesting_lines = self.interesting_lines[1]
+            else:
+                interesting_lines = self.interesting_lines[0]
+
+            get_interesting_line_name = line_table.get_interesting_line_func(
+                tuple(self.interesting_line_regexes))
+
+            for linenum, code in enumerate(raw_codes):
+                interesting_line_name = get_interesting_line_name(code)
+
+                if interesting_line_name:
+                    interesting_lines[interesting_line_name].append(
+                        (linenum, lines[linenum]))
+
+        return codes
+
+    def _discard_confusing_lines(self):
+        for data in (self.a_data, self.b_data):
+            data.undiscarded = array('i', [0]) * data.length
+            data.real_indexes = array('i', [0]) * data.length
+
+        a_discarded = array('B', [0]) * self.a_data.length
+        b_discarded = array('B', [0]) * self.b_data.length
+        a_code_counts = self._count_codes(self.a_data.data)
+        b_code_counts = self._count_codes(self.b_data.data)
+
+        self._build_discard_list(self.a_data, a_discarded, b_code_counts)
+        self._build_discard_list(self.b_data, b_discarded, a_code_counts)
+
+        self._check_discard_runs(self.a_data, a_discarded)
+        self._check_discard_runs(self.b_data, b_discarded)
+
+        self._discard_lines(self.a_data, a_discarded)
+        self._discard_lines(self.b_data, b_discarded)
+
+    def _count_codes(self, codes):
+        """
+        Returns a dictionary mapping each line code to its number of uses.
+
+        See MyersDiffer._discard_confusing_lines for why this isn't a list.
+        """
+        counts = {}
+        get = counts.get
+
+        for code in codes:
+            counts[code] = get(code, 0) + 1
+
+        return counts
+
+    def _build_discard_list(self, data, discards, counts):
+        many = 5 * self._very_approx_sqrt(data.length / 64)
+        DISCARD_FOUND = self.DISCARD_FOUND
+        DISCARD_CANCEL = self.DISCARD_CANCEL
+        get_count = counts.get
+
+        for i, item in enumerate(data.data):
+            num_matches = get_count(item, 0)
+
+            if num_matches == 0:
+                discards[i] = DISCARD_FOUND
+            elif num_matches > many:
+                discards[i] = DISCARD_CANCEL
+
+    def _discard_lines(self, data, discards):
+        undiscarded = data.undiscarded
+        real_indexes = data.real_indexes
+        modified = data.modified
+        j = 0
+
+        if self.minimal_diff:
+            discards = array('B', [self.DISCARD_NONE]) * data.length
+
+        for i, item in enumerate(data.data):
+            if discards[i] == self.DISCARD_NONE:
+                undiscarded[j] = item
+                real_indexes[j] = i
+                j += 1
+            else:
+                modified[i] = 1
+
+        data.undiscarded_lines = j
+
+    def _snake_forward(self, x, y, x_upper, y_upper):
+        """
+        Returns the end of the snake starting at (x, y), using NumPy.
+        """
+        a_vector = self.a_vector
+        b_vector = self.b_vector
+        block = 64
+
+        while x < x_upper and y < y_upper:
+            n = min(block, x_upper - x, y_upper - y)
+            unequal = a_vector[x:x + n] != b_vector[y:y + n]
+            i = int(unequal.argmax())
+
+            if unequal[i]:
+                return x + i
+
+            x += n
+            y += n
+            block *= 2
+
+        return x
+
+    def _snake_backward(self, x, y, x_lower, y_lower):
+        """
+        Returns the start of the snake ending at (x, y), using NumPy.
+        """
+        a_vector = self.a_vector
+        b_vector = self.b_vector
+        block = 64
+
+        while x > x_lower and y > y_lower:
+            n = min(block, x - x_lower, y - y_lower)
+            unequal = a_vector[x - n:x][::-1] != b_vector[y - n:y][::-1]
+            i = int(unequal.argmax())
+
+            if unequal[i]:
+                return x - i
+
+            x -= n
+            y -= n
+            block *= 2
+
+        return x
+
+    def _find_sms(self, a_lower, a_upper, b_lower, b_upper, find_minimal):
+        """
+        Finds the Shortest Middle Snake.
+
+        This is the same search as MyersDiffer._find_sms, but with the state
+        pulled into local variables. Like MyersDiffer, it never gives up
+        once the search gets too expensive.
+        """
+        down_vector = self.fdiag
+        up_vector = self.bdiag
+        downoff = self.downoff
+        upoff = self.upoff
+        a = self.a_data.undiscarded
+        b = self.b_data.undiscarded
+        max_lines = self.max_lines
+        snake_limit = self.SNAKE_LIMIT
+        snake_length = self.snake_length
+
+        down_k = a_lower - b_lower
+        up_k = a_upper - b_upper
+        odd_delta = (down_k - up_k) % 2 != 0
+
+        down_vector[downoff + down_k] = a_lower
+        up_vector[upoff + up_k] = a_upper
+
+        dmin = a_lower - b_upper
+        dmax = a_upper - b_lower
+
+        down_min = down_max = down_k
+        up_min = up_max = up_k
+
+        cost = 0
+
+        while True:
+            cost += 1
+            big_snake = False
+
+            if down_min > dmin:
+                down_min -= 1
+                down_vector[downoff + down_min - 1] = -1
+            else:
+                down_min += 1
+
+            if down_max < dmax:
+                down_max += 1
+                down_vector[downoff + down_max + 1] = -1
+            else:
+                down_max -= 1
+
+            # Extend the forward path
+            for k in xrange(down_max, down_min - 1, -2):
+                tlo = down_vector[downoff + k - 1]
+                thi = down_vector[downoff + k + 1]
+
+                if tlo >= thi:
+                    x = tlo + 1
+                else:
+                    x = thi
+
+                y = x - k
+                old_x = x
+
+                while x < a_upper and y < b_upper and a[x] == b[y]:
+                    x += 1
+                    y += 1
+
+                    if x - old_x == snake_length:
+                        x = self._snake_forward(x, y, a_upper, b_upper)
+                        y = x - k
+                        break
+
+                if odd_delta and up_min <= k <= up_max and \
+                   up_vector[upoff + k] <= x:
+                    return x, y, True, True
+
+                if x - old_x > snake_limit:
+                    big_snake = True
+
+                down_vector[downoff + k] = x
+
+            # Extend the reverse path
+            if up_min > dmin:
+                up_min -= 1
+                up_vector[upoff + up_min - 1] = max_lines
+            else:
+                up_min += 1
+
+            if up_max < dmax:
+                up_max += 1
+                up_vector[upoff + up_max + 1] = max_lines
+            else:
+                up_max -= 1
+
+            for k in xrange(up_max, up_min - 1, -2):
+                tlo = up_vector[upoff + k - 1]
+                thi = up_vector[upoff + k + 1]
+
+                if tlo < thi:
+                    x = tlo
+                else:
+                    x = thi - 1
+
+                y = x - k
+                old_x = x
+
+                while x > a_lower and y > b_lower and a[x - 1] == b[y - 1]:
+                    x -= 1
+                    y -= 1
+
+                    if old_x - x == snake_length:
+                        x = self._snake_backward(x, y, a_lower, b_lower)
+                        y = x - k
+                        break
+
+                if not odd_delta and down_min <= k <= down_max and \
+                   x <= down_vector[downoff + k]:
+                    return x, y, True, True
+
+                if old_x - x > snake_limit:
+                    big_snake = True
+
+                up_vector[upoff + k] = x
+
+            if find_minimal:
+                continue
+
+            # See MyersDiffer._find_sms for the details on this heuristic.
+            if cost > 200 and big_snake:
+                ret_x, ret_y, best = \
+                    self._find_diagonal(down_min, down_max, down_k, 0,
+                                        downoff, down_vector,
+                                        lambda x: x - a_lower,
+                                        lambda x: a_lower + snake_limit <=
+                                                  x < a_upper,
+                                        lambda y: b_lower + snake_limit <=
+                                                  y < b_upper,
+                                        lambda i,k: i - k,
+                                        1, cost)
+
+                if best > 0:
+                    return ret_x, ret_y, True, False
+
+                ret_x, ret_y, best = \
+                    self._find_diagonal(up_min, up_max, up_k, best, upoff,
+                                        up_vector,
+                                        lambda x: a_upper - x,
+                                        lambda x: a_lower < x <= a_upper -
+                                                  snake_limit,
+                                        lambda y: b_lower < y <= b_upper -
+                                                  snake_limit,
+                                        lambda i,k: i + k,
+                                        0, cost)
+
+                if best > 0:
+                    return ret_x, ret_y, False, True
+
+    def _lcs(self, a_lower, a_upper, b_lower, b_upper, find_minimal):
+        a = self.a_data.undiscarded
+        b = self.b_data.undiscarded
+
+        snake_length = self.snake_length
+
+        # Fast walkthrough equal lines at the start
+        start = a_lower
+
+        while a_lower < a_upper and b_lower < b_upper and \
+              a[a_lower] == b[b_lower]:
+            a_lower += 1
+            b_lower += 1
+
+            if a_lower - start == snake_length:
+                x = self._snake_forward(a_lower, b_lower, a_upper, b_upper)
+                b_lower += x - a_lower
+                a_lower = x
+                break
+
+        start = a_upper
+
+        while a_upper > a_lower and b_upper > b_lower and \
+              a[a_upper - 1] == b[b_upper - 1]:
+            a_upper -= 1
+            b_upper -= 1
+
+            if start - a_upper == snake_length:
+                x = self._snake_backward(a_upper, b_upper, a_lower, b_lower)
+                b_upper -= a_upper - x
+                a_upper = x
+                break
+
+        if a_lower == a_upper:
+            # Inserted lines.
+            modified = self.b_data.modified
+            real_indexes = self.b_data.real_indexes
+
+            for i in xrange(b_lower, b_upper):
+                modified[real_indexes[i]] = 1
+        elif b_lower == b_upper:
+            # Deleted lines
+            modified = self.a_data.modified
+            real_indexes = self.a_data.real_indexes
+
+            for i in xrange(a_lower, a_upper):
+                modified[real_indexes[i]] = 1
+        else:
+            # Find the middle snake and length of an optimal path for A and B
+            x, y, low_minimal, high_minimal = \
+                self._find_sms(a_lower, a_upper, b_lower, b_upper,
+                               find_minimal)
+
+            self._lcs(a_lower, x, b_lower, y, low_minimal)
+            self._lcs(x, a_upper, y, b_upper, high_minimal)
+
+    def _shift_chunks(self, data, other_data):
+        """
+        Shifts the inserts/deletes of identical lines in order to join
+        the changes together a bit more.
+
+        See MyersDiffer._shift_chunks for the details. Unlike the lines
+        in this file, the position in the other file can run past either
+        end of it, so those lookups are bounds-checked.
+        """
+        lines = data.data
+        modified = data.modified
+        other_modified = other_data.modified
+        other_length = other_data.length
+        i = j = 0
+        i_end = data.length
+
+        while True:
+            # Scan forward in order to find the start of a run of changes.
+            while i < i_end and not modified[i]:
+                i += 1
+
+                while 0 <= j < other_length and other_modified[j]:
+                    j += 1
+
+            if i == i_end:
+                return
+
+            start = i
+
+            # Find the end of these changes
+            i += 1
+            while modified[i]:
+                i += 1
+
+            while 0 <= j < other_length and other_modified[j]:
+                j += 1
+
+            while True:
+                run_length = i - start
+
+                # Move the changed chunks back as long as the previous
+                # unchanged line matches the last changed line.
+                while start != 0 and lines[start - 1] == lines[i - 1]:
+                    start -= 1
+                    i -= 1
+
+                    modified[start] = 1
+                    modified[i] = 0
+
+                    while modified[start - 1]:
+                        start -= 1
+
+                    j -= 1
+                    while 0 <= j < other_length and other_modified[j]:
+                        j -= 1
+
+                if 0 < j <= other_length and other_modified[j - 1]:
+                    corresponding = i
+                else:
+                    corresponding = i_end
+
+                # Move the changed region forward as long as the first
+                # changed line is the same as the following unchanged line.
+                while i != i_end and lines[start] == lines[i]:
+                    modified[start] = 0
+                    modified[i] = 1
+
+                    start += 1
+                    i += 1
+
+                    while modified[i]:
+                        i += 1
+
+                    j += 1
+                    while 0 <= j < other_length and other_modified[j]:
+                        j += 1
+                        corresponding = i
+
+                if run_length == i - start:
+                    break
+
+            # Move the fully-merged run back to a corresponding run in the
+            # other data set, if we can.
+            while corresponding < i:
+                start -= 1
+                i -= 1
+
+                modified[start] = 1
+                modified[i] = 0
+
+                j -= 1
+                while 0 <= j < other_length and other_modified[j]:
+                    j -= 1
@@ -0,0 +1,268 @@
+"""A compact representation of a file's diff chunks, for caching.
+
+The chunks generated for a diff are a list of dictionaries, each with a
+list of lines, and each line is itself a list of line numbers, markup and
+changed regions (see get_file_chunks_in_range). Pickling that takes a lot
+of space, and unpickling it takes a lot of time, for large files.
+
+PackedChunks stores the lines of all the chunks in a few flat arrays
+instead: one each for the line numbers, the flags, and the changed
+regions, along with a single UTF-8 string holding all the markup and an
+array of offsets into it. Only the rest of each chunk (its change type,
+metadata and so on) is kept as a dictionary.
+
+When unpacked, the lines of each chunk are a PackedLines, which decodes
+lines from the arrays as they're accessed. Slicing one only decodes the
+lines in the slice.
+"""
+
+from array import array
+
+from django.utils.safestring import SafeUnicode
+
+
+# Flags stored for each line.
+WHITESPACE_LINE = 1 << 0
+MOVED_LINE = 1 << 1
+NO_OLD_REGIONS = 1 << 2
+NO_NEW_REGIONS = 1 << 3
+
+# The typecode of the integer arrays.
+INT_TYPECODE = 'i'
+
+
+class PackedChunks(object):
+    """The chunks of a file, packed into arrays.
+
+    Use pack_chunks to create one, and unpack to get the chunks back.
+    """
+    def __init__(self):
+        self.chunk_info = []
+        self.chunk_num_lines = array(INT_TYPECODE)
+        self.line_nums = array(INT_TYPECODE)
+        self.flags = array('B')
+        self.markup = ''
+        self.markup_offsets = array(INT_TYPECODE, [0])
+        self.regions = array(INT_TYPECODE)
+        self.region_offsets = array(INT_TYPECODE, [0])
+        self.moved = {}
+        self._markup_text = None
+
+    def __getstate__(self):
+        return (self.chunk_info,
+                self.chunk_num_lines.tostring(),
+                self.line_nums.tostring(),
+                self.flags.tostring(),
+                self.markup,
+                self.markup_offsets.tostring(),
+                self.regions.tostring(),
+                self.region_offsets.tostring(),
+                self.moved)
+
+    def __setstate__(self, state):
+        self.__init__()
+
+        (self.chunk_info, chunk_num_lines, line_nums, flags, self.markup,
+         markup_offsets, regions, region_offsets, self.moved) = state
+
+        self.chunk_num_lines.fromstring(chunk_num_lines)
+        self.line_nums.fromstring(line_nums)
+        self.flags.fromstring(flags)
+        self.regions.fromstring(regions)
+
+        # These start out with an initial offset, which is in the state.
+        self.markup_offsets = array(INT_TYPECODE)
+        self.markup_offsets.fromstring(markup_offsets)
+        self.region_offsets = array(INT_TYPECODE)
+        self.region_offsets.fromstring(region_offsets)
+
+    def get_size(self):
+        """Returns roughly how many bytes the packed chunks take up."""
+        size = len(self.markup)
+
+        for values in (self.chunk_num_lines, self.line_nums, self.flags,
+                       self.markup_offsets, self.regions,
+                       self.region_offsets):
+            size += values.itemsize * len(values)
+
+        return size
+
+    def unpack(self):
+        """Returns the list of chunks.
+
+        Each call returns new chunk dictionaries, which can be modified
+        freely. Their lines are PackedLines.
+        """
+        chunks = []
+        start = 0
+
+        for info, num_lines in zip(self.chunk_info, self.chunk_num_lines):
+            chunk = dict(info)
+
+            if 'meta' in chunk:
+                chunk['meta'] = dict(chunk['meta'])
+
+            end = start + num_lines
+            chunk['lines'] = PackedLines(self, start, end)
+            chunks.append(chunk)
+            start = end
+
+        return chunks
+
+    def get_line(self, i):
+        """Decodes the line at index i, counting from the first chunk."""
+        if self._markup_text is None:
+            # Decoding everything at once is much faster than decoding each
+            # line.
+            self._markup_text = self.markup.decode('utf-8')
+
+        line_nums = self.line_nums
+        flags = self.flags[i]
+        markup = self._markup_text
+        markup_offsets = self.markup_offsets
+        region_offsets = self.region_offsets
+        j = i * 2
+
+        if flags & NO_OLD_REGIONS:
+            old_regions = None
+        elif region_offsets[j] == region_offsets[j + 1]:
+            old_regions = []
+        else:
+            old_regions = self._get_regions(j)
+
+        if flags & NO_NEW_REGIONS:
+            new_regions = None
+        elif region_offsets[j + 1] == region_offsets[j + 2]:
+            new_regions = []
+        else:
+            new_regions = self._get_regions(j + 1)
+
+        # The markup is always unicode, so this is what mark_safe would
+        # return, without the overhead of checking.
+        line = [
+            line_nums[i * 3],
+            line_nums[i * 3 + 1] or '',
+            SafeUnicode(markup[markup_offsets[j]:markup_offsets[j + 1]]),
+            old_regions,
+            line_nums[i * 3 + 2] or '',
+            SafeUnicode(markup[markup_offsets[j + 1]:markup_offsets[j + 2]]),
+            new_regions,
+            bool(flags & WHITESPACE_LINE),
+        ]
+
+        if flags & MOVED_LINE:
+            line.append(self.moved[i])
+
+        return line
+
+    def _get_regions(self, i):
+        regions = self.regions
+
+        return [(regions[j], regions[j + 1])
+                for j in xrange(self.region_offsets[i],
+                                self.region_offsets[i + 1], 2)]
+
+
+class PackedLines(object):
+    """The lines of a chunk in a PackedChunks.
+
+    This acts like a read-only list of lines, decoding them as they're
+    accessed. Slicing returns a list.
+    """
+    def __init__(self, packed, start, end):
+        self.packed = packed
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __iter__(self):
+        get_line = self.packed.get_line
+
+        for i in xrange(self.start, self.end):
+            yield get_line(i)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            get_line = self.packed.get_line
+            start = self.start
+
+            return [get_line(start + j)
+                    for j in xrange(*i.indices(len(self)))]
+
+        if i < 0:
+            i += len(self)
+
+        if i < 0 or i >= len(self):
+            raise IndexError('line index out of range')
+
+        return self.packed.get_line(self.start + i)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def pack_chunks(chunks):
+    """Packs a list of chunks into a PackedChunks."""
+    packed = PackedChunks()
+    line_nums = packed.line_nums
+    flags = packed.flags
+    markup = []
+    markup_offsets = packed.markup_offsets
+    markup_len = 0
+    regions = packed.regions
+    region_offsets = packed.region_offsets
+    i = 0
+
+    for chunk in chunks:
+        info = dict(chunk)
+        del info['lines']
+        packed.chunk_info.append(info)
+        packed.chunk_num_lines.append(len(chunk['lines']))
+
+        for line in chunk['lines']:
+            line_flags = 0
+
+            if line[7]:
+                line_flags |= WHITESPACE_LINE
+
+            if len(line) > 8:
+                line_flags |= MOVED_LINE
+                packed.moved[i] = line[8]
+
+            if line[3] is None:
+                line_flags |= NO_OLD_REGIONS
+
+            if line[6] is None:
+                line_flags |= NO_NEW_REGIONS
+
+            line_nums.append(line[0])
+            line_nums.append(line[1] or 0)
+            line_nums.append(line[4] or 0)
+            flags.append(line_flags)
+
+            # The offsets are into the decoded markup, so they count
+            # characters rather than bytes.
+            for text in (line[2], line[5]):
+                markup.append(text)
+                markup_len += len(text)
+                markup_offsets.append(markup_len)
+
+            for line_regions in (line[3], line[6]):
+                for region in line_regions or []:
+                    regions.extend(region)
+
+                region_offsets.append(len(regions))
+
+            i += 1
+
+    packed.markup = u''.join(markup).encode('utf-8')
+
+    return packed
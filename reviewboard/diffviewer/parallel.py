@@ -0,0 +1,127 @@
+"""Helpers for running work in parallel.
+
+These are used to fetch files from repositories using a pool of threads,
+and to generate diffs using a pool of processes. Results are always
+returned in the order of the work given, so callers can process them as
+if the work had been done serially.
+"""
+
+import logging
+import sys
+import threading
+
+from reviewboard.diffviewer.timing import get_request_timings, \
+                                          set_request_timings
+
+try:
+    import multiprocessing
+except ImportError:
+    # This is only available in Python 2.6 and higher.
+    multiprocessing = None
+
+
+def run_in_threads(func, args_list, max_threads):
+    """Calls func with each tuple of arguments in args_list, using threads.
+
+    At most max_threads calls are made at once. Returns a list of
+    (result, exc_info) tuples in the same order as args_list. If a call
+    raised an exception, result is None and exc_info is the value of
+    sys.exc_info() for it. Otherwise, exc_info is None.
+
+    Stages timed in the threads are added to the timings of the request
+    being handled by the calling thread, if any.
+    """
+    results = [None] * len(args_list)
+    next_index = [0]
+    lock = threading.Lock()
+    timings = get_request_timings()
+
+    def worker():
+        set_request_timings(timings)
+
+        while True:
+            lock.acquire()
+
+            try:
+                i = next_index[0]
+                next_index[0] += 1
+            finally:
+                lock.release()
+
+            if i >= len(args_list):
+                break
+
+            try:
+                results[i] = (func(*args_list[i]), None)
+            except Exception:
+                results[i] = (None, sys.exc_info())
+
+    threads = []
+
+    for i in xrange(min(max_threads, len(args_list))):
+        thread = threading.Thread(target=worker)
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+_process_pool = None
+_process_pool_size = 0
+_process_pool_lock = threading.Lock()
+
+
+def can_run_in_processes():
+    """Returns whether run_in_processes is supported."""
+    return multiprocessing is not None
+
+
+def get_process_pool(num_processes):
+    """Returns a process pool with the given number of processes.
+
+    The pool is created the first time it's needed, and then kept around
+    for the life of the process. It's replaced if the requested size
+    changes.
+    """
+    global _process_pool, _process_pool_size
+
+    _process_pool_lock.acquire()
+
+    try:
+        if _process_pool is None or _process_pool_size != num_processes:
+            if _process_pool is not None:
+                _process_pool.close()
+
+            logging.debug("Starting a pool of %d processes" % num_processes)
+            _process_pool = multiprocessing.Pool(num_processes)
+            _process_pool_size = num_processes
+
+        return _process_pool
+    finally:
+        _process_pool_lock.release()
+
+
+def run_in_processes(func, args_list, num_processes):
+    """Calls func with each tuple of arguments in args_list, using processes.
+
+    func must be a module-level function, and its arguments and return
+    value must be picklable. Returns a list of (result, exc_info) tuples in
+    the same order as args_list, like run_in_threads. Since tracebacks can't
+    be passed between processes, the traceback in exc_info will be for the
+    point where the result was retrieved.
+    """
+    pool = get_process_pool(num_processes)
+    async_results = [pool.apply_async(func, args) for args in args_list]
+    results = []
+
+    for async_result in async_results:
+        try:
+            results.append((async_result.get(), None))
+        except Exception:
+            results.append((None, sys.exc_info()))
+
+    return results
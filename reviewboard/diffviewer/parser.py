@@ -1,5 +1,10 @@
 import logging
 import re
+from array import array
+
+
+# Matches the end of a line, the way str.splitlines does.
+LINE_END_RE = re.compile(r'\r\n|\r|\n')
 
 
 class File(object):
@@ -14,6 +19,88 @@ class File(object):
         self.deleted = False
 
 
+class DiffLines(object):
+    """The lines of a diff, without their line endings.
+
+    This acts like the list returned by splitlines, but only stores where
+    each line starts in the diff. Lines are sliced out of the diff as
+    they're accessed. For large diffs, this takes a small fraction of the
+    memory of a list of strings.
+    """
+    # The diff is split into lines this many bytes at a time.
+    BLOCK_SIZE = 1024 * 1024
+
+    def __init__(self, data):
+        self.data = data
+        self.offsets = array('l', [0])
+        self._find_lines()
+
+    def _find_lines(self):
+        data = self.data
+        data_len = len(data)
+        offsets = self.offsets
+        pos = 0
+
+        while pos < data_len:
+            block_end = pos + self.BLOCK_SIZE
+            lines = data[pos:block_end].splitlines(True)
+
+            if block_end < data_len:
+                # The last line may continue into the next block. It'll be
+                # split along with that.
+                del lines[-1]
+
+                if not lines:
+                    # This line is longer than a block.
+                    m = LINE_END_RE.search(data, block_end - 1)
+
+                    if m:
+                        lines = [data[pos:m.end()]]
+                    else:
+                        lines = [data[pos:]]
+
+            for line in lines:
+                pos += len(line)
+                offsets.append(pos)
+
+        self.num_lines = len(offsets) - 1
+
+    def __len__(self):
+        return self.num_lines
+
+    def __getitem__(self, i):
+        offsets = self.offsets
+
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(self.num_lines))]
+        elif i < 0:
+            i += self.num_lines
+
+            if i < 0:
+                raise IndexError('line index out of range')
+
+        # Each line ends with at most one line ending, so this only
+        # strips that.
+        return self.data[offsets[i]:offsets[i + 1]].rstrip('\r\n')
+
+    def get_text(self, start, end):
+        """Returns the lines from start up to end, as a string.
+
+        Every line ends with a '\n', whatever its original line ending was.
+        """
+        if start >= end:
+            return ""
+
+        text = self.data[self.offsets[start]:self.offsets[end]]
+
+        if '\r' in text:
+            return '\n'.join(text.splitlines()) + '\n'
+        elif not text.endswith('\n'):
+            return text + '\n'
+        else:
+            return text
+
+
 class DiffParserError(Exception):
     def __init__(self, msg, linenum):
         Exception.__init__(self, msg)
@@ -30,7 +117,7 @@ class DiffParser(object):
 
     def __init__(self, data):
         self.data = data
-        self.lines = data.splitlines()
+        self.lines = DiffLines(data)
 
     def parse(self):
         """
@@ -42,23 +129,32 @@ class DiffParser(object):
 
         self.files = []
         file = None
+        num_lines = len(self.lines)
         i = 0
 
+        # The line the current file's changes start on. Everything from
+        # there to the next file's header is part of its diff.
+        changes_start = 0
+
         # Go through each line in the diff, looking for diff headers.
-        while i < len(self.lines):
+        while i < num_lines:
             next_linenum, new_file = self.parse_change_header(i)
 
             if new_file:
                 # This line is the start of a new file diff.
+                if file:
+                    file.data += self.lines.get_text(changes_start, i)
+
                 file = new_file
                 self.files.append(file)
                 i = next_linenum
+                changes_start = i
             else:
-                if file:
-                    file.data += self.lines[i] + "\n"
-
                 i += 1
 
+        if file:
+            file.data += self.lines.get_text(changes_start, num_lines)
+
         logging.debug("DiffParser.parse: Finished parsing diff.")
 
         return self.files
@@ -0,0 +1,383 @@
+"""An in-process unified diff applier.
+
+This applies unified diffs to in-memory buffers, following the same rules
+that GNU patch uses to locate hunks (offsets, fuzz and the
+"\\ No newline at end of file" marker). It's used to avoid spawning a
+`patch` process for every file we display.
+
+Anything this module doesn't understand raises a PatchError, and the caller
+is expected to fall back on the real `patch`.
+"""
+
+import re
+
+
+# GNU patch's default maximum fuzz factor.
+MAX_FUZZ = 2
+
+HUNK_HEADER_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+class PatchError(Exception):
+    """An error applying a patch in-process.
+
+    This doesn't necessarily mean that the patch is bad, just that we
+    couldn't apply it ourselves.
+    """
+    pass
+
+
+class Hunk(object):
+    """A single hunk from a unified diff.
+
+    ``lines`` is a list of (type, line) tuples, where type is one of
+    ' ', '-' or '+', and the line includes its trailing newline (unless
+    marked with "\\ No newline at end of file").
+    """
+    def __init__(self, orig_start, orig_len, new_start, new_len):
+        self.orig_start = orig_start
+        self.orig_len = orig_len
+        self.new_start = new_start
+        self.new_len = new_len
+        self.lines = []
+
+    def reverse(self):
+        """Returns a copy of the hunk with the changes reversed."""
+        hunk = Hunk(self.new_start, self.new_len,
+                    self.orig_start, self.orig_len)
+        swap = {'+': '-', '-': '+', ' ': ' '}
+        hunk.lines = [(swap[linetype], line)
+                      for linetype, line in self.lines]
+
+        return hunk
+
+    def get_orig_lines(self):
+        return [line for linetype, line in self.lines if linetype != '+']
+
+    def get_first(self):
+        """Returns the 1-based line number the hunk expects to start at.
+
+        Like GNU patch, a hunk that only adds lines is treated as appending
+        after the line it references.
+        """
+        if self.orig_len == 0:
+            return self.orig_start + 1
+
+        return self.orig_start
+
+    def get_prefix_context(self):
+        count = 0
+
+        for linetype, line in self.lines:
+            if linetype != ' ':
+                break
+
+            count += 1
+
+        return count
+
+    def get_suffix_context(self):
+        count = 0
+
+        for linetype, line in reversed(self.lines):
+            if linetype != ' ':
+                break
+
+            count += 1
+
+        return count
+
+
+def split_lines(data):
+    """Splits data into lines, keeping the trailing newlines.
+
+    Only '\\n' is treated as a line separator, unlike str.splitlines().
+    """
+    if not data:
+        return []
+
+    lines = [line + '\n' for line in data.split('\n')]
+
+    if data.endswith('\n'):
+        del lines[-1]
+    else:
+        lines[-1] = lines[-1][:-1]
+
+    return lines
+
+
+def parse_hunks(diff):
+    """Parses the hunks out of a single-file unified diff.
+
+    Raises PatchError if the diff contains anything we don't know how to
+    apply.
+    """
+    hunks = []
+    lines = split_lines(diff)
+    num_lines = len(lines)
+    i = 0
+
+    while i < num_lines:
+        line = lines[i]
+
+        if line.startswith('@@ '):
+            m = HUNK_HEADER_RE.match(line)
+
+            if not m:
+                raise PatchError('Malformed hunk header: %r' % line)
+
+            hunk = Hunk(int(m.group(1)), int(m.group(2) or 1),
+                        int(m.group(3)), int(m.group(4) or 1))
+            i = _parse_hunk_body(hunk, lines, i + 1)
+            hunks.append(hunk)
+        elif line.startswith('***************'):
+            raise PatchError('Context diffs are not supported')
+        elif line.startswith('GIT binary patch'):
+            raise PatchError('Binary patches are not supported')
+        elif (hunks and line.startswith('--- ') and i + 1 < num_lines and
+              lines[i + 1].startswith('+++ ')):
+            raise PatchError('Diffs spanning multiple files are not '
+                             'supported')
+        else:
+            # Anything else is a header or garbage, which patch ignores.
+            i += 1
+
+    if not hunks:
+        raise PatchError('No hunks were found in the diff')
+
+    return hunks
+
+
+def _parse_hunk_body(hunk, lines, i):
+    """Parses the lines of a hunk, returning the index after the hunk."""
+    num_lines = len(lines)
+    orig_remaining = hunk.orig_len
+    new_remaining = hunk.new_len
+
+    while orig_remaining > 0 or new_remaining > 0:
+        if i >= num_lines:
+            raise PatchError('Unexpected end of diff in hunk')
+
+        line = lines[i]
+        linetype = line[:1]
+
+        if line == '\n':
+            # Some tools strip the trailing whitespace from diffs,
+            # turning empty context lines into empty lines.
+            linetype = ' '
+            line = ' \n'
+
+        if linetype == '\\':
+            _apply_no_newline_marker(hunk)
+            i += 1
+            continue
+        elif linetype == ' ':
+            orig_remaining -= 1
+            new_remaining -= 1
+        elif linetype == '-':
+            orig_remaining -= 1
+        elif linetype == '+':
+            new_remaining -= 1
+        else:
+            raise PatchError('Unexpected line in hunk: %r' % line)
+
+        if orig_remaining < 0 or new_remaining < 0:
+            raise PatchError('Hunk line counts do not match the header')
+
+        hunk.lines.append((linetype, line[1:]))
+        i += 1
+
+    # The marker for the very last line in a hunk comes after the line
+    # counts have been satisfied.
+    if i < num_lines and lines[i].startswith('\\'):
+        _apply_no_newline_marker(hunk)
+        i += 1
+
+    return i
+
+
+def _apply_no_newline_marker(hunk):
+    if not hunk.lines:
+        raise PatchError('Unexpected "No newline" marker')
+
+    linetype, line = hunk.lines[-1]
+
+    if line.endswith('\n'):
+        hunk.lines[-1] = (linetype, line[:-1])
+
+
+def apply_patch(diff, data):
+    """Applies a single-file unified diff to a buffer.
+
+    Both the diff and the buffer are expected to have normalized ('\\n')
+    line endings. Returns the patched buffer, or raises PatchError if the
+    diff couldn't be applied.
+    """
+    hunks = parse_hunks(diff)
+    input_lines = split_lines(data)
+    num_input_lines = len(input_lines)
+    missing_newline = data and not data.endswith('\n')
+    result = []
+
+    # These follow the names used by GNU patch. Line numbers are 1-based.
+    last_frozen_line = 0
+    last_offset = 0
+
+    for i, hunk in enumerate(hunks):
+        where = 0
+        max_fuzz = min(MAX_FUZZ, max(hunk.get_prefix_context(),
+                                     hunk.get_suffix_context()))
+        fuzz = 0
+
+        while fuzz <= max_fuzz:
+            where, offset = _locate_hunk(hunk, input_lines, fuzz,
+                                         last_frozen_line, last_offset)
+
+            if where:
+                last_offset = offset
+                break
+
+            if (i == 0 and
+                _locate_hunk(hunk.reverse(), input_lines, fuzz,
+                             last_frozen_line, last_offset)[0]):
+                # patch would ask whether this is a reversed patch.
+                # Let it deal with that.
+                raise PatchError('The patch appears to be reversed or '
+                                 'already applied')
+
+            fuzz += 1
+
+        if not where:
+            raise PatchError('Unable to find a location for the hunk '
+                             'starting at line %s' % hunk.orig_start)
+
+        # Like patch, we only copy lines from the file up to the last
+        # change in the hunk. Trailing context is left for the next hunk,
+        # which may overlap it. Context is always taken from the file,
+        # rather than the diff, since with fuzz it may not have matched.
+        pos = where - 1
+
+        for linetype, line in hunk.lines:
+            if linetype == '+':
+                if (missing_newline and
+                    last_frozen_line < pos == num_input_lines):
+                    # patch would join this onto the file's last line.
+                    raise PatchError('Unable to add lines after a line '
+                                     'with no newline')
+
+                result.extend(input_lines[last_frozen_line:pos])
+                result.append(line)
+                last_frozen_line = pos
+            elif linetype == '-':
+                result.extend(input_lines[last_frozen_line:pos])
+                pos += 1
+                last_frozen_line = pos
+            else:
+                pos += 1
+
+    result.extend(input_lines[last_frozen_line:])
+
+    # Only the last line may lack a newline. Like patch, add one to any
+    # other line that ended up without one.
+    for i in xrange(len(result) - 1):
+        if not result[i].endswith('\n'):
+            result[i] += '\n'
+
+    return ''.join(result)
+
+
+def _locate_hunk(hunk, input_lines, fuzz, last_frozen_line, last_offset):
+    """Finds where a hunk applies in the file.
+
+    This is a port of locate_hunk() from GNU patch. Returns a tuple of the
+    1-based line number the hunk applies at (or 0 if it doesn't apply) and
+    the new accumulated offset.
+    """
+    pattern = hunk.get_orig_lines()
+    pat_lines = len(pattern)
+    num_input_lines = len(input_lines)
+    first = hunk.get_first()
+    first_guess = first + last_offset
+    prefix_context = hunk.get_prefix_context()
+    suffix_context = hunk.get_suffix_context()
+    context = max(prefix_context, suffix_context)
+    prefix_fuzz = fuzz + prefix_context - context
+    suffix_fuzz = fuzz + suffix_context - context
+    max_where = num_input_lines - (pat_lines - suffix_fuzz) + 1
+    min_where = last_frozen_line + 1
+    max_pos_offset = max_where - first_guess
+    max_neg_offset = first_guess - min_where
+    max_offset = max(max_pos_offset, max_neg_offset)
+
+    if not pat_lines:
+        # A null range always matches.
+        return first_guess, last_offset
+
+    # Don't try lines <= 0.
+    if first_guess <= max_neg_offset:
+        max_neg_offset = first_guess - 1
+
+    if prefix_fuzz < 0 and first <= 1:
+        # The hunk has less leading context than trailing context, so it
+        # can only match at the start of the file.
+        if (suffix_fuzz < 0 and
+            (pat_lines != num_input_lines or
+             prefix_context < last_frozen_line)):
+            # It can only match the entire file, and it doesn't.
+            return 0, last_offset
+
+        offset = 1 - first_guess
+
+        if (last_frozen_line <= prefix_context and
+            offset <= max_pos_offset and
+            _patch_matches(pattern, input_lines, first_guess + offset,
+                           0, suffix_fuzz)):
+            return first_guess + offset, last_offset + offset
+
+        return 0, last_offset
+    elif prefix_fuzz < 0:
+        prefix_fuzz = 0
+
+    if suffix_fuzz < 0:
+        # The hunk can only match at the end of the file.
+        offset = first_guess - (num_input_lines - pat_lines + 1)
+
+        if (offset <= max_neg_offset and
+            _patch_matches(pattern, input_lines, first_guess - offset,
+                           prefix_fuzz, 0)):
+            return first_guess - offset, last_offset - offset
+
+        return 0, last_offset
+
+    offset = 0
+
+    while offset <= max_offset:
+        if (offset <= max_pos_offset and
+            _patch_matches(pattern, input_lines, first_guess + offset,
+                           prefix_fuzz, suffix_fuzz)):
+            return first_guess + offset, last_offset + offset
+
+        if (0 < offset <= max_neg_offset and
+            _patch_matches(pattern, input_lines, first_guess - offset,
+                           prefix_fuzz, suffix_fuzz)):
+            return first_guess - offset, last_offset - offset
+
+        offset += 1
+
+    return 0, last_offset
+
+
+def _patch_matches(pattern, input_lines, base, prefix_fuzz, suffix_fuzz):
+    """Returns whether the hunk's original lines match at a location.
+
+    The first prefix_fuzz and last suffix_fuzz lines of the pattern are
+    ignored.
+    """
+    start = base - 1 + prefix_fuzz
+    end = base - 1 + len(pattern) - suffix_fuzz
+
+    if start < 0 or end > len(input_lines):
+        return False
+
+    return input_lines[start:end] == \
+           pattern[prefix_fuzz:len(pattern) - suffix_fuzz]
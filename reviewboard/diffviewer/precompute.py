@@ -0,0 +1,181 @@
+"""Generates and caches diffs ahead of time.
+
+When a diff is uploaded, queue_precompute_job() records a job for it. The
+precompute_diffs management command runs a pool of workers that claim these
+jobs and generate the same cached chunks the diff viewer would, along with
+the interdiff against the previous revision. By the time someone looks at
+the diff, it's ready to be shown.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime
+
+from django.db import connection, transaction
+from djblets.siteconfig.models import SiteConfiguration
+
+from reviewboard.admin.checks import get_can_enable_syntax_highlighting
+from reviewboard.diffviewer.diffutils import get_diff_files
+from reviewboard.diffviewer.models import DiffPrecomputeJob
+
+
+def queue_precompute_job(diffset, previous_diffset=None):
+    """Queues a job to precompute the diffs for a diffset.
+
+    If previous_diffset is provided, the interdiff between it and diffset
+    is precomputed as well.
+
+    Returns the new job, or None if precomputing is disabled.
+    """
+    siteconfig = SiteConfiguration.objects.get_current()
+
+    if not siteconfig.get('diffviewer_precompute_diffs'):
+        return None
+
+    return DiffPrecomputeJob.objects.create(diffset=diffset,
+                                           previous_diffset=previous_diffset)
+
+
+def claim_next_job():
+    """Claims the oldest pending job and marks it as running.
+
+    This is safe to call from several workers at once, in any number of
+    processes. Returns None if there are no pending jobs.
+    """
+    # End any transaction left open by a previous query, so that we see
+    # jobs queued since then.
+    transaction.commit_unless_managed()
+
+    while True:
+        try:
+            job = DiffPrecomputeJob.objects.filter(
+                status=DiffPrecomputeJob.PENDING)[0]
+        except IndexError:
+            return None
+
+        now = datetime.now()
+
+        # Another worker may have claimed this job since we looked it up,
+        # in which case nothing will be updated and we try the next one.
+        if DiffPrecomputeJob.objects.filter(
+            pk=job.pk,
+            status=DiffPrecomputeJob.PENDING).update(
+                status=DiffPrecomputeJob.RUNNING,
+                started=now):
+            job.status = DiffPrecomputeJob.RUNNING
+            job.started = now
+
+            return job
+
+
+def run_job(job):
+    """Generates and caches the diffs for a job.
+
+    The files are all processed together, so their original versions can
+    be fetched at once and their chunks generated in parallel. If that
+    fails, each file is tried on its own to find out which ones failed.
+    The job is marked as failed if any of them did, with the errors
+    recorded on it.
+    """
+    siteconfig = SiteConfiguration.objects.get_current()
+    highlighting = (siteconfig.get('diffviewer_syntax_highlighting') and
+                    get_can_enable_syntax_highlighting())
+
+    diffset = job.diffset
+    errors = []
+
+    logging.debug("Precomputing diffs for diffset id %s" % diffset.id)
+
+    try:
+        get_diff_files(diffset, None, None, highlighting)
+    except Exception, e:
+        logging.warning("Error precomputing diffs for diffset id %s. "
+                        "Retrying each file separately: %s" %
+                        (diffset.id, e))
+
+        # The files that succeeded were cached, so this only does the work
+        # for the rest again.
+        for filediff in diffset.files.all():
+            try:
+                get_diff_files(diffset, filediff, None, highlighting)
+            except Exception, e:
+                logging.error("Error precomputing diff for filediff id %s: "
+                              "%s" % (filediff.id, e), exc_info=1)
+                errors.append("%s: %s" % (filediff.source_file, e))
+
+    if job.previous_diffset:
+        try:
+            get_diff_files(job.previous_diffset, None, diffset, highlighting)
+        except Exception, e:
+            logging.error("Error precomputing interdiff for diffset ids "
+                          "%s-%s: %s" %
+                          (job.previous_diffset.id, diffset.id, e),
+                          exc_info=1)
+            errors.append("Interdiff from revision %s: %s" %
+                          (job.previous_diffset.revision, e))
+
+    if errors:
+        job.status = DiffPrecomputeJob.FAILED
+        job.error = "\n".join(errors)
+    else:
+        job.status = DiffPrecomputeJob.DONE
+
+    job.completed = datetime.now()
+    job.save()
+
+
+def reset_running_jobs():
+    """Marks jobs left running by workers that have died as pending.
+
+    This should only be called when no workers are running.
+    Returns the number of jobs reset.
+    """
+    return DiffPrecomputeJob.objects.filter(
+        status=DiffPrecomputeJob.RUNNING).update(
+            status=DiffPrecomputeJob.PENDING,
+            started=None)
+
+
+def process_jobs(num_workers=1, wait=True, poll_interval=5):
+    """Processes precompute jobs using a pool of worker threads.
+
+    If wait is True, the workers poll for new jobs every poll_interval
+    seconds once the queue is empty, and this never returns. Otherwise,
+    this returns once there are no pending jobs left.
+    """
+    threads = []
+
+    for i in xrange(num_workers):
+        thread = threading.Thread(target=_process_jobs,
+                                  args=(wait, poll_interval))
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        # Joining with a timeout lets us be interrupted with Ctrl-C.
+        while thread.isAlive():
+            thread.join(1)
+
+
+def _process_jobs(wait, poll_interval):
+    try:
+        while True:
+            job = claim_next_job()
+
+            if job:
+                try:
+                    run_job(job)
+                except Exception, e:
+                    # Keep the worker alive. The job is left as running,
+                    # and can be reset with reset_running_jobs.
+                    logging.error("Error running precompute job %s: %s" %
+                                  (job.id, e), exc_info=1)
+            elif wait:
+                time.sleep(poll_interval)
+            else:
+                break
+    finally:
+        # Each thread gets its own database connection.
+        connection.close()
@@ -1,14 +1,33 @@
 import os
+import pickle
+import random
+import shutil
+import tempfile
 import unittest
 
 from django.test import TestCase
+from django.utils.safestring import SafeData
 from djblets.siteconfig.models import SiteConfiguration
 
-from reviewboard.diffviewer.models import DiffSet, FileDiff
+from reviewboard.diffviewer.filecache import DiskCache
+from reviewboard.diffviewer.linetable import LineTable
+from reviewboard.diffviewer.models import DiffPrecomputeJob, DiffSet, \
+                                          FileDiff
 from reviewboard.diffviewer.templatetags.difftags import highlightregion
+import reviewboard.diffviewer.benchmark as benchmark
 import reviewboard.diffviewer.diffutils as diffutils
+import reviewboard.diffviewer.highlighting as highlighting
+import reviewboard.diffviewer.myersdiff as myersdiff
+import reviewboard.diffviewer.packedchunks as packedchunks
+import reviewboard.diffviewer.parallel as parallel
 import reviewboard.diffviewer.parser as diffparser
-from reviewboard.scmtools.models import Repository
+import reviewboard.diffviewer.patcher as patcher
+import reviewboard.diffviewer.precompute as precompute
+import reviewboard.diffviewer.timing as timing
+from reviewboard.scmtools.core import PRE_CREATION
+from reviewboard.scmtools.errors import FileNotFoundError
+from reviewboard.scmtools.git import GitTool
+from reviewboard.scmtools.models import Repository, Tool
 
 
 class MyersDifferTest(TestCase):
@@ -35,8 +54,52 @@ class MyersDifferTest(TestCase):
                           ("equal",   5, 8, 9, 12)])
 
 
+    def testCompactDiffer(self):
+        """Testing compact myers differ against myers differ"""
+        def random_lines(count):
+            return ['%d\n' % random.randint(0, 30) for i in xrange(count)]
+
+        random.seed(0)
+
+        for i in xrange(200):
+            a = random_lines(random.choice([0, 1, 10, 100, 1000]))
+            b = list(a)
+
+            for j in xrange(random.randint(0, 15)):
+                pos = random.randint(0, len(b))
+                action = random.randint(0, 3)
+
+                if action == 0:
+                    b[pos:pos] = random_lines(random.randint(1, 30))
+                elif action == 1:
+                    del b[pos:pos + random.randint(1, 30)]
+                elif action == 2:
+                    b[pos:pos + 1] = ['  %s' % line
+                                      for line in b[pos:pos + 1]]
+                else:
+                    b[pos:pos] = b[random.randint(0, len(b)):][:40]
+
+            ignore_space = bool(random.randint(0, 1))
+            expected = list(myersdiff.MyersDiffer(a, b, ignore_space)
+                            .get_opcodes())
+
+            for use_numpy in (True, False):
+                old_numpy = myersdiff.numpy
+
+                if not use_numpy:
+                    myersdiff.numpy = None
+
+                try:
+                    differ = myersdiff.CompactMyersDiffer(a, b, ignore_space)
+                    self.assertEqual(list(differ.get_opcodes()), expected)
+                finally:
+                    myersdiff.numpy = old_numpy
+
     def __test_diff(self, a, b, expected):
-        opcodes = list(diffutils.MyersDiffer(a, b).get_opcodes())
+        opcodes = list(myersdiff.MyersDiffer(a, b).get_opcodes())
+        self.assertEquals(opcodes, expected)
+
+        opcodes = list(myersdiff.CompactMyersDiffer(a, b).get_opcodes())
         self.assertEquals(opcodes, expected)
 
 
@@ -151,7 +214,7 @@ class InterestingLinesTest(TestCase):
         b = f.readlines()
         f.close()
 
-        differ = diffutils.MyersDiffer(a, b)
+        differ = myersdiff.MyersDiffer(a, b)
         diffutils.register_interesting_lines_for_filename(differ, filename)
 
         # Begin the scan.
@@ -208,6 +271,55 @@ class DiffParserTest(unittest.TestCase):
         files = diffparser.DiffParser(data).parse()
         self.compareDiffs(files, "context")
 
+    def testParseLineEndings(self):
+        """Testing parse with mixed line endings"""
+        data = ('--- README\t2002-01-01\r\n'
+                '+++ README\t2002-01-02\r\n'
+                '@@ -1 +1 @@\r\n'
+                '-foo\r'
+                '+bar\n'
+                '--- foo.c\t2002-01-01\n'
+                '+++ foo.c\t2002-01-02\n'
+                '@@ -1 +1 @@\n'
+                '-a\n'
+                '+b')
+        files = diffparser.DiffParser(data).parse()
+
+        self.assertEqual(len(files), 2)
+        self.assertEqual(files[0].origFile, 'README')
+        self.assertEqual(files[0].data,
+                         '--- README\t2002-01-01\n'
+                         '+++ README\t2002-01-02\n'
+                         '@@ -1 +1 @@\n'
+                         '-foo\n'
+                         '+bar\n')
+        self.assertEqual(files[1].origFile, 'foo.c')
+        self.assertEqual(files[1].data,
+                         '--- foo.c\t2002-01-01\n'
+                         '+++ foo.c\t2002-01-02\n'
+                         '@@ -1 +1 @@\n'
+                         '-a\n'
+                         '+b\n')
+
+    def testDiffLines(self):
+        """Testing DiffLines"""
+        data = 'abc\r\n\ndef\rghi\r\r\njkl'
+        old_block_size = diffparser.DiffLines.BLOCK_SIZE
+
+        try:
+            for block_size in (1, 2, 3, 5, 1024):
+                diffparser.DiffLines.BLOCK_SIZE = block_size
+                lines = diffparser.DiffLines(data)
+
+                self.assertEqual(len(lines), 6)
+                self.assertEqual(lines[:], data.splitlines())
+                self.assertEqual(lines[-1], 'jkl')
+                self.assertEqual(lines.get_text(1, 4), '\ndef\nghi\n')
+                self.assertEqual(lines.get_text(4, 6), '\njkl\n')
+                self.assertRaises(IndexError, lambda: lines[6])
+        finally:
+            diffparser.DiffLines.BLOCK_SIZE = old_block_size
+
     def testPatch(self):
         """Testing patching"""
 
@@ -296,6 +408,33 @@ class DiffParserTest(unittest.TestCase):
         regions = diffutils.get_line_changed_regions(old, new)
         deepEqual(regions, (None, None))
 
+    def testInterlineCached(self):
+        """Testing inter-line diffs returned from the cache"""
+        old = 'submitter = models.ForeignKey(Person, verbose_name="Submitter")'
+        new = 'submitter = models.ForeignKey(User, verbose_name="Submitter")'
+        regions = diffutils.get_line_changed_regions(old, new)
+        regions[0].append((0, 1))
+
+        # Changing the results mustn't change what's cached.
+        self.assertEqual(diffutils.get_line_changed_regions(old, new),
+                         ([(30, 36)], [(30, 34)]))
+
+    def testInterlineCachedUnicode(self):
+        """Testing inter-line diffs of Unicode lines returned from the cache"""
+        old = u'label = u"R\xe9sum\xe9"'
+        new = u'label = u"CV"'
+
+        for i in range(2):
+            self.assertEqual(diffutils.get_line_changed_regions(old, new),
+                             ([(10, 16)], [(10, 12)]))
+
+    def testInterlineLongLines(self):
+        """Testing inter-line diffs with very long lines"""
+        old = 'x = 1; ' * diffutils.MAX_LINE_CHANGED_REGIONS_LENGTH
+        new = old + 'y = 2;'
+        self.assertEqual(diffutils.get_line_changed_regions(old, new),
+                         (None, None))
+
     def testMoveDetection(self):
         """Testing move detection"""
         # movetest1 has two blocks of code that would appear to be moves:
@@ -345,6 +484,564 @@ class DiffParserTest(unittest.TestCase):
         return data
 
 
+class PatcherTest(unittest.TestCase):
+    """Unit tests for the in-process patcher."""
+    PREFIX = os.path.join(os.path.dirname(__file__), 'testdata')
+
+    def testTestData(self):
+        """Testing in-process patching of the test data"""
+        for name in os.listdir(os.path.join(self.PREFIX, 'new_src')):
+            old = diffutils.convert_line_endings(
+                self._get_file('orig_src', name))
+            new = diffutils.convert_line_endings(
+                self._get_file('new_src', name))
+            diff = diffutils.convert_line_endings(
+                self._get_file('diffs', 'unified', name + '.diff'))
+
+            self.assertEqual(patcher.apply_patch(diff, old), new)
+
+    def testOffset(self):
+        """Testing in-process patching with offset hunks"""
+        diff = ('--- a\n'
+                '+++ b\n'
+                '@@ -1,3 +1,3 @@\n'
+                ' a\n'
+                '-b\n'
+                '+B\n'
+                ' c\n')
+        self.assertEqual(patcher.apply_patch(diff, 'x\ny\na\nb\nc\nd\n'),
+                         'x\ny\na\nB\nc\nd\n')
+
+    def testFuzz(self):
+        """Testing in-process patching with fuzzy context"""
+        diff = ('--- a\n'
+                '+++ b\n'
+                '@@ -1,5 +1,5 @@\n'
+                ' a\n'
+                ' b\n'
+                '-c\n'
+                '+C\n'
+                ' d\n'
+                ' e\n')
+        self.assertEqual(patcher.apply_patch(diff, 'z\nb\nc\nd\ny\n'),
+                         'z\nb\nC\nd\ny\n')
+
+    def testNoNewline(self):
+        """Testing in-process patching with "No newline at end of file\""""
+        diff = ('--- a\n'
+                '+++ b\n'
+                '@@ -1,2 +1,2 @@\n'
+                ' a\n'
+                '-b\n'
+                '\\ No newline at end of file\n'
+                '+b\n')
+        self.assertEqual(patcher.apply_patch(diff, 'a\nb'), 'a\nb\n')
+
+    def testUnsupported(self):
+        """Testing in-process patching with diffs that must use patch"""
+        # Reversed patches.
+        diff = ('--- a\n'
+                '+++ b\n'
+                '@@ -1,2 +1,2 @@\n'
+                ' a\n'
+                '-b\n'
+                '+B\n')
+        self.assertRaises(patcher.PatchError,
+                          lambda: patcher.apply_patch(diff, 'a\nB\n'))
+
+        # Context diffs.
+        diff = self._get_file('diffs', 'context', 'foo.c.diff')
+        old = self._get_file('orig_src', 'foo.c')
+        self.assertRaises(patcher.PatchError,
+                          lambda: patcher.apply_patch(diff, old))
+
+        # But patch() should still handle them.
+        self.assertEqual(diffutils.patch(diff, old, 'foo.c'),
+                         self._get_file('new_src', 'foo.c'))
+
+    def _get_file(self, *relative):
+        f = open(os.path.join(*tuple([self.PREFIX] + list(relative))))
+        data = f.read()
+        f.close()
+        return data
+
+
+class DiskCacheTest(unittest.TestCase):
+    """Unit tests for the on-disk file cache."""
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix='reviewboard.')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def testSetGet(self):
+        """Testing DiskCache.set and DiskCache.get"""
+        cache = DiskCache(self.path, 1024)
+        self.assertEqual(cache.get('abcdef'), None)
+
+        cache.set('abcdef', 'test data')
+        self.assertEqual(cache.get('abcdef'), 'test data')
+
+        # A new instance should see the same data.
+        cache = DiskCache(self.path, 1024)
+        self.assertEqual(cache.get('abcdef'), 'test data')
+
+    def testPrune(self):
+        """Testing DiskCache evicting the least recently used entries"""
+        cache = DiskCache(self.path, 250)
+        cache.set('aa1', 'x' * 100)
+        cache.set('bb2', 'x' * 100)
+
+        # Make aa1 the most recently used.
+        os.utime(cache._get_filename('bb2'), (1, 1))
+        self.assertNotEqual(cache.get('aa1'), None)
+
+        cache.set('cc3', 'x' * 100)
+        self.assertNotEqual(cache.get('aa1'), None)
+        self.assertEqual(cache.get('bb2'), None)
+        self.assertNotEqual(cache.get('cc3'), None)
+
+    def testReplaceEntry(self):
+        """Testing DiskCache.set replacing an existing entry"""
+        cache = DiskCache(self.path, 1024)
+        cache.set('aa1', 'x' * 100)
+        cache.set('bb2', 'x' * 100)
+        cache.set('aa1', 'x' * 50)
+        self.assertEqual(cache.total_size, 150)
+        self.assertEqual(cache.get('aa1'), 'x' * 50)
+
+    def testCreateDirectory(self):
+        """Testing DiskCache creating a private cache directory"""
+        path = os.path.join(self.path, 'cache')
+        cache = DiskCache(path, 1024)
+        cache.set('abcdef', 'test data')
+        self.assertEqual(cache.get('abcdef'), 'test data')
+        self.assertEqual(os.stat(path).st_mode & 0777, 0700)
+
+    def testOtherOwner(self):
+        """Testing DiskCache refusing a directory owned by another user"""
+        if not hasattr(os, 'getuid'):
+            return
+
+        old_getuid = os.getuid
+        os.getuid = lambda: os.stat(self.path).st_uid + 1
+
+        try:
+            cache = DiskCache(self.path, 1024)
+            cache.set('abcdef', 'test data')
+            self.assertEqual(cache.get('abcdef'), None)
+        finally:
+            os.getuid = old_getuid
+
+        self.assertEqual(os.listdir(self.path), [])
+
+
+class LineTableTest(unittest.TestCase):
+    """Unit tests for LineTable."""
+    def testCodes(self):
+        """Testing LineTable codes"""
+        table = LineTable()
+        codes = table.get_codes(['  foo()', 'bar', '  foo()', '   ', 'foo()'])
+        self.assertEqual(codes[0], codes[2])
+        self.assertNotEqual(codes[0], codes[1])
+        self.assertEqual(table.get_line(codes[1]), 'bar')
+
+        # Leading whitespace is ignored, unless the line is blank.
+        self.assertEqual(table.get_ignore_space_code(codes[0]), codes[4])
+        self.assertEqual(table.get_ignore_space_code(codes[3]), codes[3])
+
+        self.assertEqual(table.get_stripped_code(codes[0]), codes[4])
+        self.assertEqual(table.get_stripped_code(codes[3]), 0)
+        self.assertEqual(table.get_no_whitespace_code(table.get_code('a b')),
+                         table.get_code('ab'))
+
+    def testSharedDiffers(self):
+        """Testing sharing a LineTable between differs"""
+        table = LineTable()
+        regex = diffutils.HEADER_REGEXES['.c'][1]
+        a = ['int main() {', '    return 0;', '}']
+        b = ['int main() {', '    return 1;', '}']
+
+        for i in xrange(2):
+            differ = diffutils.Differ(a, b, line_table=table)
+            differ.add_interesting_line_regex('header', regex)
+            self.assertEqual(list(differ.get_opcodes()),
+                             [('equal', 0, 1, 0, 1),
+                              ('replace', 1, 2, 1, 2),
+                              ('equal', 2, 3, 2, 3)])
+            self.assertEqual(differ.get_interesting_lines('header', True),
+                             [(0, 'int main() {')])
+
+
+class PackedChunksTest(unittest.TestCase):
+    def testPackChunks(self):
+        """Testing packing and unpacking chunks"""
+        chunks = [
+            {
+                'change': 'equal',
+                'collapsable': False,
+                'numlines': 2,
+                'meta': {'left_headers': [], 'right_headers': []},
+                'lines': [
+                    [1, 1, u'<span>a</span>', [], 1, u'<span>a</span>', [],
+                     False],
+                    [2, 2, u'b', [], 2, u'b', [], False],
+                ],
+            },
+            {
+                'change': 'replace',
+                'collapsable': False,
+                'numlines': 2,
+                'meta': {'whitespace_chunk': False},
+                'lines': [
+                    [3, 3, u'caf\xe9', [(0, 2)], 3, u'cafe', [(1, 2), (3, 4)],
+                     False],
+                    [4, 4, u'd', None, 4, u'e', None, True],
+                ],
+            },
+            {
+                'change': 'insert',
+                'collapsable': False,
+                'numlines': 1,
+                'meta': {},
+                'lines': [
+                    [5, '', u'', [], 5, u'b', [], False, 2],
+                ],
+            },
+        ]
+
+        packed = pickle.loads(pickle.dumps(packedchunks.pack_chunks(chunks)))
+        unpacked = packed.unpack()
+
+        self.assertEqual(unpacked, chunks)
+        self.assertEqual(len(unpacked[1]['lines']), 2)
+        self.assertEqual(unpacked[1]['lines'][-1], chunks[1]['lines'][-1])
+        self.assertEqual(unpacked[1]['lines'][1:], chunks[1]['lines'][1:])
+        self.assertTrue(isinstance(unpacked[0]['lines'][0][2], SafeData))
+
+        # Changes to the unpacked chunks don't affect later unpacking.
+        del unpacked[0]['meta']['left_headers']
+        self.assertEqual(packed.unpack(), chunks)
+
+
+class ChunkLineIndexTest(unittest.TestCase):
+    def testGetFileChunksInRange(self):
+        """Testing get_file_chunks_in_range"""
+        def make_lines(first, num):
+            return [[i, i, 'line', [], i, 'line', [], False]
+                    for i in xrange(first, first + num)]
+
+        class FakeDiffSet:
+            id = 1
+
+        class FakeFileDiff:
+            id = 2
+            diffset = FakeDiffSet()
+
+        chunks = [
+            {
+                'change': 'equal',
+                'numlines': 5,
+                'lines': make_lines(1, 5),
+                'meta': {
+                    'left_headers': [(2, 'def foo():')],
+                    'right_headers': [(2, 'def foo():')],
+                },
+            },
+            {
+                'change': 'replace',
+                'numlines': 3,
+                'lines': make_lines(6, 3),
+                'meta': {'left_headers': [], 'right_headers': []},
+            },
+            {
+                'change': 'equal',
+                'numlines': 4,
+                'lines': make_lines(9, 4),
+                'meta': {
+                    'left_headers': [(10, 'def bar():')],
+                    'right_headers': [],
+                },
+            },
+        ]
+        file = {'chunks': chunks}
+        context = {'_diff_files_1_2': [file]}
+
+        line_index = diffutils.get_chunk_line_index(file)
+        self.assertEqual(line_index['starts'], [1, 6, 9])
+        self.assertEqual(line_index['header_lines'][2], ([10], []))
+
+        result = list(diffutils.get_file_chunks_in_range(
+            context, FakeFileDiff(), None, 4, 4))
+        self.assertEqual([chunk['numlines'] for chunk in result], [2, 2])
+        self.assertEqual(result[0]['lines'][0][0], 4)
+        self.assertEqual(result[1]['lines'][-1][0], 7)
+        self.assertEqual(result[0]['meta']['headers'],
+                         ['def foo():', 'def foo():'])
+
+        # The last header of the earlier chunks is used if the chunk
+        # doesn't have one before the line.
+        result = list(diffutils.get_file_chunks_in_range(
+            context, FakeFileDiff(), None, 10, 1))
+        self.assertEqual(result[0]['meta']['headers'], ['', ''])
+
+        result = list(diffutils.get_file_chunks_in_range(
+            context, FakeFileDiff(), None, 11, 2))
+        self.assertEqual(result[0]['meta']['headers'], ['def bar():', ''])
+
+        # The file's chunks are left alone, so looking up the same lines
+        # again gives the same result.
+        self.assertTrue('left_headers' in chunks[0]['meta'])
+        self.assertEqual(
+            list(diffutils.get_file_chunks_in_range(
+                context, FakeFileDiff(), None, 11, 2)),
+            result)
+
+        self.assertEqual(list(diffutils.get_file_chunks_in_range(
+            context, FakeFileDiff(), None, 13, 1)), [])
+
+
+class ChunkStreamTest(TestCase):
+    def testStream(self):
+        """Testing ChunkStream"""
+        key = 'chunk-stream-test'
+        file = {
+            'changed_chunk_indexes': [],
+            'whitespace_only': True,
+            'num_changes': 0,
+        }
+        chunks = [
+            {'change': 'equal', 'lines': []},
+            {'change': 'replace', 'lines': [],
+             'meta': {'whitespace_chunk': True}},
+            {'change': 'insert', 'lines': []},
+        ]
+
+        self.assertEqual(diffutils.get_cached_chunks(key), None)
+
+        stream = diffutils.ChunkStream(file, key, iter(chunks))
+        file['chunks'] = stream
+
+        for i, chunk in enumerate(stream):
+            self.assertEqual(chunk['index'], i)
+            self.assertEqual(len(file['changed_chunk_indexes']),
+                             file['num_changes'])
+
+        self.assertEqual(file['chunks'], chunks)
+        self.assertEqual(file['changed_chunk_indexes'], [1, 2])
+        self.assertEqual(file['num_changes'], 2)
+        self.assertFalse(file['whitespace_only'])
+
+        stream.cache_thread.join()
+        self.assertEqual(diffutils.get_cached_chunks(key), chunks)
+
+
+class ParallelTest(unittest.TestCase):
+    def testRunInThreads(self):
+        """Testing run_in_threads"""
+        def func(i):
+            if i == 3:
+                raise ValueError(i)
+
+            return i * 2
+
+        results = parallel.run_in_threads(func, [(i,) for i in xrange(10)],
+                                          4)
+
+        self.assertEqual(len(results), 10)
+
+        for i, (result, exc_info) in enumerate(results):
+            if i == 3:
+                self.assertEqual(result, None)
+                self.assertEqual(exc_info[0], ValueError)
+            else:
+                self.assertEqual(result, i * 2)
+                self.assertEqual(exc_info, None)
+
+    def testRunInProcesses(self):
+        """Testing run_in_processes"""
+        if not parallel.can_run_in_processes():
+            return
+
+        results = parallel.run_in_processes(max, [(1, 2), (4, 3), ()], 2)
+
+        self.assertEqual(results[0], (2, None))
+        self.assertEqual(results[1], (4, None))
+        self.assertEqual(results[2][0], None)
+        self.assertEqual(results[2][1][0], TypeError)
+
+
+class BenchmarkTest(unittest.TestCase):
+    PREFIX = os.path.join(os.path.dirname(__file__), 'testdata')
+
+    def testSyntheticCases(self):
+        """Testing the synthetic diff viewer benchmark cases"""
+        cases = benchmark.get_synthetic_cases(['small_edits', 'interdiff'])
+        self.assertEqual([case.name for case in cases],
+                         ['small_edits', 'interdiff'])
+
+        # The cases must come out the same every time.
+        self.assertEqual(
+            cases[0].get_diff(),
+            benchmark.get_synthetic_cases(['small_edits'])[0].get_diff())
+
+        for case in cases:
+            for file in case.files:
+                for orig, diff, patched in file.get_patches():
+                    self.assertEqual(diffutils.patch(diff, orig,
+                                                     file.new_name),
+                                     patched)
+
+    def testRunBenchmarks(self):
+        """Testing running diff viewer benchmarks on recorded files"""
+        case = benchmark.load_recorded_case(
+            os.path.join(self.PREFIX, 'orig_src'),
+            os.path.join(self.PREFIX, 'new_src'))
+        self.assert_(case.files)
+
+        results = benchmark.run_benchmarks([case], 1,
+                                           ['parse', 'patch', 'diff'])
+
+        self.assertEqual(len(results['cases']), 1)
+        self.assertEqual(results['cases'][0]['name'], 'new_src')
+        self.assertEqual(sorted(results['cases'][0]['stages'].keys()),
+                         ['diff', 'parse', 'patch'])
+
+
+class TimingTest(unittest.TestCase):
+    def setUp(self):
+        timing.timing_store.clear()
+
+    def tearDown(self):
+        timing.set_request_timings(None)
+        timing.timing_store.clear()
+
+    def testRequestTimings(self):
+        """Testing timing stages for a request"""
+        timings = timing.start_request_timings()
+        timing.record_timing('fetch', 0.002, 100)
+        timing.record_timing('diff', 0.01)
+        timing.record_timing('fetch', 0.003, 50)
+
+        self.assertEqual(timings.get_header_value(),
+                         'fetch;dur=5.0;count=2;bytes=150, '
+                         'diff;dur=10.0;count=1')
+
+    def testRequestTimingsInThreads(self):
+        """Testing timing stages in threads working on a request"""
+        timings = timing.start_request_timings()
+        parallel.run_in_threads(timing.record_timing,
+                                [('fetch', 0.001)] * 5, 2)
+
+        self.assertEqual(timings.stages['fetch'][0], 5)
+
+    def testTimeIteration(self):
+        """Testing time_iteration"""
+        self.assertEqual(list(timing.time_iteration('chunks', [1, 2, 3])),
+                         [1, 2, 3])
+
+        stats = timing.timing_store.get_stats()
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats[0]['stage'], 'chunks')
+        self.assertEqual(stats[0]['count'], 1)
+
+    def testStats(self):
+        """Testing statistics on recent timings"""
+        store = timing.TimingStore(max_samples=100)
+
+        for i in xrange(200):
+            store.record('highlight', i / 1000.0, 10)
+
+        stats = store.get_stats()
+        self.assertEqual(len(stats), 1)
+
+        stats = stats[0]
+        self.assertEqual(stats['count'], 100)
+        self.assertEqual(stats['median'], 149)
+        self.assertEqual(stats['max'], 199)
+        self.assertEqual(stats['bytes'], 2000)
+        self.assertEqual(stats['histogram'],
+                         [(1, 0), (5, 0), (10, 0), (50, 0), (100, 0),
+                          (500, 100), (1000, 0), (5000, 0), (None, 0)])
+
+
+class HighlightingTest(unittest.TestCase):
+    def testLexerCache(self):
+        """Testing lexer lookups by filename"""
+        self.assertEqual(highlighting.get_lexer_class('foo/bar.py'),
+                         highlighting.get_lexer_class('baz.py'))
+        self.assertNotEqual(highlighting.get_lexer_class('Makefile'), None)
+        self.assertEqual(highlighting.get_lexer_class('foo.nolexer'), None)
+        self.assertRaises(ValueError, highlighting.get_lexer, 'foo.nolexer')
+
+    def testMarkupCache(self):
+        """Testing caching highlighted files by their contents"""
+        old = 'def foo():\n    return 1\n'
+        new = 'def foo():\n    return 2\n'
+        markup = {
+            'old': ['<span>old</span>'],
+            'new': ['<span>new</span>'],
+        }
+
+        self.assertEqual(diffutils.get_cached_markup(old, new, 'a.py',
+                                                     'a.py'),
+                         {})
+
+        diffutils.cache_markup(old, new, 'a.py', 'a.py',
+                               {'old': markup['old']})
+        diffutils.cache_markup(new, old, 'b.py', 'b.py',
+                               {'old': markup['new']})
+
+        # The same contents are cached for any file using the same lexer.
+        self.assertEqual(diffutils.get_cached_markup(old, new, 'b.py',
+                                                     'c.py'),
+                         markup)
+        self.assertEqual(diffutils.get_cached_markup(old, new, 'a.c',
+                                                     'a.txt'),
+                         {})
+
+    def testIncremental(self):
+        """Testing highlighting modified files incrementally"""
+        a = [
+            'def foo():',
+            '    """Does something.',
+            '',
+            '    Returns a value.',
+            '    """',
+            '    x = "abc"',
+            '',
+            '    return x',
+            '',
+            '',
+            'def bar():',
+            '    return 1',
+        ]
+        changes = [
+            # A modified line.
+            (5, 6, ['    x = "abd"']),
+            # A removed docstring opening.
+            (1, 2, []),
+            # An added docstring opening.
+            (6, 6, ['    """']),
+            # A removed line near the end.
+            (11, 12, []),
+        ]
+
+        for i1, i2, lines in changes:
+            b = a[:i1] + lines + a[i2:]
+            lexer = highlighting.get_lexer('foo.py')
+            markup_a = highlighting.highlight('\n'.join(a) + '\n', lexer)
+            opcodes = diffutils.Differ(a, b).get_opcodes()
+
+            markup_b = highlighting.highlight_incrementally(
+                markup_a, a, b, opcodes, highlighting.get_lexer('foo.py'))
+
+            self.assertEqual(
+                markup_b,
+                highlighting.highlight('\n'.join(b) + '\n',
+                                       highlighting.get_lexer('foo.py')))
+
+
 class HighlightRegionTest(TestCase):
     def setUp(self):
         siteconfig = SiteConfiguration.objects.get_current()
@@ -427,3 +1124,184 @@ class DbTests(TestCase):
 
         filediff = FileDiff.objects.get(pk=filediff.id)
         self.assertEquals(filediff.source_file, long_filename)
+
+    def testBulkCreateFileDiffs(self):
+        """Testing FileDiff.objects.bulk_create"""
+        repository = Repository.objects.get(pk=1)
+        diffset = DiffSet.objects.create(name='test',
+                                         revision=1,
+                                         repository=repository)
+        filediffs = []
+
+        for i in range(5):
+            filediffs.append(FileDiff(source_file='foo%d.c' % i,
+                                      dest_file='foo%d.c' % i,
+                                      source_revision='%d' % i,
+                                      dest_detail='New',
+                                      diff='diff %d\n' % i,
+                                      status=FileDiff.MODIFIED,
+                                      diffset=diffset))
+
+        old_max_rows = FileDiff.objects.MAX_INSERT_ROWS
+        FileDiff.objects.MAX_INSERT_ROWS = 2
+
+        try:
+            FileDiff.objects.bulk_create(filediffs)
+        finally:
+            FileDiff.objects.MAX_INSERT_ROWS = old_max_rows
+
+        files = diffset.files.order_by('source_file')
+        self.assertEqual(files.count(), 5)
+
+        for i, filediff in enumerate(files):
+            self.assertEqual(filediff.source_file, 'foo%d.c' % i)
+            self.assertEqual(filediff.source_revision, '%d' % i)
+            self.assertEqual(filediff.diff, 'diff %d\n' % i)
+            self.assertEqual(filediff.parent_diff, '')
+            self.assertFalse(filediff.binary)
+
+
+class PrefetchTest(TestCase):
+    """Unit tests for prefetching original files."""
+    fixtures = ['test_scmtools.json']
+
+    def setUp(self):
+        git_repo_path = os.path.join(os.path.dirname(__file__), '..',
+                                     'scmtools', 'testdata', 'git_repo')
+        repository = Repository.objects.create(
+            name='Git test repo',
+            path=os.path.abspath(git_repo_path),
+            tool=Tool.objects.get(name='Git'))
+        self.diffset = DiffSet.objects.create(name='test',
+                                              revision=1,
+                                              repository=repository)
+
+        self.get_files_calls = []
+        self.old_get_files = GitTool.get_files
+        calls = self.get_files_calls
+        old_get_files = self.old_get_files
+
+        def get_files(tool, paths_and_revisions, max_threads=4):
+            calls.append(paths_and_revisions)
+            return old_get_files(tool, paths_and_revisions, max_threads)
+
+        GitTool.get_files = get_files
+
+    def tearDown(self):
+        GitTool.get_files = self.old_get_files
+
+    def testPrefetchOriginalFiles(self):
+        """Testing prefetching original files"""
+        filediffs = []
+
+        for revision in ('e965047', 'd6613f5', '0000000', PRE_CREATION):
+            filediffs.append(FileDiff.objects.create(
+                source_file='readme',
+                dest_file='readme',
+                source_revision=revision,
+                diffset=self.diffset))
+
+        original_files = diffutils.prefetch_original_files(filediffs)
+
+        self.assertEqual(len(self.get_files_calls), 1)
+        self.assertEqual(len(self.get_files_calls[0]), 3)
+        self.assertEqual(len(original_files), 2)
+        self.assertEqual(
+            diffutils.get_original_file(filediffs[0], original_files),
+            'Hello\n')
+        self.assertEqual(
+            diffutils.get_original_file(filediffs[1], original_files),
+            'Hello there\n')
+        self.assertRaises(FileNotFoundError,
+                          lambda: diffutils.get_original_file(
+                              filediffs[2], original_files))
+
+        # The files that were found should now be cached.
+        self.assertEqual(diffutils.prefetch_original_files(filediffs[:2]),
+                         original_files)
+        self.assertEqual(len(self.get_files_calls), 1)
+
+
+class PrecomputeTest(TestCase):
+    """Unit tests for precomputing diffs."""
+    fixtures = ['test_scmtools.json']
+
+    def setUp(self):
+        self.siteconfig = SiteConfiguration.objects.get_current()
+        self.siteconfig.set('diffviewer_precompute_diffs', True)
+
+        repository = Repository.objects.get(pk=1)
+        self.diffset = DiffSet.objects.create(name='test',
+                                              revision=1,
+                                              repository=repository)
+        FileDiff.objects.create(source_file='foo.png',
+                                dest_file='foo.png',
+                                diffset=self.diffset,
+                                binary=True)
+
+    def tearDown(self):
+        self.siteconfig.set('diffviewer_precompute_diffs', False)
+
+    def testQueueDisabled(self):
+        """Testing queueing precompute jobs when disabled"""
+        self.siteconfig.set('diffviewer_precompute_diffs', False)
+        self.assertEqual(precompute.queue_precompute_job(self.diffset), None)
+        self.assertEqual(DiffPrecomputeJob.objects.count(), 0)
+
+    def testClaimJobs(self):
+        """Testing claiming precompute jobs"""
+        job1 = precompute.queue_precompute_job(self.diffset)
+        job2 = precompute.queue_precompute_job(self.diffset)
+
+        self.assertEqual(precompute.claim_next_job().id, job1.id)
+        self.assertEqual(precompute.claim_next_job().id, job2.id)
+        self.assertEqual(precompute.claim_next_job(), None)
+
+        self.assertEqual(precompute.reset_running_jobs(), 2)
+        self.assertEqual(precompute.claim_next_job().id, job1.id)
+
+    def testRunJob(self):
+        """Testing running precompute jobs"""
+        precompute.queue_precompute_job(self.diffset)
+        job = precompute.claim_next_job()
+        precompute.run_job(job)
+
+        job = DiffPrecomputeJob.objects.get(pk=job.id)
+        self.assertEqual(job.status, DiffPrecomputeJob.DONE)
+        self.assertNotEqual(job.completed, None)
+        self.assertEqual(job.error, '')
+
+    def testRunJobBatched(self):
+        """Testing running precompute jobs for all files at once"""
+        filediff = FileDiff.objects.create(source_file='bar.png',
+                                           dest_file='bar.png',
+                                           diffset=self.diffset,
+                                           binary=True)
+        calls = []
+
+        def get_diff_files(diffset, filediff, interdiffset, highlighting):
+            calls.append(filediff)
+
+            if filediff is None or filediff.source_file == 'bar.png':
+                raise Exception('Broken file')
+
+        old_get_diff_files = precompute.get_diff_files
+        precompute.get_diff_files = get_diff_files
+
+        try:
+            precompute.queue_precompute_job(self.diffset)
+            job = precompute.claim_next_job()
+            precompute.run_job(job)
+        finally:
+            precompute.get_diff_files = old_get_diff_files
+
+        # The files are processed together first, and then one at a time
+        # once that fails.
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(calls[0], None)
+        self.assertEqual(set([f.source_file for f in calls[1:]]),
+                         set(['foo.png', 'bar.png']))
+
+        job = DiffPrecomputeJob.objects.get(pk=job.id)
+        self.assertEqual(job.status, DiffPrecomputeJob.FAILED)
+        self.assertEqual(job.error, 'bar.png: Broken file')
@@ -0,0 +1,276 @@
+"""Timing of the stages the diff viewer goes through to show a diff.
+
+Each stage (fetching files, patching, highlighting, diffing and so on) is
+timed with time_stage:
+
+    timer = time_stage('highlight')
+    ...
+    timer.done()
+
+Every timing is recorded in timing_store, which keeps the most recent
+samples for each stage so that their distribution can be shown in the
+administration UI. Timings made while handling a request are also added
+up for that request (see DiffTimingMiddleware), so a slow page can be
+broken down by stage.
+
+Timings made in other processes, such as when generating diffs with a
+process pool, aren't recorded.
+"""
+
+import threading
+import time
+
+from django.utils.translation import ugettext_lazy as _
+
+
+# The stages that are timed, and their descriptions, in the order they
+# happen in.
+STAGES = (
+    ('fetch', _('Fetching files from repositories')),
+    ('parent_patch', _('Applying parent diffs')),
+    ('patch', _('Applying diffs')),
+    ('utf8', _('Converting to UTF-8')),
+    ('highlight', _('Syntax highlighting')),
+    ('diff', _('Diffing')),
+    ('moves', _('Detecting moved lines')),
+    ('chunks', _('Generating chunks (in total)')),
+    ('cache_get', _('Reading from the cache')),
+    ('cache_set', _('Writing to the cache')),
+    ('render', _('Rendering templates')),
+)
+
+STAGE_NAMES = [name for name, description in STAGES]
+
+# The number of recent timings kept for each stage.
+MAX_SAMPLES = 1000
+
+# The upper bounds, in milliseconds, of the buckets of the histograms shown
+# for each stage. The last bucket holds everything slower.
+HISTOGRAM_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class StageTimer(object):
+    """Times a single run of a stage. See time_stage."""
+    def __init__(self, stage):
+        assert stage in STAGE_NAMES, "Unknown stage '%s'" % stage
+        self.stage = stage
+        self.start_time = time.time()
+
+    def done(self, num_bytes=None):
+        """Records the time since the timer was started.
+
+        num_bytes is the amount of data the stage handled, if known.
+        """
+        record_timing(self.stage, time.time() - self.start_time, num_bytes)
+
+
+class RequestTimings(object):
+    """The total time spent in each stage while handling a request."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+
+    def add(self, stage, duration, num_bytes=None):
+        self.lock.acquire()
+
+        try:
+            totals = self.stages.setdefault(stage, [0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += duration
+
+            if num_bytes:
+                totals[2] += num_bytes
+        finally:
+            self.lock.release()
+
+    def get_header_value(self):
+        """Returns the timings formatted for the X-Diff-Timing header.
+
+        Each stage is listed as "<stage>;dur=<ms>;count=<n>", followed by
+        ";bytes=<n>" if the stage handled a known amount of data.
+        """
+        entries = []
+
+        for stage in STAGE_NAMES:
+            if stage in self.stages:
+                count, duration, num_bytes = self.stages[stage]
+                entry = '%s;dur=%.1f;count=%d' % (stage, duration * 1000,
+                                                  count)
+
+                if num_bytes:
+                    entry += ';bytes=%d' % num_bytes
+
+                entries.append(entry)
+
+        return ', '.join(entries)
+
+
+class TimingStore(object):
+    """Keeps the most recent timings for each stage, across requests."""
+    def __init__(self, max_samples=MAX_SAMPLES):
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.samples = {}
+        self.num_bytes = {}
+
+    def record(self, stage, duration, num_bytes=None):
+        self.lock.acquire()
+
+        try:
+            samples = self.samples.setdefault(stage, [])
+            samples.append(duration)
+
+            if len(samples) > self.max_samples:
+                del samples[0]
+
+            if num_bytes:
+                self.num_bytes[stage] = (self.num_bytes.get(stage, 0) +
+                                         num_bytes)
+        finally:
+            self.lock.release()
+
+    def get_stats(self):
+        """Returns statistics on the recent timings of each stage.
+
+        This returns a list of dictionaries, one for each stage that has
+        been timed, in the order of STAGES. Durations are in milliseconds.
+        The 'histogram' is a list of (upper bound, count) tuples for the
+        buckets in HISTOGRAM_BUCKETS, with None as the bound of the last
+        one. 'bytes' is the total amount of data handled by the stage since
+        the process started, if known.
+        """
+        self.lock.acquire()
+
+        try:
+            samples = dict([(stage, list(durations))
+                            for stage, durations in self.samples.iteritems()])
+            num_bytes = dict(self.num_bytes)
+        finally:
+            self.lock.release()
+
+        all_stats = []
+
+        for stage, description in STAGES:
+            if stage not in samples:
+                continue
+
+            durations = [duration * 1000 for duration in samples[stage]]
+            durations.sort()
+            count = len(durations)
+
+            histogram = []
+            i = 0
+
+            for bound in HISTOGRAM_BUCKETS:
+                bucket_count = 0
+
+                while i < count and durations[i] < bound:
+                    bucket_count += 1
+                    i += 1
+
+                histogram.append((bound, bucket_count))
+
+            histogram.append((None, count - i))
+
+            all_stats.append({
+                'stage': stage,
+                'description': description,
+                'count': count,
+                'mean': sum(durations) / count,
+                'median': _get_percentile(durations, 50),
+                'p90': _get_percentile(durations, 90),
+                'p99': _get_percentile(durations, 99),
+                'max': durations[-1],
+                'bytes': num_bytes.get(stage),
+                'histogram': histogram,
+            })
+
+        return all_stats
+
+
+def _get_percentile(sorted_values, percentile):
+    i = (len(sorted_values) - 1) * percentile // 100
+
+    return sorted_values[i]
+
+
+timing_store = TimingStore()
+
+_local = threading.local()
+
+
+def time_stage(stage):
+    """Returns a StageTimer for a stage, started now.
+
+    Call done() on it once the stage has finished.
+    """
+    return StageTimer(stage)
+
+
+def time_iteration(stage, iterable):
+    """Times how long it takes to get the items of an iterable.
+
+    This returns a generator that yields each item in the iterable. Only
+    the time spent getting the items counts, not the time spent in between
+    by whatever is iterating over them. Nothing is recorded if iteration
+    stops early.
+    """
+    duration = 0
+    iterator = iter(iterable)
+
+    while True:
+        start_time = time.time()
+
+        try:
+            item = iterator.next()
+        except StopIteration:
+            break
+
+        duration += time.time() - start_time
+
+        yield item
+
+    duration += time.time() - start_time
+    record_timing(stage, duration)
+
+
+def record_timing(stage, duration, num_bytes=None):
+    """Records that a stage took duration seconds.
+
+    The timing is recorded in timing_store, and added to the timings for
+    the current request, if there is one.
+    """
+    timing_store.record(stage, duration, num_bytes)
+
+    timings = get_request_timings()
+
+    if timings is not None:
+        timings.add(stage, duration, num_bytes)
+
+
+def start_request_timings():
+    """Starts collecting timings for the request being handled.
+
+    Returns the new RequestTimings.
+    """
+    timings = RequestTimings()
+    set_request_timings(timings)
+
+    return timings
+
+
+def get_request_timings():
+    """Returns the RequestTimings for this thread, or None."""
+    return getattr(_local, 'timings', None)
+
+
+def set_request_timings(timings):
+    """Sets the RequestTimings that timings in this thread are added to.
+
+    This lets threads doing work for a request add their timings to it.
+    Pass None to stop adding them.
+    """
+    _local.timings = timings
@@ -3,10 +3,11 @@ import traceback
 
 from django.conf import settings
 from django.core.paginator import Paginator
+from django.db import connection
 from django.http import HttpResponse, HttpResponseServerError
 from django.shortcuts import get_object_or_404, render_to_response
 from django.template import RequestContext
-from django.template.loader import render_to_string
+from django.template.loader import get_template, render_to_string
 from django.utils.translation import ugettext as _
 
 from djblets.siteconfig.models import SiteConfiguration
@@ -16,6 +17,7 @@ from reviewboard.diffviewer.models import DiffSet, FileDiff
 from reviewboard.diffviewer.diffutils import UserVisibleError, \
                                              get_diff_files, \
                                              get_enable_highlighting
+from reviewboard.diffviewer.timing import time_stage
 
 
 def build_diff_fragment(request, file, chunkindex, highlighting, collapseall,
@@ -53,9 +55,75 @@ def build_diff_fragment(request, file, chunkindex, highlighting, collapseall,
 
     context['file'] = file
 
-    return cache_memoize(key,
-        lambda: render_to_string(template_name,
-                                 RequestContext(request, context)))
+    def render():
+        timer = time_stage('render')
+        content = render_to_string(template_name,
+                                   RequestContext(request, context))
+        timer.done(len(content))
+
+        return content
+
+    return cache_memoize(key, render)
+
+
+def stream_diff_fragment(request, file, collapseall, context,
+                         error_template_name):
+    """Renders a diff fragment for a file as its chunks are generated.
+
+    This returns an iterator that yields the fragment in pieces: the file
+    header, then each chunk as soon as it's been generated, and then a
+    footer. The file's 'chunks' must be a ChunkStream (see get_diff_files).
+
+    Since we don't know until the end whether the file has any changes or
+    contains only whitespace changes, the footer fixes up the page with
+    JavaScript once the last chunk has been sent.
+    """
+    context['file'] = file
+    context['collapseall'] = collapseall
+
+    # The context processors may need the database, so they're run now,
+    # before the request's connection is closed.
+    request_context = RequestContext(request, context)
+
+    return _stream_diff_fragment(request, file, request_context,
+                                 error_template_name)
+
+
+def _stream_diff_fragment(request, file, request_context,
+                          error_template_name):
+    yield render_to_string('diffviewer/diff_file_header.html',
+                           request_context)
+
+    try:
+        chunk_template = get_template('diffviewer/diff_chunk_fragment.html')
+
+        for chunk in file['chunks']:
+            request_context.push()
+            request_context['chunk'] = chunk
+
+            try:
+                timer = time_stage('render')
+                content = chunk_template.render(request_context)
+                timer.done(len(content))
+            finally:
+                request_context.pop()
+
+            yield content
+
+        yield render_to_string('diffviewer/diff_file_stream_footer.html',
+                               request_context)
+    except Exception, e:
+        # The response has already started, so the best we can do is close
+        # off what we've sent and show the error after it.
+        logging.error("Error streaming diff fragment for filediff %s: %s",
+                      file['filediff'].id, e, exc_info=1)
+        yield '</table>'
+        yield exception_traceback_string(request, e, error_template_name,
+                                         {'file': file})
+
+    # This runs after the request has finished, so don't leave open any
+    # database connection that was needed to render the fragment.
+    connection.close()
 
 
 def get_collapse_diff(request):
@@ -185,9 +253,9 @@ def view_diff_fragment(
         template_name='diffviewer/diff_file_fragment.html',
         error_template_name='diffviewer/diff_fragment_error.html'):
 
-    def get_requested_diff_file(get_chunks=True):
+    def get_requested_diff_file(get_chunks=True, stream_chunks=False):
         files = get_diff_files(diffset, filediff, interdiffset, highlighting,
-                               get_chunks)
+                               get_chunks, stream_chunks)
 
         if files:
             assert len(files) == 1
@@ -210,14 +278,29 @@ def view_diff_fragment(
     else:
         collapseall = get_collapse_diff(request)
 
+    # Whole files that haven't been diffed yet are streamed to the browser
+    # as they're processed, rather than making the user wait for the whole
+    # file before seeing anything.
+    siteconfig = SiteConfiguration.objects.get_current()
+    stream_chunks = (chunkindex is None and
+                     siteconfig.get('diffviewer_stream_fragments'))
+
     try:
-        file = get_requested_diff_file()
+        file = get_requested_diff_file(stream_chunks=stream_chunks)
 
         if file:
             context = {
                 'standalone': chunkindex is not None,
             }
 
+            if file.get('streaming', False):
+                response = HttpResponse(
+                    stream_diff_fragment(request, file, collapseall, context,
+                                         error_template_name))
+                response.streaming = True
+
+                return response
+
             return HttpResponse(build_diff_fragment(request, file,
                                                     chunkindex,
                                                     highlighting, collapseall,
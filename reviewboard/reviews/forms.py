@@ -7,6 +7,7 @@ from django.utils.translation import ugettext as _
 
 from reviewboard.diffviewer import forms as diffviewer_forms
 from reviewboard.diffviewer.models import DiffSet
+from reviewboard.diffviewer.precompute import queue_precompute_job
 from reviewboard.reviews.errors import OwnershipError
 from reviewboard.reviews.models import DefaultReviewer, ReviewRequest, \
                                        ReviewRequestDraft, Screenshot
@@ -233,22 +234,30 @@ class UploadDiffForm(diffviewer_forms.UploadDiffForm):
                                                      parent_diff_file,
                                                      history)
 
+        public_diffsets = self.review_request.diffset_history.diffsets
+
+        try:
+            latest_diffset = public_diffsets.exclude(pk=diffset.pk).latest()
+        except DiffSet.DoesNotExist:
+            latest_diffset = None
+
         if not attach_to_history:
             # Set the initial revision to be one newer than the most recent
             # public revision, so we can reference it in the diff viewer.
             #
             # TODO: It would be nice to later consolidate this with the logic
             #       in DiffSet.save.
-            public_diffsets = self.review_request.diffset_history.diffsets
-
-            try:
-                latest_diffset = public_diffsets.latest()
+            if latest_diffset:
                 diffset.revision = latest_diffset.revision + 1
-            except DiffSet.DoesNotExist:
+            else:
                 diffset.revision = 1
 
             diffset.save()
 
+        # Generate the diff, and the interdiff against the last public
+        # revision, in the background before anyone asks for them.
+        queue_precompute_job(diffset, latest_diffset)
+
         return diffset
 
 
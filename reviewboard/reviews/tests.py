@@ -2,16 +2,21 @@ import logging
 import os
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.template import Context, Template
 from django.test import TestCase
 
 from djblets.siteconfig.models import SiteConfiguration
 
-from reviewboard.reviews.models import DefaultReviewer, \
+from reviewboard.diffviewer.diffutils import get_enable_highlighting
+from reviewboard.reviews.models import Comment, \
+                                       DefaultReviewer, \
                                        ReviewRequest, \
                                        ReviewRequestDraft, \
                                        Review
+from reviewboard.reviews.views import build_diff_comment_fragments, \
+                                      get_comment_fragment_cache_key
 from reviewboard.scmtools.models import Repository, Tool
 
 
@@ -508,6 +513,29 @@ class ViewTests(TestCase):
         self.assert_('fragment' in files[0])
         self.assert_('interfilediff' in files[0])
 
+    def testCachedDiffCommentFragments(self):
+        """Testing build_diff_comment_fragments with cached fragments"""
+        user = User.objects.get(username='doc')
+        comments = list(Comment.objects.order_by('pk'))
+        template_name = 'reviews/diff_comment_fragment.html'
+        highlighting = get_enable_highlighting(user)
+
+        for comment in comments:
+            cache.set(get_comment_fragment_cache_key(comment, template_name,
+                                                     highlighting),
+                      'fragment %s' % comment.pk)
+
+        # Pass the comments in reverse, to make sure they come back in
+        # the order given.
+        comments.reverse()
+        had_error, entries = build_diff_comment_fragments(comments,
+                                                          {'user': user})
+
+        self.assertFalse(had_error)
+        self.assertEqual([entry['comment'] for entry in entries], comments)
+        self.assertEqual([entry['html'] for entry in entries],
+                         ['fragment %s' % comment.pk for comment in comments])
+
     def testDashboard5(self):
         """Testing dashboard view (mine)"""
         self.client.login(username='doc', password='doc')
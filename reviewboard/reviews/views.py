@@ -5,14 +5,15 @@ from datetime import datetime
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.db.models import Q
 from django.http import HttpResponse, HttpResponseRedirect, Http404, \
                         HttpResponseNotModified, HttpResponseServerError
 from django.shortcuts import get_object_or_404, get_list_or_404, \
                              render_to_response
-from django.template.context import RequestContext
-from django.template.loader import render_to_string
+from django.template.context import Context, RequestContext
+from django.template.loader import get_template, render_to_string
 from django.utils import simplejson
 from django.utils.http import http_date
 from django.utils.safestring import mark_safe
@@ -29,8 +30,11 @@ from djblets.siteconfig.models import SiteConfiguration
 from reviewboard.accounts.decorators import check_login_required, \
                                             valid_prefs_required
 from reviewboard.accounts.models import ReviewRequestVisit
-from reviewboard.diffviewer.diffutils import get_file_chunks_in_range
+from reviewboard.diffviewer.diffutils import get_enable_highlighting, \
+                                             get_file_chunks_in_range, \
+                                             preload_file_chunks
 from reviewboard.diffviewer.models import DiffSet
+from reviewboard.diffviewer.timing import time_stage
 from reviewboard.diffviewer.views import view_diff, view_diff_fragment, \
                                          exception_traceback_string
 from reviewboard.reviews.datagrids import DashboardDataGrid, \
@@ -474,43 +478,95 @@ def raw_diff(request, review_request_id, revision=None):
     return resp
 
 
+def get_comment_fragment_cache_key(comment, template_name, highlighting):
+    """Returns the cache key for the rendered diff fragment of a comment."""
+    site = Site.objects.get_current()
+
+    return "%s:%s:diff-comment-fragment:%s:%s:%s:%s:%s:%s" % (
+        site.domain, settings.SITE_ROOT, template_name, comment.pk,
+        comment.first_line, comment.num_lines, int(bool(highlighting)),
+        settings.AJAX_SERIAL)
+
+
 def build_diff_comment_fragments(
         comments, context,
         comment_template_name='reviews/diff_comment_fragment.html',
         error_template_name='diffviewer/diff_fragment_error.html'):
+    """Renders the diff fragments shown for a list of comments.
 
-    comment_entries = []
+    The rendered fragments are cached, and all the cached ones are fetched
+    in one lookup. The rest are rendered grouped by file and in order of
+    their lines, so each file's chunks are loaded once.
+
+    Returns whether any fragment failed to render, along with a list of
+    dictionaries containing each comment and its rendered HTML.
+    """
+    comments = list(comments)
     had_error = False
 
-    for comment in comments:
-        try:
-            content = render_to_string(comment_template_name, {
-                'comment': comment,
-                'chunks': list(get_file_chunks_in_range(context,
-                                                        comment.filediff,
-                                                        comment.interfilediff,
-                                                        comment.first_line,
-                                                        comment.num_lines))
-            })
-        except Exception, e:
-            content = exception_traceback_string(None, e,
-                                                 error_template_name, {
-                'comment': comment,
-                'file': {
-                    'depot_filename': comment.filediff.source_file,
-                    'index': None,
-                    'filediff': comment.filediff,
-                },
-            })
+    assert 'user' in context
+    highlighting = get_enable_highlighting(context['user'])
+
+    keys = [get_comment_fragment_cache_key(comment, comment_template_name,
+                                           highlighting)
+            for comment in comments]
+    contents = cache.get_many(keys)
+    missing = [i for i, key in enumerate(keys) if key not in contents]
+
+    if missing:
+        # Generate the diffs for all the comments at once, rather than one
+        # at a time as each is rendered.
+        preload_file_chunks(context,
+                            [(comments[i].filediff, comments[i].interfilediff)
+                             for i in missing])
+
+        template = get_template(comment_template_name)
+        missing.sort(key=lambda i: (comments[i].filediff_id,
+                                    comments[i].interfilediff_id,
+                                    comments[i].first_line))
 
-            # It's bad that we failed, and we'll return a 500, but we'll
-            # still return content for anything we have. This will prevent any
-            # caching.
-            had_error = True
+        for i in missing:
+            comment = comments[i]
+
+            try:
+                chunks = list(get_file_chunks_in_range(context,
+                                                       comment.filediff,
+                                                       comment.interfilediff,
+                                                       comment.first_line,
+                                                       comment.num_lines))
+
+                timer = time_stage('render')
+                content = template.render(Context({
+                    'comment': comment,
+                    'chunks': chunks,
+                }))
+                timer.done(len(content))
+
+                cache.set(keys[i], content)
+            except Exception, e:
+                content = exception_traceback_string(None, e,
+                                                     error_template_name, {
+                    'comment': comment,
+                    'file': {
+                        'depot_filename': comment.filediff.source_file,
+                        'index': None,
+                        'filediff': comment.filediff,
+                    },
+                })
+
+                # It's bad that we failed, and we'll return a 500, but we'll
+                # still return content for anything we have. This will
+                # prevent any caching.
+                had_error = True
+
+            contents[keys[i]] = content
+
+    comment_entries = []
 
+    for comment, key in zip(comments, keys):
         comment_entries.append({
             'comment': comment,
-            'html': content,
+            'html': contents[key],
         })
 
     return had_error, comment_entries
@@ -1,10 +1,11 @@
 import calendar
 from datetime import datetime, timedelta
+import sys
 import time
 import urlparse
 
 try:
-    from bzrlib import bzrdir, revisionspec
+    from bzrlib import bzrdir, revisionspec, urlutils
     from bzrlib.errors import NotBranchError
 except ImportError:
     pass
@@ -63,6 +64,80 @@ class BZRTool(SCMTool):
 
         return contents
 
+    def get_files(self, paths_and_revisions, max_threads=4):
+        """Fetches several files, opening each branch only once.
+
+        Each branch containing the files is opened and locked once, and the
+        tree for each revision is built once, rather than for every file.
+        Returns a list of (contents, exc_info) tuples in the same order as
+        paths_and_revisions, as with run_in_threads.
+        """
+        results = []
+        branches = []
+        revtrees = {}
+
+        try:
+            for path, revision in paths_and_revisions:
+                if revision in (PRE_CREATION,
+                                BZRTool.PRE_CREATION_TIMESTAMP):
+                    results.append(('', None))
+                    continue
+
+                try:
+                    results.append((self._get_file_text(path, revision,
+                                                        branches, revtrees),
+                                    None))
+                except SCMError:
+                    results.append((None, sys.exc_info()))
+        finally:
+            for base, tree, branch in branches:
+                branch.unlock()
+
+        return results
+
+    def _get_file_text(self, path, revision, branches, revtrees):
+        """Returns the contents of a file, for get_files.
+
+        branches is a list of (base URL, tree, branch) tuples for the
+        branches opened so far, and revtrees is a dictionary of the trees
+        built so far, keyed by the branch's base URL and revspec.
+        """
+        filepath = self._get_full_path(path)
+
+        try:
+            if '://' in filepath:
+                fileurl = urlutils.normalize_url(filepath)
+            else:
+                fileurl = urlutils.local_path_to_url(filepath)
+
+            for base, tree, branch in branches:
+                if fileurl.startswith(base):
+                    relpath = urlutils.unescape(fileurl[len(base):])
+                    break
+            else:
+                tree, branch, relpath = \
+                    bzrdir.BzrDir.open_containing_tree_or_branch(filepath)
+                branch.lock_read()
+
+                # Paths are relative to the tree, if there is one.
+                if tree:
+                    base = tree.bzrdir.root_transport.base
+                else:
+                    base = branch.base
+
+                branches.append((base, tree, branch))
+
+            revspec = self._revspec_from_revision(revision)
+            key = (base, revspec)
+
+            if key not in revtrees:
+                revtrees[key] = revisionspec.RevisionSpec.from_string(
+                    revspec).as_tree(branch)
+
+            return revtrees[key].get_file_text(tree.path2id(relpath))
+        except Exception, e:
+            raise SCMError(e)
+
     def parse_diff_revision(self, file_str, revision_str):
         if revision_str == BZRTool.PRE_CREATION_TIMESTAMP:
             return (file_str, PRE_CREATION)
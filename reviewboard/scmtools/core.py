@@ -1,7 +1,14 @@
 import logging
+import sys
+import threading
 import urlparse
 
+from django.core.cache import cache
+from django.utils.encoding import smart_str
+from django.utils.hashcompat import sha_constructor
+
 import reviewboard.diffviewer.parser as diffparser
+from reviewboard.diffviewer.parallel import run_in_threads
 from reviewboard.scmtools import sshutils
 from reviewboard.scmtools.errors import FileNotFoundError
 
@@ -40,6 +47,9 @@ HEAD = Revision("HEAD")
 UNKNOWN = Revision('UNKNOWN')
 PRE_CREATION = Revision("PRE-CREATION")
 
+# How long, in seconds, the results of file_exists_many are cached for.
+FILE_EXISTS_CACHE_EXPIRATION = 5 * 60
+
 
 class SCMTool(object):
     name = None
@@ -70,6 +80,106 @@ class SCMTool(object):
         except FileNotFoundError:
             return False
 
+    def file_exists_many(self, paths_and_revisions, max_threads=4):
+        """Checks whether several files exist in the repository.
+
+        paths_and_revisions is a list of (path, revision) tuples. This
+        returns a list of booleans in the same order. Errors other than
+        the file not being found are raised.
+
+        The results are cached for a few minutes, so checking the same
+        files again soon after (such as when a diff is uploaded again) is
+        cheap. The files that aren't cached are checked by
+        _file_exists_many.
+        """
+        keys = [self._get_file_exists_cache_key(path, revision)
+                for path, revision in paths_and_revisions]
+        cached = cache.get_many(keys)
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+
+        if missing:
+            results = self._file_exists_many(
+                [paths_and_revisions[i] for i in missing],
+                max_threads)
+
+            for i, exists in zip(missing, results):
+                cached[keys[i]] = exists
+                cache.set(keys[i], exists, FILE_EXISTS_CACHE_EXPIRATION)
+
+        return [cached[key] for key in keys]
+
+    def _file_exists_many(self, paths_and_revisions, max_threads):
+        """Checks whether several files exist, without using the cache.
+
+        By default, this calls file_exists for each file using up to
+        max_threads threads (see _run_in_threads). Tools that can check
+        many files at once should override this.
+        """
+        if len(paths_and_revisions) == 1 or max_threads < 2:
+            return [self.file_exists(path, revision)
+                    for path, revision in paths_and_revisions]
+
+        results = []
+
+        for exists, exc_info in self._run_in_threads('file_exists',
+                                                     paths_and_revisions,
+                                                     max_threads):
+            if exc_info:
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+            results.append(exists)
+
+        return results
+
+    def get_files(self, paths_and_revisions, max_threads=4):
+        """Fetches several files from the repository.
+
+        paths_and_revisions is a list of (path, revision) tuples. This
+        returns a list of (contents, exc_info) tuples in the same order, as
+        with run_in_threads. If fetching a file failed, contents is None and
+        exc_info is the value of sys.exc_info() for the error. Otherwise,
+        exc_info is None.
+
+        By default, this calls get_file for each file using up to
+        max_threads threads (see _run_in_threads). Tools that can fetch
+        many files at once should override this.
+        """
+        if len(paths_and_revisions) == 1 or max_threads < 2:
+            results = []
+
+            for path, revision in paths_and_revisions:
+                try:
+                    results.append((self.get_file(path, revision), None))
+                except Exception:
+                    results.append((None, sys.exc_info()))
+
+            return results
+
+        return self._run_in_threads('get_file', paths_and_revisions,
+                                    max_threads)
+
+    def _run_in_threads(self, method_name, args_list, max_threads):
+        """Calls a method of the tool for each tuple of arguments in threads.
+
+        Each thread uses its own instance of the tool, since most SCM
+        clients can't be shared between threads. The results are returned
+        as with run_in_threads.
+        """
+        local = threading.local()
+
+        def call(*args):
+            if not hasattr(local, 'tool'):
+                local.tool = self.__class__(self.repository)
+
+            return getattr(local.tool, method_name)(*args)
+
+        return run_in_threads(call, args_list, max_threads)
+
+    def _get_file_exists_cache_key(self, path, revision):
+        key = '%s:%s:%s' % (self.repository.path, path, revision)
+
+        return 'file-exists:%s' % sha_constructor(smart_str(key)).hexdigest()
+
     def parse_diff_revision(self, file_str, revision_str):
         raise NotImplementedError
 
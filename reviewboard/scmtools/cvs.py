@@ -1,7 +1,10 @@
 import os
 import re
+import shutil
 import subprocess
+import sys
 import tempfile
+import threading
 import urlparse
 
 from djblets.util.filesystem import is_exe_in_path
@@ -43,6 +46,25 @@ class CVSTool(SCMTool):
 
         return self.client.cat_file(path, revision)
 
+    def get_files(self, paths_and_revisions, max_threads=4):
+        """Fetches several files, running cvs as few times as possible.
+
+        Returns a list of (contents, exc_info) tuples in the same order as
+        paths_and_revisions.
+        """
+        return self.client.cat_files(paths_and_revisions)
+
+    def _file_exists_many(self, paths_and_revisions, max_threads):
+        results = []
+
+        for contents, exc_info in self.get_files(paths_and_revisions):
+            if exc_info and not issubclass(exc_info[0], FileNotFoundError):
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+            results.append(exc_info is None)
+
+        return results
+
     def parse_diff_revision(self, file_str, revision_str):
         if revision_str == "PRE-CREATION":
             return file_str, PRE_CREATION
@@ -181,9 +203,12 @@ class CVSDiffParser(DiffParser):
 
 
 class CVSClient:
+    # The directory that cvs is run in. Each command gets its own
+    # subdirectory of this, which is removed once the command is done.
+    scratch_dir = None
+    scratch_dir_lock = threading.Lock()
+
     def __init__(self, repository, path):
-        self.tempdir = ""
-        self.currentdir = os.getcwd()
         self.repository = repository
         self.path = path
 
@@ -192,15 +217,72 @@ class CVSClient:
             # pattern we use with all the other tools.
             raise ImportError
 
-    def cleanup(self):
-        if self.currentdir != os.getcwd():
-            # Restore current working directory
-            os.chdir(self.currentdir)
-            # Remove temporary directory
-            if self.tempdir != "":
-                os.rmdir(self.tempdir)
-
     def cat_file(self, filename, revision):
+        contents, exc_info = self.cat_files([(filename, revision)])[0]
+
+        if exc_info:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        return contents
+
+    def cat_files(self, filenames_and_revisions):
+        """Fetches several files, running cvs as few times as possible.
+
+        The files at each revision are fetched with a single cvs command.
+        Files that aren't found are then looked for once more in the Attic.
+
+        This returns a list of (contents, exc_info) tuples, in the same
+        order as filenames_and_revisions.
+        """
+        results = [None] * len(filenames_and_revisions)
+        by_revision = {}
+
+        for i, (filename, revision) in enumerate(filenames_and_revisions):
+            if revision == PRE_CREATION:
+                results[i] = self._not_found(filename, revision)
+            else:
+                filename, filenameAttic = self._normalize_filename(filename)
+                by_revision.setdefault(str(revision), []).append(
+                    (i, filename, filenameAttic))
+
+        for revision, files in by_revision.iteritems():
+            try:
+                found = self._export_files(
+                    [filename for i, filename, filenameAttic in files],
+                    revision)
+
+                attic_filenames = [
+                    filenameAttic
+                    for i, filename, filenameAttic in files
+                    if filename not in found and filenameAttic
+                ]
+
+                if attic_filenames:
+                    found.update(self._export_files(attic_filenames,
+                                                    revision))
+            except SCMError:
+                exc_info = sys.exc_info()
+
+                for i, filename, filenameAttic in files:
+                    results[i] = (None, exc_info)
+
+                continue
+
+            for i, filename, filenameAttic in files:
+                if filename in found:
+                    results[i] = (found[filename], None)
+                elif filenameAttic in found:
+                    results[i] = (found[filenameAttic], None)
+                else:
+                    results[i] = self._not_found(filename, revision)
+
+        return results
+
+    def _normalize_filename(self, filename):
+        """Returns the path to give cvs for a file, and its Attic path.
+
+        The Attic path is None if there's no sensible one.
+        """
         # We strip the repo off of the fully qualified path as CVS does
         # not like to be given absolute paths.
         repos_path = self.path.split(":")[-1]
@@ -237,60 +319,83 @@ class CVSClient:
             # Attic path that makes any kind of sense.
             filenameAttic = None
 
+        return filename, filenameAttic
+
+    def _export_files(self, filenames, revision):
+        """Exports several files at a revision with a single cvs command.
+
+        This returns a dictionary mapping the filenames that were found to
+        their contents. An SCMError is raised if cvs failed for any reason
+        other than files not being found.
+        """
+        # cvs writes the files to the directory it's run in, and sometimes
+        # writes .cvsignore files there as well, so give each command its
+        # own directory. It's passed to cvs rather than changed to, since
+        # the current directory is shared by every thread in the process.
+        workdir = tempfile.mkdtemp(dir=self._get_scratch_dir())
+
         try:
-            return self._cat_specific_file(filename, revision)
-        except FileNotFoundError:
-            if filenameAttic:
-                return self._cat_specific_file(filenameAttic, revision)
-            else:
-                raise
-
-    def _cat_specific_file(self, filename, revision):
-        # Somehow CVS sometimes seems to write .cvsignore files to current
-        # working directory even though we force stdout with -p.
-        self.tempdir = tempfile.mkdtemp()
-        os.chdir(self.tempdir)
-
-        p = subprocess.Popen(['cvs', '-f', '-d', self.repository, 'checkout',
-                              '-r', str(revision), '-p', filename],
-                             stderr=subprocess.PIPE, stdout=subprocess.PIPE,
-                             close_fds=(os.name != 'nt'))
-        contents = p.stdout.read()
-        errmsg = p.stderr.read()
-        failure = p.wait()
+            p = subprocess.Popen(['cvs', '-f', '-d', self.repository,
+                                  'export', '-r', revision] + filenames,
+                                 stderr=subprocess.PIPE,
+                                 stdout=subprocess.PIPE,
+                                 cwd=workdir,
+                                 close_fds=(os.name != 'nt'))
+            errmsg = p.communicate()[1]
+            failure = p.wait()
+
+            found = {}
+
+            for filename in filenames:
+                filepath = os.path.normpath(os.path.join(workdir, filename))
+
+                # Don't read anything outside of the directory, should we be
+                # given an absolute path or one containing "..".
+                if (filepath.startswith(workdir + os.sep) and
+                    os.path.isfile(filepath)):
+                    f = open(filepath, 'rb')
+
+                    try:
+                        found[filename] = f.read()
+                    finally:
+                        f.close()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
 
         # Unfortunately, CVS is not consistent about exiting non-zero on
-        # errors.  If the file is not found at all, then CVS will print an
+        # errors. If a file is not found at all, then CVS will print an
         # error message on stderr, but it doesn't set an exit code with
-        # pservers.  If the file is found but an invalid revision is requested,
-        # then cvs exits zero and nothing is printed at all. (!)
+        # pservers. If the file is found but an invalid revision is
+        # requested, then cvs exits zero and nothing is printed at all. (!)
         #
-        # But, when it is successful, cvs will print a header on stderr like
-        # so:
-        #
-        # ===================================================================
-        # Checking out foobar
-        # RCS: /path/to/repo/foobar,v
-        # VERS: 1.1
-        # ***************
-
-        # So, if nothing is in errmsg, or errmsg has a specific recognized
-        # message, call it FileNotFound.
-        if not errmsg or \
-           errmsg.startswith('cvs checkout: cannot find module') or \
-           errmsg.startswith('cvs checkout: could not read RCS file'):
-            self.cleanup()
-            raise FileNotFoundError(filename, revision)
-
-        # Otherwise, if there's an exit code, or errmsg doesn't look like
-        # successful header, then call it a generic SCMError.
+        # So, if nothing was exported and there's an exit code, call it a
+        # generic SCMError, unless errmsg has a specific recognized message
+        # saying that files weren't found.
         #
         # If the .cvspass file doesn't exist, CVS will return an error message
         # stating this. This is safe to ignore.
-        if (failure and not errmsg.startswith('==========')) and \
-           not ".cvspass does not exist - creating new file" in errmsg:
-            self.cleanup()
+        if (failure and not found and
+            'cannot find module' not in errmsg and
+            'could not read RCS file' not in errmsg and
+            ".cvspass does not exist - creating new file" not in errmsg):
             raise SCMError(errmsg)
 
-        self.cleanup()
-        return contents
+        return found
+
+    def _not_found(self, filename, revision):
+        try:
+            raise FileNotFoundError(filename, revision)
+        except FileNotFoundError:
+            return None, sys.exc_info()
+
+    @classmethod
+    def _get_scratch_dir(cls):
+        cls.scratch_dir_lock.acquire()
+
+        try:
+            if not cls.scratch_dir or not os.path.isdir(cls.scratch_dir):
+                cls.scratch_dir = tempfile.mkdtemp(prefix='reviewboard-cvs.')
+
+            return cls.scratch_dir
+        finally:
+            cls.scratch_dir_lock.release()
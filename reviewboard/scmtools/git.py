@@ -2,6 +2,9 @@ import logging
 import os
 import re
 import subprocess
+import sys
+import threading
+import time
 import urllib2
 import urlparse
 
@@ -15,11 +18,13 @@ except ImportError:
 from django.utils.translation import ugettext_lazy as _
 from djblets.util.filesystem import is_exe_in_path
 
+from reviewboard.diffviewer.parallel import run_in_threads
 from reviewboard.diffviewer.parser import DiffParser, DiffParserError, File
 from reviewboard.scmtools.core import SCMTool, HEAD, PRE_CREATION
 from reviewboard.scmtools.errors import FileNotFoundError, \
                                         RepositoryNotFoundError, \
                                         SCMError
+from reviewboard.scmtools.httputils import fetch_url, head_url
 
 
 GIT_DIFF_EMPTY_CHANGESET_SIZE = 3
@@ -52,6 +57,21 @@ class GitTool(SCMTool):
 
         return self.client.get_file(path, revision)
 
+    def get_files(self, paths_and_revisions, max_threads=4):
+        results = [('', None)] * len(paths_and_revisions)
+        indexes = [i for i, (path, revision) in enumerate(paths_and_revisions)
+                   if revision != PRE_CREATION]
+
+        if indexes:
+            files = self.client.get_files(
+                [paths_and_revisions[i] for i in indexes],
+                max_threads)
+
+            for i, result in zip(indexes, files):
+                results[i] = result
+
+        return results
+
     def file_exists(self, path, revision=HEAD):
         if revision == PRE_CREATION:
             return False
@@ -61,6 +81,24 @@ class GitTool(SCMTool):
         except FileNotFoundError:
             return False
 
+    def _file_exists_many(self, paths_and_revisions, max_threads):
+        if self.client.raw_file_url:
+            return super(GitTool, self)._file_exists_many(paths_and_revisions,
+                                                          max_threads)
+
+        results = [False] * len(paths_and_revisions)
+        indexes = [i for i, (path, revision) in enumerate(paths_and_revisions)
+                   if revision != PRE_CREATION]
+
+        if indexes:
+            exists = self.client.get_files_exist(
+                [paths_and_revisions[i] for i in indexes])
+
+            for i, file_exists in zip(indexes, exists):
+                results[i] = file_exists
+
+        return results
+
     def parse_diff_revision(self, file_str, revision_str):
         revision = revision_str
         if file_str == "/dev/null":
@@ -176,21 +214,25 @@ class GitDiffParser(DiffParser):
             linenum += 1
 
         # Get the changes
+        changes_start = linenum
+
         while linenum < len(self.lines):
             if self._is_git_diff(linenum):
-                return linenum, file_info
+                break
 
             if self._is_binary_patch(linenum):
                 file_info.binary = True
+                file_info.data += self.lines.get_text(changes_start, linenum)
                 return linenum + 1, file_info
 
             if self._is_diff_fromfile_line(linenum):
                 if self.lines[linenum].split()[1] == "/dev/null":
                     file_info.origInfo = PRE_CREATION
 
-            file_info.data += self.lines[linenum] + "\n"
             linenum += 1
 
+        file_info.data += self.lines.get_text(changes_start, linenum)
+
         return linenum, file_info
 
     def _is_empty_change(self, linenum):
@@ -245,6 +287,9 @@ class GitClient(object):
         r'^(?P<username>[A-Za-z0-9_\.-]+@)?(?P<hostname>[A-Za-z0-9_\.-]+):'
         r'(?P<path>.*)')
 
+    # The local repositories that have been found to be valid.
+    checked_git_dirs = set()
+
     def __init__(self, path, raw_file_url=None):
         if not is_exe_in_path('git'):
             # This is technically not the right kind of error, but it's the
@@ -260,6 +305,11 @@ class GitClient(object):
         if url_parts[0] == 'file':
             self.git_dir = url_parts[2]
 
+            # A client is created for every file diffed, so only check each
+            # repository once.
+            if self.git_dir in GitClient.checked_git_dirs:
+                return
+
             p = subprocess.Popen(
                 ['git', '--git-dir=%s' % self.git_dir, 'config',
                      'core.repositoryformatversion'],
@@ -273,6 +323,8 @@ class GitClient(object):
                 raise SCMError(_('Unable to retrieve information from local '
                                  'Git repository'))
 
+            GitClient.checked_git_dirs.add(self.git_dir)
+
     def is_valid_repository(self):
         """Checks if this is a valid Git repository."""
         p = subprocess.Popen(
@@ -297,12 +349,15 @@ class GitClient(object):
 
             try:
                 url = self._build_raw_url(path, revision)
-                return urllib2.urlopen(url).read()
+                return fetch_url(url)
             except Exception, e:
                 logging.error("Git: Error fetching file from %s: %s" % (url, e))
                 raise SCMError("Error fetching file from %s: %s" % (url, e))
         else:
-            return self._cat_file(path, revision, "blob")
+            commit = self._resolve_head(revision, path)
+
+            return self._get_blob(commit,
+                                  cat_file_pool.cat_file(self.git_dir, commit))
 
     def get_file_exists(self, path, revision):
         if self.raw_file_url:
@@ -310,7 +365,8 @@ class GitClient(object):
 
             try:
                 url = self._build_raw_url(path, revision)
-                return urllib2.urlopen(url).geturl()
+                head_url(url)
+                return True
             except urllib2.HTTPError, e:
                 if e.code != 404:
                     logging.error("Git: HTTP error code %d when fetching "
@@ -320,46 +376,77 @@ class GitClient(object):
 
             return False
         else:
-            contents = self._cat_file(path, revision, "-t")
-            return contents and contents.strip() == "blob"
+            return self.get_files_exist([(path, revision)])[0]
 
-    def _build_raw_url(self, path, revision):
-        url = self.raw_file_url
-        url = url.replace("<revision>", revision)
-        url = url.replace("<filename>", urllib_quote(path))
-        return url
+    def get_files(self, paths_and_revisions, max_threads=4):
+        """
+        Fetches several files at once.
 
-    def _cat_file(self, path, revision, option):
+        Returns a list of (contents, exc_info) tuples in the same order as
+        paths_and_revisions, as with run_in_threads. Files in a local
+        repository are all read by one git-cat-file process. Files fetched
+        from raw file URLs use up to max_threads threads, which share a
+        pool of keep-alive connections.
         """
-        Call git-cat-file(1) to get content or type information for a
-        repository object.
+        if self.raw_file_url:
+            return run_in_threads(self.get_file, paths_and_revisions,
+                                  max_threads)
 
-        If called with just "commit", gets the content of a blob (or
-        raises an exception if the commit is not a blob).
+        results = [None] * len(paths_and_revisions)
+        indexes = []
+        commits = []
 
-        Otherwise, "option" can be used to pass a switch to git-cat-file,
-        e.g. to test or existence or get the type of "commit".
+        for i, (path, revision) in enumerate(paths_and_revisions):
+            try:
+                commits.append(self._resolve_head(revision, path))
+                indexes.append(i)
+            except SCMError:
+                results[i] = (None, sys.exc_info())
+
+        if commits:
+            objects = cat_file_pool.cat_files(self.git_dir, commits)
+
+            for i, commit, result in zip(indexes, commits, objects):
+                try:
+                    results[i] = (self._get_blob(commit, result), None)
+                except SCMError:
+                    results[i] = (None, sys.exc_info())
+
+        return results
+
+    def get_files_exist(self, paths_and_revisions):
         """
-        commit = self._resolve_head(revision, path)
+        Returns a list of whether each of the given (path, revision) files
+        exists as a blob in a local repository.
+        """
+        objects = [self._resolve_head(revision, path)
+                   for path, revision in paths_and_revisions]
 
-        p = subprocess.Popen(
-            ['git', '--git-dir=%s' % self.git_dir, 'cat-file', option, commit],
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            close_fds=(os.name != 'nt')
-        )
-        contents = p.stdout.read()
-        errmsg = p.stderr.read()
-        failure = p.wait()
+        return [object_type == "blob"
+                for object_type in cat_file_pool.check_objects(self.git_dir,
+                                                               objects)]
 
-        if failure:
-            if errmsg.startswith("fatal: Not a valid object name"):
-                raise FileNotFoundError(commit)
-            else:
-                raise SCMError(errmsg)
+    def _get_blob(self, commit, result):
+        """
+        Returns the contents of a blob looked up with git-cat-file, raising
+        an error if it doesn't exist or isn't a blob.
+        """
+        if not result:
+            raise FileNotFoundError(commit)
+
+        object_type, contents = result
+
+        if object_type != "blob":
+            raise SCMError("%s is a %s, not a blob" % (commit, object_type))
 
         return contents
 
+    def _build_raw_url(self, path, revision):
+        url = self.raw_file_url
+        url = url.replace("<revision>", revision)
+        url = url.replace("<filename>", urllib_quote(path))
+        return url
+
     def _resolve_head(self, revision, path):
         if revision == HEAD:
             if path == "":
@@ -392,3 +479,228 @@ class GitClient(object):
                                      path)
 
         return "file://" + path
+
+
+class GitCatFileProcess(object):
+    """
+    A long-lived git-cat-file(1) process, run with --batch or --batch-check.
+
+    Object names are written to the process one at a time, and it replies
+    with each object's type and size (and, for --batch, its contents).
+    """
+    def __init__(self, git_dir, option):
+        devnull = open(os.devnull, 'w')
+
+        try:
+            self.p = subprocess.Popen(
+                ['git', '--git-dir=%s' % git_dir, 'cat-file', option],
+                bufsize=-1,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=devnull,
+                close_fds=(os.name != 'nt')
+            )
+        finally:
+            devnull.close()
+
+        self.read_contents = (option == '--batch')
+        self.last_used = time.time()
+
+    def is_alive(self):
+        return self.p.poll() is None
+
+    def lookup(self, name):
+        """
+        Looks up an object, returning a (type, contents) tuple, or None if
+        it doesn't exist. The contents are None for --batch-check.
+
+        Raises IOError if the process has died.
+        """
+        if '\n' in name:
+            return None
+
+        self.p.stdin.write('%s\n' % name)
+        self.p.stdin.flush()
+
+        header = self.p.stdout.readline()
+
+        if not header.endswith('\n'):
+            raise IOError('git cat-file exited unexpectedly')
+
+        # The header is "<sha1> <type> <size>" for objects that exist, and
+        # "<object> missing" (or "ambiguous") for those that don't.
+        parts = header[:-1].split(' ')
+
+        if len(parts) != 3 or not parts[2].isdigit():
+            return None
+
+        contents = None
+
+        if self.read_contents:
+            size = int(parts[2])
+            contents = self.p.stdout.read(size)
+
+            if len(contents) != size or self.p.stdout.read(1) != '\n':
+                raise IOError('git cat-file exited unexpectedly')
+
+        return parts[1], contents
+
+    def close(self):
+        try:
+            self.p.stdin.close()
+            self.p.wait()
+        except (IOError, OSError):
+            pass
+
+
+class GitCatFilePool(object):
+    """
+    A pool of git-cat-file(1) processes for local repositories.
+
+    Rather than running git-cat-file for every file fetched or checked,
+    processes are kept around and reused, one request at a time. Up to
+    MAX_IDLE_PROCESSES idle processes are kept for each repository and
+    mode, and those left idle for IDLE_TIMEOUT seconds are closed. A
+    process that has died is replaced, and the request retried once.
+    """
+    MAX_IDLE_PROCESSES = 4
+    IDLE_TIMEOUT = 5 * 60
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def cat_file(self, git_dir, name):
+        """
+        Returns a (type, contents) tuple for an object, or None if it
+        doesn't exist.
+        """
+        return self._run(git_dir, '--batch', [name])[0]
+
+    def cat_files(self, git_dir, names):
+        """
+        Returns a list of (type, contents) tuples for several objects,
+        looked up one after another by the same process. The tuple is
+        None for objects that don't exist.
+        """
+        return self._run(git_dir, '--batch', names)
+
+    def check_objects(self, git_dir, names):
+        """
+        Returns a list of the types of several objects. The type is None
+        for objects that don't exist.
+        """
+        results = []
+
+        for result in self._run(git_dir, '--batch-check', names):
+            if result:
+                results.append(result[0])
+            else:
+                results.append(None)
+
+        return results
+
+    def close_all(self):
+        """Closes all idle processes."""
+        self.lock.acquire()
+
+        try:
+            idle = self.idle
+            self.idle = {}
+        finally:
+            self.lock.release()
+
+        for processes in idle.itervalues():
+            for process in processes:
+                process.close()
+
+    def _run(self, git_dir, option, names):
+        key = (git_dir, option)
+        process = self._acquire(key)
+        results = []
+        finished = False
+
+        try:
+            for name in names:
+                try:
+                    results.append(process.lookup(name))
+                except (IOError, OSError), e:
+                    logging.warning("Git: Restarting git cat-file for %s "
+                                    "after error: %s" % (git_dir, e))
+                    process.close()
+                    process = GitCatFileProcess(git_dir, option)
+
+                    try:
+                        results.append(process.lookup(name))
+                    except (IOError, OSError), e:
+                        raise SCMError("Error running git cat-file on %s: %s"
+                                       % (git_dir, e))
+
+            finished = True
+        finally:
+            # A process that failed partway through a lookup may have
+            # output left that would be read as the next result.
+            if finished:
+                self._release(key, process)
+            else:
+                process.close()
+
+        return results
+
+    def _acquire(self, key):
+        now = time.time()
+        to_close = []
+        process = None
+
+        self.lock.acquire()
+
+        try:
+            # Close any processes that have been idle for too long.
+            for idle_key, processes in self.idle.items():
+                for idle_process in processes[:]:
+                    if now - idle_process.last_used > self.IDLE_TIMEOUT:
+                        processes.remove(idle_process)
+                        to_close.append(idle_process)
+
+                if not processes:
+                    del self.idle[idle_key]
+
+            processes = self.idle.get(key, [])
+
+            while processes and not process:
+                process = processes.pop()
+
+                if not process.is_alive():
+                    to_close.append(process)
+                    process = None
+        finally:
+            self.lock.release()
+
+        for idle_process in to_close:
+            idle_process.close()
+
+        if not process:
+            process = GitCatFileProcess(key[0], key[1])
+
+        return process
+
+    def _release(self, key, process):
+        process.last_used = time.time()
+
+        self.lock.acquire()
+
+        try:
+            processes = self.idle.setdefault(key, [])
+
+            if (process.is_alive() and
+                len(processes) < self.MAX_IDLE_PROCESSES):
+                processes.append(process)
+                process = None
+        finally:
+            self.lock.release()
+
+        if process:
+            process.close()
+
+
+cat_file_pool = GitCatFilePool()
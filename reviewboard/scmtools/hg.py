@@ -6,10 +6,12 @@ try:
 except ImportError:
     from urllib import quote as urllib_quote
 
+from reviewboard.diffviewer.parallel import run_in_threads
 from reviewboard.diffviewer.parser import DiffParser, DiffParserError
 from reviewboard.scmtools.git import GitDiffParser
 from reviewboard.scmtools.core import \
     FileNotFoundError, SCMTool, HEAD, PRE_CREATION
+from reviewboard.scmtools.httputils import fetch_url
 
 
 class HgTool(SCMTool):
@@ -34,6 +36,17 @@ class HgTool(SCMTool):
     def get_file(self, path, revision=HEAD):
         return self.client.cat_file(path, str(revision))
 
+    def get_files(self, paths_and_revisions, max_threads=4):
+        if isinstance(self.client, HgWebClient):
+            return self.client.get_files(
+                [(path, str(revision))
+                 for path, revision in paths_and_revisions],
+                max_threads)
+
+        # Local repositories are read in-process, so there's nothing to gain
+        # from opening them again in other threads.
+        return super(HgTool, self).get_files(paths_and_revisions, 1)
+
     def parse_diff_revision(self, file_str, revision_str):
         revision = revision_str
         if file_str == "/dev/null":
@@ -106,6 +119,11 @@ class HgDiffParser(DiffParser):
 
 class HgWebClient(object):
     FULL_FILE_URL = '%(url)s/%(rawpath)s/%(revision)s/%(quoted_path)s'
+    RAW_PATHS = ['raw-file', 'raw']
+
+    # The raw path that last worked for each repository URL. This is tried
+    # first from then on.
+    working_raw_paths = {}
 
     def __init__(self, repoPath, username, password):
         self.url = repoPath
@@ -120,39 +138,51 @@ class HgWebClient(object):
         elif rev == PRE_CREATION:
             rev = ""
 
-        found = False
+        rawpaths = list(self.RAW_PATHS)
+        working_rawpath = HgWebClient.working_raw_paths.get(self.url)
+
+        if working_rawpath in rawpaths:
+            rawpaths.remove(working_rawpath)
+            rawpaths.insert(0, working_rawpath)
+
+        error = None
 
-        for rawpath in ["raw-file", "raw"]:
-            full_url = ''
+        for rawpath in rawpaths:
+            full_url = self.FULL_FILE_URL % {
+                'url': self.url.rstrip('/'),
+                'rawpath': rawpath,
+                'revision': rev,
+                'quoted_path': urllib_quote(path.lstrip('/')),
+            }
 
             try:
-                passman = urllib2.HTTPPasswordMgrWithDefaultRealm()
-                passman.add_password(None, self.url, self.username,
-                                     self.password)
-                authhandler = urllib2.HTTPBasicAuthHandler(passman)
-                opener = urllib2.build_opener(authhandler)
-                full_url = self.FULL_FILE_URL % {
-                    'url': self.url.rstrip('/'),
-                    'rawpath': rawpath,
-                    'revision': rev,
-                    'quoted_path': urllib_quote(path.lstrip('/')),
-                }
-                f = opener.open(full_url)
-                return f.read()
+                data = fetch_url(full_url, self.username, self.password)
+                HgWebClient.working_raw_paths[self.url] = rawpath
 
+                return data
             except urllib2.HTTPError, e:
-
                 if e.code != 404:
                     logging.error("%s: HTTP error code %d when fetching "
                                   "file from %s: %s", self.__class__.__name__,
                                   e.code, full_url, e)
 
-            except Exception:
+                error = e
+            except Exception, e:
                 logging.exception('%s: Non-HTTP error when fetching %r: ',
                                   self.__class__.__name__, full_url)
+                error = e
 
-        if not found:
-            raise FileNotFoundError(path, rev, str(e))
+        raise FileNotFoundError(path, rev, str(error))
+
+    def get_files(self, paths_and_revisions, max_threads=4):
+        """Fetches several files at once, using up to max_threads threads.
+
+        Returns a list of (contents, exc_info) tuples in the same order as
+        paths_and_revisions, as with run_in_threads. The files are fetched
+        over a shared pool of keep-alive connections.
+        """
+        return run_in_threads(self.cat_file, paths_and_revisions,
+                              max_threads)
 
     def get_filenames(self, rev):
         raise NotImplemented
@@ -0,0 +1,285 @@
+import base64
+import httplib
+import socket
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+
+
+class HTTPConnectionPool(object):
+    """A pool of keep-alive HTTP connections, shared between repositories.
+
+    Fetching many files from the same host (such as the raw file URLs of a
+    Git or Mercurial web front-end) reuses a few open connections rather
+    than connecting for every file. At most MAX_CONNECTIONS_PER_HOST
+    requests are made to a host at once, and connections left idle for
+    IDLE_TIMEOUT seconds are closed.
+
+    URLs that would go through a proxy are fetched with urllib2 instead.
+    """
+    MAX_CONNECTIONS_PER_HOST = 4
+    IDLE_TIMEOUT = 60
+    MAX_REDIRECTS = 5
+
+    # The timeout, in seconds, for connecting and reading.
+    TIMEOUT = 60
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = {}
+        self.semaphores = {}
+
+    def fetch(self, url, username=None, password=None):
+        """Fetches a URL, returning its contents.
+
+        If a username is given, it's sent to the host of the URL using
+        HTTP Basic authentication. Redirects are followed.
+
+        Error responses raise urllib2.HTTPError, and failures to connect
+        raise urllib2.URLError, as with urllib2.urlopen.
+        """
+        return self._open(url, username, password, 'GET')
+
+    def head(self, url, username=None, password=None):
+        """Checks that a URL can be fetched, without fetching its contents.
+
+        This makes a HEAD request, which is handled the same way as in
+        fetch, and raises the same errors. Servers that don't allow HEAD
+        requests get a normal GET instead.
+        """
+        try:
+            self._open(url, username, password, 'HEAD')
+        except urllib2.HTTPError, e:
+            # 405 Method Not Allowed or 501 Not Implemented.
+            if e.code not in (405, 501):
+                raise
+
+            self.fetch(url, username, password)
+
+    def _open(self, url, username, password, method):
+        scheme, netloc = urlparse.urlsplit(url)[:2]
+
+        if (scheme not in ('http', 'https') or
+            urllib.getproxies().get(scheme)):
+            return self._fetch_with_urllib2(url, username, password, method)
+
+        netloc, url_username, url_password = self._split_netloc(netloc)
+
+        if not username and url_username:
+            username = url_username
+            password = url_password
+
+        auth_netloc = netloc
+        headers = {}
+
+        for i in xrange(self.MAX_REDIRECTS + 1):
+            scheme, netloc, path, query = urlparse.urlsplit(url)[:4]
+            netloc = self._split_netloc(netloc)[0]
+
+            if scheme not in ('http', 'https'):
+                return self._fetch_with_urllib2(url, username, password,
+                                                method)
+
+            selector = path or '/'
+
+            if query:
+                selector += '?' + query
+
+            # Only send credentials to the host they were given for.
+            if username and netloc == auth_netloc:
+                headers['Authorization'] = 'Basic %s' % base64.b64encode(
+                    '%s:%s' % (username, password or ''))
+            elif 'Authorization' in headers:
+                del headers['Authorization']
+
+            status, reason, msg, data = self._request(scheme, netloc, method,
+                                                      selector, headers)
+
+            if status in (301, 302, 303, 307) and msg.getheader('location'):
+                url = urlparse.urljoin(url, msg.getheader('location'))
+            elif 200 <= status < 300:
+                return data
+            else:
+                raise urllib2.HTTPError(url, status, reason, msg, None)
+
+        raise urllib2.HTTPError(url, status, 'Too many redirects', msg, None)
+
+    def close_all(self):
+        """Closes all idle connections."""
+        self.lock.acquire()
+
+        try:
+            idle = self.idle
+            self.idle = {}
+        finally:
+            self.lock.release()
+
+        for connections in idle.itervalues():
+            for conn, last_used in connections:
+                conn.close()
+
+    def _request(self, scheme, netloc, method, selector, headers):
+        key = (scheme, netloc)
+        semaphore = self._get_semaphore(key)
+        semaphore.acquire()
+
+        try:
+            conn, reused = self._get_connection(key)
+
+            try:
+                try:
+                    response = self._send(conn, method, selector, headers)
+                except (httplib.HTTPException, socket.error):
+                    conn.close()
+
+                    if not reused:
+                        raise
+
+                    # The server may have closed the connection while it was
+                    # idle. Try again on a new one.
+                    conn = self._new_connection(scheme, netloc)
+                    response = self._send(conn, method, selector, headers)
+
+                data = response.read()
+            except (httplib.HTTPException, socket.error), e:
+                conn.close()
+                raise urllib2.URLError(e)
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+
+            return response.status, response.reason, response.msg, data
+        finally:
+            semaphore.release()
+
+    def _send(self, conn, method, selector, headers):
+        conn.request(method, selector, headers=headers)
+
+        return conn.getresponse()
+
+    def _get_semaphore(self, key):
+        self.lock.acquire()
+
+        try:
+            if key not in self.semaphores:
+                self.semaphores[key] = \
+                    threading.Semaphore(self.MAX_CONNECTIONS_PER_HOST)
+
+            return self.semaphores[key]
+        finally:
+            self.lock.release()
+
+    def _get_connection(self, key):
+        """Returns an idle connection to a host, or a new one.
+
+        This returns a tuple of the connection and whether it's been used
+        before.
+        """
+        now = time.time()
+        to_close = []
+        conn = None
+
+        self.lock.acquire()
+
+        try:
+            connections = self.idle.get(key, [])
+
+            while connections:
+                idle_conn, last_used = connections.pop()
+
+                if now - last_used > self.IDLE_TIMEOUT:
+                    to_close.append(idle_conn)
+                else:
+                    conn = idle_conn
+                    break
+        finally:
+            self.lock.release()
+
+        for idle_conn in to_close:
+            idle_conn.close()
+
+        if conn:
+            return conn, True
+        else:
+            return self._new_connection(*key), False
+
+    def _new_connection(self, scheme, netloc):
+        if scheme == 'https':
+            conn_class = httplib.HTTPSConnection
+        else:
+            conn_class = httplib.HTTPConnection
+
+        try:
+            return conn_class(netloc, timeout=self.TIMEOUT)
+        except TypeError:
+            # Python 2.5 and older don't support timeouts.
+            return conn_class(netloc)
+
+    def _release(self, key, conn):
+        self.lock.acquire()
+
+        try:
+            self.idle.setdefault(key, []).append((conn, time.time()))
+        finally:
+            self.lock.release()
+
+    def _split_netloc(self, netloc):
+        """Splits a network location into the host and any credentials."""
+        username = None
+        password = None
+
+        if '@' in netloc:
+            userinfo, netloc = netloc.rsplit('@', 1)
+
+            if ':' in userinfo:
+                username, password = userinfo.split(':', 1)
+            else:
+                username = userinfo
+
+            username = urllib.unquote(username)
+
+            if password is not None:
+                password = urllib.unquote(password)
+
+        return netloc, username, password
+
+    def _fetch_with_urllib2(self, url, username, password, method):
+        handlers = []
+
+        if username:
+            passman = urllib2.HTTPPasswordMgrWithDefaultRealm()
+            passman.add_password(None, url, username, password)
+            handlers.append(urllib2.HTTPBasicAuthHandler(passman))
+
+        request = urllib2.Request(url)
+        request.get_method = lambda: method
+
+        f = urllib2.build_opener(*handlers).open(request)
+
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+
+http_pool = HTTPConnectionPool()
+
+
+def fetch_url(url, username=None, password=None):
+    """Fetches a URL using the shared pool of connections.
+
+    See HTTPConnectionPool.fetch.
+    """
+    return http_pool.fetch(url, username, password)
+
+
+def head_url(url, username=None, password=None):
+    """Checks that a URL can be fetched, using the shared pool of connections.
+
+    See HTTPConnectionPool.head.
+    """
+    http_pool.head(url, username, password)
@@ -1,5 +1,7 @@
+import logging
 import re
-import subprocess
+import sys
+import threading
 
 try:
     from P4 import P4Error
@@ -9,7 +11,119 @@ except ImportError:
 from reviewboard.diffviewer.parser import DiffParser
 from reviewboard.scmtools.core import SCMTool, ChangeSet, \
                                       HEAD, PRE_CREATION
-from reviewboard.scmtools.errors import SCMError, EmptyChangeSetError
+from reviewboard.scmtools.errors import SCMError, EmptyChangeSetError, \
+                                        FileNotFoundError
+
+
+class P4ConnectionPool(object):
+    """A pool of connected P4 clients, shared by every PerforceTool.
+
+    Connecting to a Perforce server is slow, so connections are kept open
+    and reused, rather than made for each command. Up to
+    MAX_IDLE_CONNECTIONS idle connections are kept for each server and
+    user.
+    """
+    MAX_IDLE_CONNECTIONS = 4
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def run(self, port, user, password, func):
+        """Calls func with a connected P4 client, returning its result.
+
+        If func raises a P4Error because the connection was dropped, it's
+        called once more with a new connection.
+        """
+        key = (port, user, password)
+        p4 = self._acquire(key)
+
+        try:
+            try:
+                return func(p4)
+            except P4Error:
+                if not self._is_dropped(p4):
+                    raise
+
+                logging.warning("Perforce: Reconnecting to %s after the "
+                                "connection was dropped" % port)
+                self._disconnect(p4)
+                p4 = self._connect(key)
+
+                return func(p4)
+        finally:
+            self._release(key, p4)
+
+    def close_all(self):
+        """Disconnects all idle connections."""
+        self.lock.acquire()
+
+        try:
+            idle = self.idle
+            self.idle = {}
+        finally:
+            self.lock.release()
+
+        for connections in idle.itervalues():
+            for p4 in connections:
+                self._disconnect(p4)
+
+    def _acquire(self, key):
+        self.lock.acquire()
+
+        try:
+            connections = self.idle.get(key)
+
+            if connections:
+                return connections.pop()
+        finally:
+            self.lock.release()
+
+        return self._connect(key)
+
+    def _release(self, key, p4):
+        if p4.connected() and not self._is_dropped(p4):
+            self.lock.acquire()
+
+            try:
+                connections = self.idle.setdefault(key, [])
+
+                if len(connections) < self.MAX_IDLE_CONNECTIONS:
+                    connections.append(p4)
+                    return
+            finally:
+                self.lock.release()
+
+        self._disconnect(p4)
+
+    def _connect(self, key):
+        import P4
+
+        p4 = P4.P4()
+        p4.port, p4.user, p4.password = key
+        p4.exception_level = 1
+        p4.connect()
+
+        return p4
+
+    def _disconnect(self, p4):
+        try:
+            if p4.connected():
+                p4.disconnect()
+        except P4Error:
+            # If the connection was already lost, we'll get a P4Error from
+            # disconnect(). This is safe to ignore.
+            pass
+
+    def _is_dropped(self, p4):
+        try:
+            return p4.dropped()
+        except AttributeError:
+            # Older versions of P4Python can't tell us.
+            return not p4.connected()
+
+
+connection_pool = P4ConnectionPool()
 
 
 class PerforceTool(SCMTool):
@@ -23,47 +137,27 @@ class PerforceTool(SCMTool):
     def __init__(self, repository):
         SCMTool.__init__(self, repository)
 
+        # Make sure P4Python is installed.
         import P4
-        self.p4 = P4.P4()
-        self.p4.port = str(repository.mirror_path or repository.path)
-        self.p4.user = str(repository.username)
-        self.p4.password = str(repository.password)
-        self.p4.exception_level = 1
 
-        # We defer actually connecting until just before we do some operation
-        # that requires an active connection to the perforce depot.  This
-        # connection is then left open as long as possible.
+        self.p4port = str(repository.mirror_path or repository.path)
+        self.p4user = str(repository.username)
+        self.p4password = str(repository.password)
 
-    def __del__(self):
-        try:
-            self._disconnect()
-        except P4Error:
-            # Exceptions in __del__ get ignored but spew warnings.  If there's
-            # no internet connection, we'll get a P4Error from disconnect().
-            # This is totally safe to ignore.
-            pass
-
-    def _connect(self):
-        if not self.p4.connected():
-            self.p4.connect()
-
-    def _disconnect(self):
-        try:
-            if self.p4.connected():
-                self.p4.disconnect()
-        except AttributeError:
-            pass
+    def _run(self, func):
+        """Calls func with a connected P4 client from the pool."""
+        return connection_pool.run(self.p4port, self.p4user, self.p4password,
+                                   func)
 
     def get_pending_changesets(self, userid):
-        self._connect()
-        return map(self.get_changeset,
-                   [x.split()[1] for x in
-                       self.p4.run_changes('-s', 'pending', '-u', userid)])
+        changes = self._run(
+            lambda p4: p4.run_changes('-s', 'pending', '-u', userid))
+
+        return map(self.get_changeset, [x.split()[1] for x in changes])
 
     def get_changeset(self, changesetid):
-        self._connect()
-        changeset = self.p4.run_describe('-s', str(changesetid))
-        self._disconnect()
+        changeset = self._run(
+            lambda p4: p4.run_describe('-s', str(changesetid)))
 
         if changeset:
             return self.parse_change_desc(changeset[0], changesetid)
@@ -73,51 +167,119 @@ class PerforceTool(SCMTool):
         return True
 
     def get_file(self, path, revision=HEAD):
-        if revision == PRE_CREATION:
-            return ''
+        contents, exc_info = self.get_files([(path, revision)])[0]
+
+        if exc_info:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        return contents
+
+    def get_files(self, paths_and_revisions, max_threads=4):
+        """Fetches several files with a single "p4 print".
+
+        Returns a list of (contents, exc_info) tuples in the same order as
+        paths_and_revisions, as with run_in_threads. Files that don't exist
+        have a FileNotFoundError.
+        """
+        specs = []
+
+        for path, revision in paths_and_revisions:
+            if revision == HEAD:
+                specs.append(path)
+            elif revision != PRE_CREATION:
+                specs.append('%s#%s' % (path, revision))
+
+        # The output is a dictionary describing each file that was found,
+        # followed by its contents, which may be split into several strings.
+        found_revisions = {}
+        found_heads = {}
+
+        if specs:
+            try:
+                output = self._run(lambda p4: p4.run_print(*specs))
+            except P4Error, e:
+                raise SCMError(e)
+
+            contents = None
+
+            for item in output:
+                if isinstance(item, dict):
+                    contents = []
+                    found_revisions[(item['depotFile'], item['rev'])] = \
+                        contents
+                    found_heads.setdefault(item['depotFile'], contents)
+                elif contents is not None:
+                    contents.append(item)
+
+        results = []
+
+        for path, revision in paths_and_revisions:
+            if revision == PRE_CREATION:
+                results.append(('', None))
+                continue
+
+            if revision == HEAD:
+                contents = found_heads.get(path)
+            else:
+                contents = found_revisions.get((path, str(revision)))
+
+            if contents is None:
+                try:
+                    raise FileNotFoundError(path, revision)
+                except FileNotFoundError:
+                    results.append((None, sys.exc_info()))
+            else:
+                results.append((''.join(contents), None))
+
+        return results
+
+    def _file_exists_many(self, paths_and_revisions, max_threads):
+        # Look up all the files with one "p4 files". Files that don't exist
+        # only cause warnings, and are left out of the results.
+        specs = []
+
+        for path, revision in paths_and_revisions:
+            if revision == HEAD:
+                specs.append(path)
+            elif revision != PRE_CREATION:
+                specs.append('%s#%s' % (path, revision))
+
+        if not specs:
+            return [False] * len(paths_and_revisions)
 
-        if revision == HEAD:
-            file = path
-        else:
-            file = '%s#%s' % (path, revision)
+        try:
+            files = self._run(lambda p4: p4.run_files(*specs))
+        except P4Error, e:
+            raise SCMError(e)
 
-        cmdline = ['p4', '-p', self.p4.port]
-        if self.p4.user:
-            cmdline.extend(['-u', self.p4.user])
-        if self.p4.password:
-            cmdline.extend(['-P', self.p4.password])
-        cmdline.extend(['print', '-q', file])
+        found_revisions = set()
+        found_heads = set()
 
-        p = subprocess.Popen(cmdline, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        for f in files:
+            if f['action'] not in ('delete', 'move/delete', 'purge',
+                                   'archive'):
+                found_revisions.add((f['depotFile'], f['rev']))
+                found_heads.add(f['depotFile'])
 
-        (res, errdata) = p.communicate()
-        failure = p.poll()
+        results = []
 
-        if failure:
-            error = errdata.splitlines()
-            # The command-line output is the same as the contents of a P4Error
-            # except they're prefixed with a line that says "Perforce client
-            # error:", and the lines of the error are indented with tabs.
-            if error[0].startswith("Perforce client error:"):
-                error = error[1:]
+        for path, revision in paths_and_revisions:
+            if revision == HEAD:
+                results.append(path in found_heads)
+            else:
+                results.append((path, str(revision)) in found_revisions)
 
-            raise SCMError('\n'.join(line.lstrip("\t") for line in error))
-        else:
-            return res
+        return results
 
     def parse_diff_revision(self, file_str, revision_str):
         # Perforce has this lovely idiosyncracy that diffs show revision #1 both
         # for pre-creation and when there's an actual revision.
-        self._connect()
-
         filename, revision = revision_str.rsplit('#', 1)
-        files = self.p4.run_files(revision_str)
+        files = self._run(lambda p4: p4.run_files(revision_str))
 
         if len(files) == 0:
             revision = PRE_CREATION
 
-        self._disconnect()
-
         return filename, revision
 
     def get_filenames_in_revision(self, revision):
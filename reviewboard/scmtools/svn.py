@@ -1,5 +1,6 @@
 import logging
 import os
+import posixpath
 import re
 import urllib
 import urlparse
@@ -9,6 +10,9 @@ try:
 except ImportError:
     pass
 
+from django.core.cache import cache
+from django.utils.encoding import smart_str
+from django.utils.hashcompat import sha_constructor
 from django.utils.translation import ugettext as _
 
 from reviewboard.diffviewer.parser import DiffParser
@@ -24,6 +28,10 @@ from reviewboard.scmtools.errors import SCMError, \
 # Register these URI schemes so we can handle them properly.
 sshutils.ssh_uri_schemes.append('svn+ssh')
 
+# How long, in seconds, the svn:keywords property of a file at a revision
+# is cached for. These never change, so they can be kept for a long time.
+KEYWORDS_CACHE_EXPIRATION = 24 * 60 * 60
+
 
 class SVNCertificateFailures:
     """SVN HTTPS certificate failure codes.
@@ -67,6 +75,10 @@ class SVNTool(SCMTool):
         'URL':                 URL_KEYWORDS,
     }
 
+    # Compiled regexes used by collapse_keywords, keyed by the value of
+    # svn:keywords.
+    keywords_re_cache = {}
+
     def __init__(self, repository):
         self.repopath = repository.path
         if self.repopath[-1] == '/':
@@ -103,17 +115,7 @@ class SVNTool(SCMTool):
             raise FileNotFoundError(path, revision)
 
         try:
-            normpath = self.__normalize_path(path)
-
-            # SVN expects to have URLs escaped. Take care to only
-            # escape the path part of the URL.
-            if self.client.is_url(normpath):
-                pathtuple = urlparse.urlsplit(normpath)
-                normpath = urlparse.urlunsplit((pathtuple[0],
-                                                pathtuple[1],
-                                                urllib.quote(pathtuple[2]),
-                                                '',''))
-
+            normpath = self.__normalize_url(path)
             normrev  = self.__normalize_revision(revision)
 
             data = self.client.cat(normpath, normrev)
@@ -121,11 +123,10 @@ class SVNTool(SCMTool):
             # Find out if this file has any keyword expansion set.
             # If it does, collapse these keywords. This is because SVN
             # will return the file expanded to us, which would break patching.
-            keywords = self.client.propget("svn:keywords", normpath, normrev,
-                                           recurse=True)
+            keyword_str = self.__get_keywords(normpath, normrev, revision)
 
-            if normpath in keywords:
-                data = self.collapse_keywords(data, keywords[normpath])
+            if keyword_str:
+                data = self.collapse_keywords(data, keyword_str)
 
             return data
         except ClientError, e:
@@ -143,6 +144,74 @@ class SVNTool(SCMTool):
             else:
                 raise SCMError(e)
 
+    def prefetch_keywords(self, paths_and_revisions):
+        """Looks up the svn:keywords property of several files at once.
+
+        Files in the same directory at the same revision are looked up
+        with a single propget of the directory, and the results are cached
+        for get_file. This saves a round trip to the server per file when
+        many files are fetched, such as for all the files in a diff.
+        """
+        import pysvn
+
+        if not hasattr(pysvn, 'depth'):
+            # Older versions of pysvn can only propget a directory
+            # recursively, which may be far more than we want.
+            return
+
+        dirs = {}
+
+        for path, revision in paths_and_revisions:
+            if not path or not str(revision).isdigit():
+                continue
+
+            normpath = self.__normalize_url(path)
+            key = self._get_keywords_cache_key(normpath, revision)
+            dirname = posixpath.dirname(normpath)
+            dirs.setdefault((dirname, str(revision)), {})[key] = normpath
+
+        for (dirname, revision), files in dirs.iteritems():
+            if len(files) < 2:
+                # It's no cheaper than looking it up in get_file.
+                continue
+
+            cached = cache.get_many(files.keys())
+            uncached = [key for key in files if key not in cached]
+
+            if len(uncached) < 2:
+                continue
+
+            try:
+                props = self.client.propget(
+                    "svn:keywords", dirname,
+                    self.__normalize_revision(revision),
+                    depth=pysvn.depth.files)
+            except ClientError, e:
+                # The directory may no longer exist. get_file will look up
+                # each file instead.
+                logging.debug('SVN: Unable to get svn:keywords for %s: %s' %
+                              (dirname, e))
+                continue
+
+            props = dict([(urllib.unquote(url), value)
+                          for url, value in props.iteritems()])
+
+            for key in uncached:
+                cache.set(key, props.get(urllib.unquote(files[key]), ''),
+                          KEYWORDS_CACHE_EXPIRATION)
+
+    def _file_exists_many(self, paths_and_revisions, max_threads):
+        self.prefetch_keywords(paths_and_revisions)
+
+        return super(SVNTool, self)._file_exists_many(paths_and_revisions,
+                                                      max_threads)
+
+    def get_files(self, paths_and_revisions, max_threads=4):
+        self.prefetch_keywords(paths_and_revisions)
+
+        return super(SVNTool, self).get_files(paths_and_revisions,
+                                              max_threads)
+
     def collapse_keywords(self, data, keyword_str):
         """
         Collapse SVN keywords in string.
@@ -164,13 +233,19 @@ class SVNTool(SCMTool):
 
             return "$%s$" % m.group(1)
 
-        # Get any aliased keywords
-        keywords = [keyword
-                    for name in keyword_str.split(" ")
-                    for keyword in self.keywords.get(name, [])]
+        regex = self.keywords_re_cache.get(keyword_str)
+
+        if not regex:
+            # Get any aliased keywords
+            keywords = [keyword
+                        for name in keyword_str.split(" ")
+                        for keyword in self.keywords.get(name, [])]
+
+            regex = re.compile(r"\$(%s):(:?)([^\$\n\r]+)\$" %
+                               '|'.join(keywords))
+            self.keywords_re_cache[keyword_str] = regex
 
-        return re.sub(r"\$(%s):(:?)([^\$\n\r]+)\$" % '|'.join(keywords),
-                      repl, data)
+        return regex.sub(repl, data)
 
 
     def parse_diff_revision(self, file_str, revision_str):
@@ -245,6 +320,56 @@ class SVNTool(SCMTool):
         else:
             return self.repopath + "/" + path
 
+    def __normalize_url(self, path):
+        normpath = self.__normalize_path(path)
+
+        # SVN expects to have URLs escaped. Take care to only
+        # escape the path part of the URL.
+        if self.client.is_url(normpath):
+            pathtuple = urlparse.urlsplit(normpath)
+            normpath = urlparse.urlunsplit((pathtuple[0],
+                                            pathtuple[1],
+                                            urllib.quote(pathtuple[2]),
+                                            '',''))
+
+        return normpath
+
+    def __get_keywords(self, normpath, normrev, revision):
+        """Returns the svn:keywords property of a file.
+
+        The property of a file at a numbered revision never changes, so it's
+        cached, and only looked up the first time.
+        """
+        if revision == HEAD:
+            key = None
+        else:
+            key = self._get_keywords_cache_key(normpath, revision)
+            keyword_str = cache.get(key)
+
+            if keyword_str is not None:
+                return keyword_str
+
+        keywords = self.client.propget("svn:keywords", normpath, normrev,
+                                       recurse=False)
+        keyword_str = keywords.get(normpath, '')
+
+        if not keyword_str:
+            # The path may have been escaped differently than we did.
+            for url, value in keywords.iteritems():
+                if urllib.unquote(url) == urllib.unquote(normpath):
+                    keyword_str = value
+                    break
+
+        if key:
+            cache.set(key, keyword_str, KEYWORDS_CACHE_EXPIRATION)
+
+        return keyword_str
+
+    def _get_keywords_cache_key(self, normpath, revision):
+        key = '%s:%s' % (normpath, revision)
+
+        return 'svn-keywords:%s' % sha_constructor(smart_str(key)).hexdigest()
+
     def get_fields(self):
         return ['basedir', 'diff_path']
 
@@ -1,7 +1,14 @@
+import base64
+import BaseHTTPServer
 import imp
 import os
 import nose
+import SocketServer
+import sys
+import threading
+import urllib2
 
+from django.core.cache import cache
 from django.test import TestCase as DjangoTestCase
 try:
     imp.find_module("P4")
@@ -11,9 +18,14 @@ except ImportError:
 
 from reviewboard.diffviewer.diffutils import patch
 from reviewboard.diffviewer.parser import DiffParserError
-from reviewboard.scmtools.core import HEAD, PRE_CREATION, ChangeSet, Revision
+from reviewboard.scmtools.core import HEAD, PRE_CREATION, ChangeSet, \
+                                      Revision, SCMTool
 from reviewboard.scmtools.errors import SCMError, FileNotFoundError
 from reviewboard.scmtools.models import Repository, Tool
+import reviewboard.scmtools.git as git
+import reviewboard.scmtools.hg as hg
+import reviewboard.scmtools.httputils as httputils
+import reviewboard.scmtools.perforce as perforce
 
 
 class CoreTests(DjangoTestCase):
@@ -31,6 +43,61 @@ class CoreTests(DjangoTestCase):
         self.assert_(len(cs.bugs_closed) == 0)
         self.assert_(len(cs.files) == 0)
 
+    def testFileExistsMany(self):
+        """Testing SCMTool.file_exists_many"""
+        checked = []
+
+        class DummyTool(SCMTool):
+            def file_exists(self, path, revision=HEAD):
+                checked.append((path, revision))
+                return path.startswith('exists')
+
+        repository = Repository(name='Dummy', path='/dummy/file-exists-many')
+        tool = DummyTool(repository)
+        files = [('exists1', '1'), ('missing', '1'), ('exists2', HEAD)]
+
+        self.assertEqual(tool.file_exists_many(files), [True, False, True])
+        self.assertEqual(len(checked), 3)
+
+        # The results should now be cached.
+        files.append(('exists3', '2'))
+        self.assertEqual(tool.file_exists_many(files),
+                         [True, False, True, True])
+        self.assertEqual(len(checked), 4)
+        self.assertEqual(checked[-1], ('exists3', '2'))
+
+    def testGetFiles(self):
+        """Testing SCMTool.get_files"""
+        fetched = []
+
+        class DummyTool(SCMTool):
+            def get_file(self, path, revision=HEAD):
+                fetched.append((path, revision))
+
+                if path.startswith('missing'):
+                    raise FileNotFoundError(path, revision)
+
+                return '%s@%s' % (path, revision)
+
+        repository = Repository(name='Dummy', path='/dummy/get-files')
+        tool = DummyTool(repository)
+        files = [('file%d' % i, str(i)) for i in range(10)]
+        files.insert(3, ('missing', '1'))
+
+        for max_threads in (1, 4):
+            del fetched[:]
+            results = tool.get_files(files, max_threads)
+
+            self.assertEqual(len(results), 11)
+            self.assertEqual(len(fetched), 11)
+            self.assertEqual(results[3][0], None)
+            self.assertEqual(results[3][1][0], FileNotFoundError)
+
+            for (path, revision), (contents, exc_info) in \
+                zip(files[:3] + files[4:], results[:3] + results[4:]):
+                self.assertEqual(contents, '%s@%s' % (path, revision))
+                self.assertEqual(exc_info, None)
+
 
 class CVSTests(DjangoTestCase):
     """Unit tests for CVS."""
@@ -99,6 +166,26 @@ class CVSTests(DjangoTestCase):
         self.assertRaises(FileNotFoundError,
                           lambda: self.tool.get_file('hello', PRE_CREATION))
 
+    def testGetFiles(self):
+        """Testing CVSTool.get_files"""
+        cwd = os.getcwd()
+        results = self.tool.get_files([
+            ('test/testfile', Revision('1.1')),
+            ('test/testfile,v', Revision('1.1')),
+            ('test/testfile2', Revision('1.1')),
+            ('test/testfile', Revision('2.1')),
+            ('test/testfile', PRE_CREATION),
+        ])
+
+        self.assertEqual(os.getcwd(), cwd)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(results[0], ('test content\n', None))
+        self.assertEqual(results[1], ('test content\n', None))
+
+        for contents, exc_info in results[2:]:
+            self.assertEqual(contents, None)
+            self.assertEqual(exc_info[0], FileNotFoundError)
+
     def testRevisionParsing(self):
         """Testing revision number parsing"""
         self.assertEqual(self.tool.parse_diff_revision('', 'PRE-CREATION')[1],
@@ -242,6 +329,47 @@ class SubversionTests(DjangoTestCase):
                           lambda: self.tool.get_file('hello',
                                                      PRE_CREATION))
 
+    def testKeywordsCache(self):
+        """Testing SVNTool caching svn:keywords"""
+        class PropgetCounter(object):
+            def __init__(self, client):
+                self.client = client
+                self.num_propgets = 0
+
+            def propget(self, *args, **kwargs):
+                self.num_propgets += 1
+                return self.client.propget(*args, **kwargs)
+
+            def __getattr__(self, name):
+                return getattr(self.client, name)
+
+        file = 'trunk/doc/misc-docs/Makefile'
+        cache.delete(self.tool._get_keywords_cache_key(
+            self.repository.path + '/' + file, '2'))
+
+        self.tool.client = PropgetCounter(self.tool.client)
+        data = self.tool.get_file(file, Revision('2'))
+        self.assertEqual(self.tool.client.num_propgets, 1)
+
+        self.assertEqual(self.tool.get_file(file, Revision('2')), data)
+        self.assertEqual(self.tool.client.num_propgets, 1)
+
+        self.tool.get_file(file, HEAD)
+        self.tool.get_file(file, HEAD)
+        self.assertEqual(self.tool.client.num_propgets, 3)
+
+    def testCollapseKeywords(self):
+        """Testing SVNTool.collapse_keywords"""
+        data = '$Id: Makefile 2 2007-05-31 chipx86 $\n' \
+               '$Revision:: 2  $\n' \
+               '$Author: chipx86 $\n'
+
+        self.assertEqual(self.tool.collapse_keywords(data, 'Id Rev'),
+                         '$Id$\n$Revision::    $\n$Author: chipx86 $\n')
+        self.assertEqual(self.tool.collapse_keywords(data, 'Author'),
+                         '$Id: Makefile 2 2007-05-31 chipx86 $\n'
+                         '$Revision:: 2  $\n$Author$\n')
+
     def testRevisionParsing(self):
         """Testing revision number parsing"""
         self.assertEqual(self.tool.parse_diff_revision('', '(working copy)')[1],
@@ -443,6 +571,161 @@ class PerforceTests(DjangoTestCase):
         self.assertEqual(files[1].data, diff2_text)
 
 
+class PerforceConnectionTests(DjangoTestCase):
+    """Unit tests for the reuse of Perforce connections.
+
+       These use a fake P4 module, so that they don't need a server.
+       """
+    fixtures = ['test_scmtools.json']
+
+    def setUp(self):
+        tests = self
+
+        class FakeP4Error(Exception):
+            pass
+
+        class FakeP4(object):
+            def __init__(self):
+                self.is_connected = False
+
+            def connect(self):
+                tests.num_connects += 1
+                self.is_connected = True
+
+            def disconnect(self):
+                self.is_connected = False
+
+            def connected(self):
+                return self.is_connected
+
+            def dropped(self):
+                return not self.is_connected
+
+            def run_describe(self, *args):
+                if tests.drop_connection:
+                    tests.drop_connection = False
+                    self.is_connected = False
+                    raise FakeP4Error('Connection dropped')
+
+                return [{
+                    'change': args[-1],
+                    'user': 'user',
+                    'status': 'submitted',
+                    'desc': 'Description',
+                    'depotFile': ['//depot/foo'],
+                }]
+
+            def run_print(self, *specs):
+                tests.print_calls.append(specs)
+
+                if tests.print_error:
+                    raise FakeP4Error(tests.print_error)
+
+                output = []
+
+                for spec in specs:
+                    if '#' in spec:
+                        path, rev = spec.split('#')
+                    else:
+                        path, rev = spec, '3'
+
+                    if path in tests.depot:
+                        output.append({'depotFile': path, 'rev': rev})
+                        output.extend(tests.depot[path])
+
+                return output
+
+        fake_module = imp.new_module('P4')
+        fake_module.P4 = FakeP4
+        fake_module.P4Error = FakeP4Error
+
+        self.old_module = sys.modules.get('P4')
+        self.old_p4error = getattr(perforce, 'P4Error', None)
+        sys.modules['P4'] = fake_module
+        perforce.P4Error = FakeP4Error
+
+        self.num_connects = 0
+        self.print_calls = []
+        self.drop_connection = False
+        self.print_error = None
+        self.depot = {
+            '//depot/foo': ['foo ', 'contents\n'],
+            '//depot/bar': ['bar contents\n'],
+        }
+
+        perforce.connection_pool.close_all()
+
+        self.repository = Repository(name='Perforce',
+                                     path='perforce.example.com:1666',
+                                     tool=Tool.objects.get(name='Perforce'))
+        self.tool = perforce.PerforceTool(self.repository)
+
+    def tearDown(self):
+        perforce.connection_pool.close_all()
+
+        if self.old_module:
+            sys.modules['P4'] = self.old_module
+        else:
+            del sys.modules['P4']
+
+        if self.old_p4error:
+            perforce.P4Error = self.old_p4error
+        else:
+            del perforce.P4Error
+
+    def testReuseConnection(self):
+        """Testing PerforceTool reusing connections"""
+        self.tool.get_changeset(1)
+        self.tool.get_changeset(2)
+        perforce.PerforceTool(self.repository).get_changeset(3)
+
+        self.assertEqual(self.num_connects, 1)
+
+    def testReconnect(self):
+        """Testing PerforceTool reconnecting after a dropped connection"""
+        self.tool.get_changeset(1)
+
+        self.drop_connection = True
+        changeset = self.tool.get_changeset(2)
+
+        self.assertEqual(changeset.changenum, 2)
+        self.assertEqual(self.num_connects, 2)
+
+    def testGetFiles(self):
+        """Testing PerforceTool.get_files"""
+        results = self.tool.get_files([
+            ('//depot/foo', '2'),
+            ('//depot/bar', HEAD),
+            ('//depot/new', PRE_CREATION),
+            ('//depot/missing', '1'),
+        ])
+
+        self.assertEqual(len(self.print_calls), 1)
+        self.assertEqual(self.print_calls[0],
+                         ('//depot/foo#2', '//depot/bar', '//depot/missing#1'))
+
+        self.assertEqual(results[0], ('foo contents\n', None))
+        self.assertEqual(results[1], ('bar contents\n', None))
+        self.assertEqual(results[2], ('', None))
+        self.assertEqual(results[3][0], None)
+        self.assertEqual(results[3][1][0], FileNotFoundError)
+
+        self.assertEqual(self.tool.get_file('//depot/foo', '2'),
+                         'foo contents\n')
+        self.assertRaises(FileNotFoundError,
+                          lambda: self.tool.get_file('//depot/missing', '1'))
+        self.assertEqual(self.num_connects, 1)
+
+    def testGetFilesError(self):
+        """Testing PerforceTool.get_files with a Perforce error"""
+        self.print_error = 'Access for user denied'
+
+        self.assertRaises(SCMError,
+                          lambda: self.tool.get_files([('//depot/foo', '2')]))
+        self.assertRaises(SCMError,
+                          lambda: self.tool.get_file('//depot/foo', '2'))
+
+
 class VMWareTests(DjangoTestCase):
     """Tests for VMware specific code"""
     fixtures = ['vmware.json', 'test_scmtools.json']
@@ -874,6 +1157,37 @@ class GitTests(DjangoTestCase):
         self.assert_(not self.tool.file_exists("readme", "a62df6c"))
         self.assert_(not self.tool.file_exists("readme2", "ccffbb4"))
 
+    def testFileExistsMany(self):
+        """Testing GitTool.file_exists_many"""
+        files = [
+            ("readme", "e965047"),
+            ("readme", PRE_CREATION),
+            ("readme", "fffffff"),
+            ("readme", "a62df6c"),
+            ("readme", HEAD),
+            ("readme2", HEAD),
+        ]
+
+        self.assertEqual(self.tool._file_exists_many(files, 4),
+                         [True, False, False, False, True, False])
+
+    def testGetFiles(self):
+        """Testing GitTool.get_files"""
+        results = self.tool.get_files([
+            ("readme", "e965047"),
+            ("readme", PRE_CREATION),
+            ("readme", "0000000"),
+            ("", HEAD),
+            ("readme", HEAD),
+        ])
+
+        self.assertEqual(len(results), 5)
+        self.assertEqual(results[0], ('Hello\n', None))
+        self.assertEqual(results[1], ('', None))
+        self.assertEqual(results[2][1][0], FileNotFoundError)
+        self.assertEqual(results[3][1][0], SCMError)
+        self.assertEqual(results[4], ('Hello there\n', None))
+
     def testGetFile(self):
         """Testing GitTool.get_file"""
 
@@ -891,3 +1205,205 @@ class GitTests(DjangoTestCase):
                           lambda: self.tool.get_file("hello", "0000000"))
         self.assertRaises(FileNotFoundError,
                           lambda: self.tool.get_file("readme", "0000000"))
+
+    def testGetFileNotBlob(self):
+        """Testing GitTool.get_file with a commit instead of a blob"""
+        self.assertRaises(SCMError,
+                          lambda: self.tool.get_file("readme", "a62df6c"))
+
+    def testCatFilePool(self):
+        """Testing reuse of git cat-file processes"""
+        pool = git.cat_file_pool
+        key = (self.tool.client.git_dir, '--batch')
+        pool.close_all()
+
+        self.assertEqual(self.tool.get_file("readme", "e965047"), 'Hello\n')
+        self.assertEqual(len(pool.idle[key]), 1)
+        process = pool.idle[key][0]
+
+        self.assertEqual(self.tool.get_file("readme", "d6613f5"),
+                         'Hello there\n')
+        self.assertEqual(pool.idle[key], [process])
+
+        # A process that has died should be replaced.
+        process.close()
+        self.assertEqual(self.tool.get_file("readme", "e965047"), 'Hello\n')
+        self.assertEqual(len(pool.idle[key]), 1)
+        self.assertNotEqual(pool.idle[key][0], process)
+
+        # Idle processes should be closed after a while.
+        old_timeout = pool.IDLE_TIMEOUT
+        pool.IDLE_TIMEOUT = -1
+
+        try:
+            self.tool.file_exists("readme", "e965047")
+            self.assertFalse(key in pool.idle)
+        finally:
+            pool.IDLE_TIMEOUT = old_timeout
+            pool.close_all()
+
+
+class HTTPFetchTests(DjangoTestCase):
+    """Unit tests for the shared pool of HTTP connections."""
+
+    FILES = {
+        '/raw/tip/readme': 'Hello\n',
+        '/files/a': 'File A\n',
+        '/files/b': 'File B\n',
+    }
+
+    def setUp(self):
+        test = self
+        self.connections = 0
+        self.requests = []
+        self.head_requests = []
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            # Buffer each response, so that it's sent in one go.
+            wbufsize = -1
+
+            def setup(self):
+                BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+                test.connections += 1
+
+            def do_GET(self):
+                test.requests.append(self.path)
+
+                if self.path == '/redirect':
+                    self.send_response(302)
+                    self.send_header('Location', '/files/a')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                elif (self.path == '/secret' and
+                      self.headers.get('Authorization') ==
+                      'Basic %s' % base64.b64encode('user:pass')):
+                    self.send_response(200)
+                    self.send_header('Content-Length', '7')
+                    self.end_headers()
+                    self.wfile.write('Secret\n')
+                elif self.path in test.FILES:
+                    data = test.FILES[self.path]
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                else:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+
+            def do_HEAD(self):
+                test.head_requests.append(self.path)
+
+                if self.path.startswith('/files/') and self.path in test.FILES:
+                    self.send_response(200)
+                    self.send_header('Content-Length',
+                                     str(len(test.FILES[self.path])))
+                elif self.path in test.FILES:
+                    self.send_response(405)
+                    self.send_header('Content-Length', '0')
+                else:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+        self.pool = httputils.HTTPConnectionPool()
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def testFetch(self):
+        """Testing HTTPConnectionPool.fetch reusing connections"""
+        for i in range(3):
+            self.assertEqual(self.pool.fetch(self.url + '/files/a'),
+                             'File A\n')
+            self.assertEqual(self.pool.fetch(self.url + '/files/b'),
+                             'File B\n')
+
+        self.assertEqual(self.connections, 1)
+
+    def testFetchErrors(self):
+        """Testing HTTPConnectionPool.fetch with errors"""
+        try:
+            self.pool.fetch(self.url + '/files/c')
+            self.fail('HTTPError was not raised')
+        except urllib2.HTTPError, e:
+            self.assertEqual(e.code, 404)
+
+        self.assertRaises(urllib2.HTTPError,
+                          lambda: self.pool.fetch(self.url + '/secret'))
+        self.assertEqual(self.pool.fetch(self.url + '/secret', 'user', 'pass'),
+                         'Secret\n')
+        self.assertEqual(self.connections, 1)
+
+    def testFetchRedirect(self):
+        """Testing HTTPConnectionPool.fetch following redirects"""
+        self.assertEqual(self.pool.fetch(self.url + '/redirect'), 'File A\n')
+        self.assertEqual(self.requests, ['/redirect', '/files/a'])
+
+    def testFetchIdleTimeout(self):
+        """Testing HTTPConnectionPool.fetch closing idle connections"""
+        self.pool.IDLE_TIMEOUT = -1
+        self.pool.fetch(self.url + '/files/a')
+        self.pool.fetch(self.url + '/files/b')
+        self.assertEqual(self.connections, 2)
+
+    def testHead(self):
+        """Testing HTTPConnectionPool.head"""
+        self.pool.head(self.url + '/files/a')
+        self.pool.head(self.url + '/files/b')
+
+        try:
+            self.pool.head(self.url + '/files/c')
+            self.fail('HTTPError was not raised')
+        except urllib2.HTTPError, e:
+            self.assertEqual(e.code, 404)
+
+        # Servers that don't allow HEAD requests get a GET instead.
+        self.pool.head(self.url + '/raw/tip/readme')
+
+        self.assertEqual(self.head_requests, ['/files/a', '/files/b',
+                                              '/files/c', '/raw/tip/readme'])
+        self.assertEqual(self.requests, ['/raw/tip/readme'])
+        self.assertEqual(self.connections, 1)
+
+    def testHgWebClient(self):
+        """Testing HgWebClient remembering which raw path works"""
+        old_fetch_url = hg.fetch_url
+        hg.fetch_url = self.pool.fetch
+
+        try:
+            client = hg.HgWebClient(self.url, '', '')
+            self.assertEqual(client.cat_file('readme', HEAD), 'Hello\n')
+            self.assertEqual(client.cat_file('readme', HEAD), 'Hello\n')
+            self.assertRaises(FileNotFoundError,
+                              lambda: client.cat_file('readme2', HEAD))
+        finally:
+            hg.fetch_url = old_fetch_url
+            del hg.HgWebClient.working_raw_paths[self.url]
+
+        self.assertEqual(self.requests, [
+            '/raw-file/tip/readme',
+            '/raw/tip/readme',
+            '/raw/tip/readme',
+            '/raw/tip/readme2',
+            '/raw-file/tip/readme2',
+        ])
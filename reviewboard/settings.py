@@ -43,10 +43,10 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
-    'django.middleware.gzip.GZipMiddleware', # Keep this first.
+    'reviewboard.admin.middleware.StreamingGZipMiddleware', # Keep this first.
     'django.middleware.common.CommonMiddleware',
     'django.middleware.doc.XViewMiddleware',
-    'django.middleware.http.ConditionalGetMiddleware',
+    'reviewboard.admin.middleware.StreamingConditionalGetMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -56,6 +56,7 @@ MIDDLEWARE_CLASSES = (
     'reviewboard.admin.middleware.LoadSettingsMiddleware',
 
     'djblets.log.middleware.LoggingMiddleware',
+    'reviewboard.admin.middleware.DiffTimingMiddleware',
     'reviewboard.admin.middleware.CheckUpdatesRequiredMiddleware',
     'reviewboard.admin.middleware.X509AuthMiddleware',
 )
@@ -43,3 +43,7 @@ NOTHING_TO_PUBLISH        = WebAPIError(211, "You attempted to publish a "
 EMPTY_CHANGESET           = WebAPIError(212, "The change number specified "
                                              "represents an empty changeset",
                                         http_status=400) # 400 Bad Request
+DIFF_GENERATION_ERROR     = WebAPIError(213, "There was an error generating "
+                                             "the diff",
+                                        http_status=500) # 500 Internal Server
+                                                         #     Error
@@ -8,9 +8,11 @@ from django.contrib import auth
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.core.exceptions import PermissionDenied, ObjectDoesNotExist
+from django.db import connection
 from django.db.models import Q
 from django.http import HttpResponseRedirect, HttpResponse
 from django.template.defaultfilters import timesince
+from django.utils import simplejson
 from django.utils.translation import ugettext as _
 from djblets.siteconfig.models import SiteConfiguration
 from djblets.util.http import get_http_requested_mimetype, \
@@ -30,7 +32,8 @@ from djblets.webapi.resources import WebAPIResource as DjbletsWebAPIResource, \
 
 from reviewboard import get_version_string, get_package_version, is_release
 from reviewboard.accounts.models import Profile
-from reviewboard.diffviewer.diffutils import get_diff_files
+from reviewboard.diffviewer.diffutils import UserVisibleError, \
+                                             get_diff_files
 from reviewboard.diffviewer.forms import EmptyDiffError
 from reviewboard.reviews.errors import PermissionError
 from reviewboard.reviews.forms import UploadDiffForm, UploadScreenshotForm
@@ -44,6 +47,7 @@ from reviewboard.scmtools.errors import ChangeNumberInUseError, \
                                         InvalidChangeNumberError
 from reviewboard.webapi.decorators import webapi_check_login_required
 from reviewboard.webapi.errors import CHANGE_NUMBER_IN_USE, \
+                                      DIFF_GENERATION_ERROR, \
                                       EMPTY_CHANGESET, \
                                       INVALID_CHANGE_NUMBER, \
                                       INVALID_REPOSITORY, \
@@ -469,8 +473,18 @@ class FileDiffResource(WebAPIResource):
 
         highlighting = request.GET.get('syntax-highlighting', False)
 
+        # XXX: Kind of a hack.
+        api_format = mimetype.split('+')[-1]
+
+        # Chunks that haven't been generated yet are streamed as they're
+        # generated. We only know how to do this for JSON.
+        siteconfig = SiteConfiguration.objects.get_current()
+        stream_chunks = (api_format == 'json' and
+                         siteconfig.get('diffviewer_stream_fragments'))
+
         files = get_diff_files(filediff.diffset, filediff,
-                               enable_syntax_highlighting=highlighting)
+                               enable_syntax_highlighting=highlighting,
+                               stream_chunks=stream_chunks)
 
         if not files:
             # This may not be the right error here.
@@ -479,25 +493,79 @@ class FileDiffResource(WebAPIResource):
         assert len(files) == 1
         f = files[0]
 
-        payload = {
-            'diff_data': {
-                'binary': f['binary'],
-                'chunks': f['chunks'],
-                'num_changes': f['num_changes'],
-                'whitespace_only': f['whitespace_only'],
-                'changed_chunk_indexes': f['changed_chunk_indexes'],
-                'new_file': f['newfile'],
+        if f.get('streaming', False):
+            resp = HttpResponse(self._stream_diff_data(f), mimetype=mimetype)
+            resp.streaming = True
+        else:
+            payload = {
+                'diff_data': {
+                    'binary': f['binary'],
+                    # Cached chunks decode their lines lazily, and need to
+                    # be turned into lists to be serialized.
+                    'chunks': [dict(chunk, lines=list(chunk['lines']))
+                               for chunk in f['chunks']],
+                    'num_changes': f['num_changes'],
+                    'whitespace_only': f['whitespace_only'],
+                    'changed_chunk_indexes': f['changed_chunk_indexes'],
+                    'new_file': f['newfile'],
+                }
             }
-        }
 
-        # XXX: Kind of a hack.
-        api_format = mimetype.split('+')[-1]
+            resp = WebAPIResponse(request, payload, api_format=api_format)
 
-        resp = WebAPIResponse(request, payload, api_format=api_format)
         set_last_modified(resp, filediff.diffset.timestamp)
 
         return resp
 
+    def _stream_diff_data(self, f):
+        """Generates a JSON diff data payload as the chunks are generated.
+
+        This produces the same payload as the non-streaming version. The
+        fields that depend on the chunks are sent after all the chunks, and
+        "stat" is sent last, since it isn't known until then.
+
+        If generating the chunks fails partway through, the diff data is
+        closed off after the chunks sent so far, and "stat" is "fail" with
+        an "err" object, as in any other API error. Clients can't rely on
+        the HTTP status, which has already been sent.
+        """
+        yield '{"diff_data": {"binary": %s, "new_file": %s, "chunks": [' % (
+            simplejson.dumps(f['binary']),
+            simplejson.dumps(f['newfile']))
+
+        try:
+            for i, chunk in enumerate(f['chunks']):
+                if i > 0:
+                    yield ', '
+
+                yield simplejson.dumps(chunk)
+
+            yield '], "num_changes": %s, "whitespace_only": %s, ' \
+                  '"changed_chunk_indexes": %s}, "stat": "ok"}' % (
+                      simplejson.dumps(f['num_changes']),
+                      simplejson.dumps(f['whitespace_only']),
+                      simplejson.dumps(f['changed_chunk_indexes']))
+        except Exception, e:
+            logging.error("Error streaming diff data for filediff %s: %s",
+                          f['filediff'].id, e, exc_info=1)
+
+            # Only errors meant for users are shown. Anything else may
+            # contain details of the server, and is only logged.
+            if isinstance(e, UserVisibleError):
+                msg = unicode(e)
+            else:
+                msg = DIFF_GENERATION_ERROR.msg
+
+            yield ']}, "stat": "fail", "err": %s}' % \
+                simplejson.dumps({
+                    'code': DIFF_GENERATION_ERROR.code,
+                    'msg': msg,
+                })
+
+        # This runs after the request has finished, so don't leave open any
+        # database connection that was needed to generate the chunks.
+        connection.close()
+
 filediff_resource = FileDiffResource()
 
 
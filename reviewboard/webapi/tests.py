@@ -11,13 +11,16 @@ from djblets.webapi.errors import DOES_NOT_EXIST, INVALID_ATTRIBUTE, \
                                   INVALID_FORM_DATA, PERMISSION_DENIED
 
 from reviewboard import initialize
+from reviewboard.diffviewer.diffutils import UserVisibleError
 from reviewboard.diffviewer.models import DiffSet
 from reviewboard.notifications.tests import EmailTestHelper
 from reviewboard.reviews.models import Group, ReviewRequest, \
                                        ReviewRequestDraft, Review, \
                                        Comment, Screenshot, ScreenshotComment
 from reviewboard.scmtools.models import Repository, Tool
-from reviewboard.webapi.errors import INVALID_REPOSITORY
+from reviewboard.webapi.errors import DIFF_GENERATION_ERROR, \
+                                      INVALID_REPOSITORY
+from reviewboard.webapi.resources import filediff_resource
 
 
 class BaseWebAPITestCase(TestCase, EmailTestHelper):
@@ -3111,3 +3114,62 @@ class DeprecatedWebAPITests(TestCase, EmailTestHelper):
     def __getTrophyFilename(self):
         return os.path.join(settings.HTDOCS_ROOT,
                             "media", "rb", "images", "trophy.png")
+
+
+class StreamDiffDataTests(TestCase):
+    """Unit tests for streaming diff data."""
+
+    def _stream(self, chunks):
+        class FakeFileDiff(object):
+            id = 1
+
+        f = {
+            'filediff': FakeFileDiff(),
+            'binary': False,
+            'newfile': False,
+            'chunks': chunks,
+            'num_changes': 1,
+            'whitespace_only': False,
+            'changed_chunk_indexes': [1],
+        }
+
+        return simplejson.loads(
+            ''.join(filediff_resource._stream_diff_data(f)))
+
+    def test_stream_diff_data(self):
+        """Testing streaming diff data"""
+        chunks = [
+            {'change': 'equal', 'lines': []},
+            {'change': 'insert', 'lines': []},
+        ]
+        rsp = self._stream(iter(chunks))
+
+        self.assertEqual(rsp['stat'], 'ok')
+        self.assertEqual(rsp['diff_data']['chunks'], chunks)
+        self.assertEqual(rsp['diff_data']['changed_chunk_indexes'], [1])
+
+    def test_stream_diff_data_with_error(self):
+        """Testing streaming diff data with an error partway through"""
+        def generate_chunks():
+            yield {'change': 'equal', 'lines': []}
+            raise ValueError('Oops')
+
+        rsp = self._stream(generate_chunks())
+
+        self.assertEqual(rsp['stat'], 'fail')
+        self.assertEqual(rsp['err']['code'], DIFF_GENERATION_ERROR.code)
+        self.assertEqual(rsp['err']['msg'], DIFF_GENERATION_ERROR.msg)
+        self.assertEqual(len(rsp['diff_data']['chunks']), 1)
+        self.assertFalse('num_changes' in rsp['diff_data'])
+
+    def test_stream_diff_data_with_user_visible_error(self):
+        """Testing streaming diff data with a UserVisibleError"""
+        def generate_chunks():
+            raise UserVisibleError('The file could not be found')
+            yield
+
+        rsp = self._stream(generate_chunks())
+
+        self.assertEqual(rsp['stat'], 'fail')
+        self.assertEqual(rsp['err']['msg'], 'The file could not be found')
+        self.assertEqual(rsp['diff_data']['chunks'], [])